@@ -1,13 +1,32 @@
-from langchain_community.chat_models import ChatOllama
+import asyncio
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import ChatPromptTemplate
+from llm_cache import enable_llm_cache
+from ollama_client import OllamaChatClient, PooledChatOllama
+from prompt_registry import get_prompt
 
-# Instantiate LLM and prompt
-llm = ChatOllama(model="llama3")
-prompt = ChatPromptTemplate.from_template("Tell me a short joke about a {job} going to {place}")
+# Cache the responses on disk, so reruns do not call the model again
+llm_cache = enable_llm_cache()
 
-# LangChain Expressive Language chain syntax
-chain = prompt | llm | StrOutputParser()
+# Instantiate prompt
+prompt = get_prompt('joke')
 
-# Print output
-print(chain.invoke({'job': 'chef', 'place': 'France'}))
+inputs = [{'job': 'chef', 'place': 'France'},
+          {'job': 'pilot', 'place': 'Spain'},
+          {'job': 'teacher', 'place': 'Italy'}]
+
+
+async def main():
+    # One pooled client, at most 4 requests to Ollama at the same time
+    async with OllamaChatClient(max_concurrency=4) as client:
+        llm = PooledChatOllama(model="llama3", client=client)
+
+        # LangChain Expressive Language chain syntax
+        chain = prompt | llm | StrOutputParser()
+
+        # Print output, the jokes are generated concurrently
+        for joke in await chain.abatch(inputs):
+            print(joke)
+        print(client.summary())
+
+asyncio.run(main())
+print(llm_cache.stats())
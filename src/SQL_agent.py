@@ -3,14 +3,15 @@ import openai
 from dotenv import load_dotenv
 from langchain_community.agent_toolkits import create_sql_agent
 from langchain_openai import ChatOpenAI
-from langchain_community.utilities.sql_database import SQLDatabase
+from sql_toolkit import GuardedSQLDatabase
 
 # Load the .env file
 load_dotenv()
 openai.api_key = os.environ["OPENAI_API_KEY"]
 
-# Initialize database
-db = SQLDatabase.from_uri("sqlite:///Chinook.db")
+# Initialize database: read-only connection pool, schema computed once and query results cached. Queries are
+# checked with EXPLAIN QUERY PLAN, full scans get a LIMIT, and results are capped at 100 rows and 2000 tokens
+db = GuardedSQLDatabase.from_sqlite("Chinook.db", max_rows=100, max_result_tokens=2000)
 
 # Initialize LLM and agent
 llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0)
@@ -20,3 +21,6 @@ agent_executor = create_sql_agent(llm, db=db, agent_type="openai-tools", verbose
 agent_executor.invoke(
     "Which tables are there in the data?"
 )
+
+# Cache counters and database time of the agent run
+print(db.stats())
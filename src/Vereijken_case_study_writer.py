@@ -1,144 +1,179 @@
 import os
+import re
+import json
+import asyncio
 import openai
 from dotenv import load_dotenv
-from langchain_community.vectorstores import FAISS
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import RunnableParallel, RunnablePassthrough
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain_openai import ChatOpenAI
+from context_packing import ContextPacker
+from embedding_cache import load_embeddings
+from llm_cache import enable_llm_cache
+from prompt_registry import get_prompt
+from retrieval import MemoizedRetriever, embed_queries, load_vector_store
 
 
 # Load the environment
 load_dotenv()
 openai.api_key = os.environ["OPENAI_API_KEY"]
 
-# Load Vereijken vector store
-vector_store = FAISS.load_local('../vector_stores/vereijken.faiss', OpenAIEmbeddings(),
-                                allow_dangerous_deserialization=True)
+# Embeddings with an on-disk cache, so repeated queries are not embedded again. Use the same backend
+# ('openai' or 'local') as Vereijken_vector_store.py
+embeddings = load_embeddings('openai')
 
-# Create retriever
-retriever = vector_store.as_retriever(search_type='mmr',
-                                      search_kwargs={'k': 4})
+# Load Vereijken vector store, once per process
+vector_store = load_vector_store('../vector_stores/vereijken.faiss', embeddings)
+
+# Create retriever, results are memoized per query
+retriever = MemoizedRetriever(vectorstore=vector_store, search_type='mmr',
+                              search_kwargs={'k': 4})
 
-# Load Example vector store
-example_vector_store = FAISS.load_local('../vector_stores/vereijken.faiss', OpenAIEmbeddings(),
-                                        allow_dangerous_deserialization=True)
+# Load Example vector store, which returns the already loaded store when the path is the same
+example_vector_store = load_vector_store('../vector_stores/vereijken.faiss', embeddings)
 
 # Create retriever
-example_retriever = example_vector_store.as_retriever(search_type='mmr',
-                                                      search_kwargs={'k': 1})
+example_retriever = MemoizedRetriever(vectorstore=example_vector_store, search_type='mmr',
+                                      search_kwargs={'k': 1})
+
+# Cache the responses on disk, so rewriting the same case study does not call the model again
+llm_cache = enable_llm_cache()
 
 # Create the model
 model = ChatOpenAI(model="gpt-4o")
 
-# Build a prompt template
-template = """
-You are an expert copy writer that writes sections of a case study for a professional website of a data
-consultancy firm (Bright Cape). The case studies highlight specific data science / engineering / visualization 
-applications that have been developed for a client. You will receive an exact instruction, an example and information 
-about the client company and application to guide you. Do as the instruction states and make extensive use of the 
-example and additional information. Do not write more than indicated in the instruction. Avoid repetition and keep the 
-sections relatively concise and short.
-
-Instruction:
-{instruction}
-
-Keep the tone professional but approachable and not too dry. Give enough detail to show that Bright Cape employs 
-competent specialists, but not so much that a PhD is needed to understand. Stay very close to the format shown in the 
-example. Do not explain what type of company Bright Cape is, only focus on the client company and the application. 
-Only write things relevant to the current section. For example, when asked to write a client profile, only write a 
-client profile; do not go into the challenges or model.
-
-Let's think step by step.
-
-Here is an example to guide you:
-{example}
-
-Use the following information about the company and application:
-{context}
-"""
-
-prompt = ChatPromptTemplate.from_template(template)
+# Load the prompt template
+prompt = get_prompt('case-study-section')
 output_parser = StrOutputParser()
 
+# Pack the retrieved chunks into clean text within a token budget, instead of the repr of the Documents
+context_packer = ContextPacker(max_tokens=3000, model=model.model_name)
+example_packer = ContextPacker(max_tokens=1500, model=model.model_name)
+
 setup_and_retrieval = RunnableParallel(
-    {"context": retriever, "example": example_retriever, "instruction": RunnablePassthrough()}
+    {"context": retriever | context_packer.pack, "example": example_retriever | example_packer.pack,
+     "instruction": RunnablePassthrough()}
 )
 
-# Define company
-company_name = "Vereijken Kwekerijen"
-
-# Instructions
-instructions = [
-    f"Write a client profile for {company_name} of no more than a few sentences, "
-    f"explaining what industry they are in, what they do, and what their vision is",
-    f"Write a section explaining the unique challenges and problems that {company_name} was facing of 1-2 paragraphs",
-    f"Write a section explaining Bright Cape's approach to solve the problems {company_name} was facing of 2-3 paragraphs, "
-    f"explain what type of model was used and why",
-    f"Write a section explaining the results and the impact that the solution has had for {company_name} of 1-2 paragraphs. "
-    f"Use numbers to quantify the impact, such as a percentage reduction in cost"
- ]
-
 # Set up section writing chain with LCEL
 section_writing_chain = setup_and_retrieval | prompt | model | output_parser
 
-# Create an empty list for written sections
-written_sections = []
-
-# Iteratively call the LLM to the sections
-for instruction in instructions:
-    response = section_writing_chain.invoke(instruction)
-    written_sections.append(response)
-
-# View the written sections
-print(written_sections)
-
-# Define the final template
-final_template = """
-You are an expert copy writer that writes a full case study from separate sections for a data consultancy firm.
-There are four sections in total, which are provided below in the correct order. Do not alter the content of 
-the sections too much, as they are already correct. You are only allowed to delete or rewrite a sentence here and there.
- Your aim is to create a cohesive whole out of the separate sections, with a focus in particular on a natural,
- smooth transition from one section to the next. However, the sections should remain separated: keep the headers in 
- between the sections. Keep the tone professional but approachable and not too dry. Avoid repetition and keep the 
- sections relatively concise.
-
-Please find the four sections below:
-
-### Section 1: Client Profile
-{section1}
-
-### Section 2: Unique Challenges and Problems
-{section2}
-
-### Section 3: Bright Cape's Approach
-{section3}
-
-### Section 4: Results and Impact
-{section4}
-
-Also write a good consulting title for the piece. Here are some examples of good titles:
-- An AI power play: Fueling the next wave of innovation in the energy sector
-- From farm to tablet: Building a new business to solve an old challenge
-- Building a next-generation carbon platform to accelerate the path to net zero
-- Banking on innovation: How ING uses generative AI to put people first
-"""
-
-final_prompt = ChatPromptTemplate.from_template(final_template)
+# Load the final template
+final_prompt = get_prompt('case-study-merge')
 
 # LangChain Expressive Language chain syntax
 chain = final_prompt | model | output_parser
 
-# Print output
-full_case_study = chain.invoke({'section1': written_sections[0],
-                                'section2': written_sections[1],
-                                'section3': written_sections[2],
-                                'section4': written_sections[3]})
-
-print(full_case_study)
-
-# Save the string 'full_case_study' to a .txt file
-with open('../results/full_case_study_4o_1.txt', 'w') as f:
-    f.write(full_case_study)
+# Define company
+company_name = "Vereijken Kwekerijen"
 
-print("\nThe full case study was successfully saved")
+# Optional JSON file with a list of company names to write case studies for concurrently
+jobs_file = None
+
+# Maximum number of concurrent LLM calls
+max_concurrency = 4
+
+
+def get_instructions(company_name):
+    """
+    Instructions for the four sections of a case study.
+    company_name: Name of the client company
+    """
+    return [
+        f"Write a client profile for {company_name} of no more than a few sentences, "
+        f"explaining what industry they are in, what they do, and what their vision is",
+        f"Write a section explaining the unique challenges and problems that {company_name} was facing of 1-2 paragraphs",
+        f"Write a section explaining Bright Cape's approach to solve the problems {company_name} was facing of 2-3 paragraphs, "
+        f"explain what type of model was used and why",
+        f"Write a section explaining the results and the impact that the solution has had for {company_name} of 1-2 paragraphs. "
+        f"Use numbers to quantify the impact, such as a percentage reduction in cost"
+    ]
+
+
+def merge_inputs(written_sections):
+    """
+    Input of the final chain from the four written sections.
+    written_sections: List of the four sections in order
+    """
+    return {'section1': written_sections[0],
+            'section2': written_sections[1],
+            'section3': written_sections[2],
+            'section4': written_sections[3]}
+
+
+def write_case_study(company_name, max_concurrency=4):
+    """
+    Write the sections of a case study concurrently and merge them into the full case study.
+    company_name: Name of the client company
+    max_concurrency: Maximum number of sections written at the same time
+    """
+    instructions = get_instructions(company_name)
+
+    # Embed the queries of all sections in one call, both retrievers reuse them
+    embed_queries(embeddings, instructions)
+
+    written_sections = section_writing_chain.batch(instructions, {"max_concurrency": max_concurrency})
+    return written_sections, chain.invoke(merge_inputs(written_sections))
+
+
+async def awrite_case_study(company_name, semaphore):
+    """
+    Asynchronously write a full case study, all four sections at once followed by the merge step.
+    company_name: Name of the client company
+    semaphore: asyncio.Semaphore that limits the number of concurrent LLM calls
+    """
+    async def limited(runnable, value):
+        async with semaphore:
+            return await runnable.ainvoke(value)
+
+    written_sections = await asyncio.gather(*[limited(section_writing_chain, instruction)
+                                              for instruction in get_instructions(company_name)])
+    return written_sections, await limited(chain, merge_inputs(written_sections))
+
+
+async def awrite_case_studies(company_names, max_concurrency=4):
+    """
+    Write case studies for many companies concurrently, sharing one limit on the number of LLM calls.
+    company_names: List of client company names
+    max_concurrency: Maximum number of concurrent LLM calls over all case studies
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    # Embed the queries of all sections of all case studies in one call
+    await asyncio.to_thread(embed_queries, embeddings,
+                            [instruction for name in company_names for instruction in get_instructions(name)])
+
+    return await asyncio.gather(*[awrite_case_study(name, semaphore) for name in company_names])
+
+
+if jobs_file is None:
+    # Write the sections concurrently, then merge them
+    written_sections, full_case_study = write_case_study(company_name, max_concurrency)
+
+    # View the written sections
+    print(written_sections)
+
+    # Print output
+    print(full_case_study)
+
+    # Save the string 'full_case_study' to a .txt file
+    with open('../results/full_case_study_4o_1.txt', 'w') as f:
+        f.write(full_case_study)
+
+    print("\nThe full case study was successfully saved")
+else:
+    # Write a case study for every company in the job file
+    with open(jobs_file, 'r', encoding='utf-8') as f:
+        company_names = json.load(f)
+
+    results = asyncio.run(awrite_case_studies(company_names, max_concurrency))
+
+    for name, (written_sections, full_case_study) in zip(company_names, results):
+        filename = re.sub(r'[^a-z0-9]+', '_', name.lower()).strip('_')
+        with open(f'../results/full_case_study_{filename}.txt', 'w') as f:
+            f.write(full_case_study)
+        print(f"The case study for {name} was successfully saved")
+
+print(llm_cache.stats())
+print(context_packer.stats)
+print(example_packer.stats)
@@ -1,65 +1,43 @@
 import os
 import glob
+import shutil
 import openai
 from dotenv import load_dotenv
 from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
 from langchain_community.document_loaders import SeleniumURLLoader
-from langchain_community.document_loaders import UnstructuredPDFLoader, UnstructuredPowerPointLoader
+from ingestion import clean_text, is_supported, update_vector_store
+from embedding_cache import load_embeddings
+from mmap_store import save_mmap_store
+from index_factory import convert_vector_store
 
 # Load the environment
 load_dotenv()
 openai.api_key = os.environ["OPENAI_API_KEY"]
 
-# Initialize pages
-pages = []
+# Only embed what changed since the previous run, set to False to rebuild the vector store from scratch
+incremental = True
 
-# Define the directory
-directory = 'Vereijken_input'
+# Number of processes that parse the files, None uses all CPUs
+max_workers = None
+
+# Number of new chunks embedded per call
+batch_size = 256
 
-# Loop over all files in the directory
-for filename in glob.glob(os.path.join(directory, '*')):
-    # Check the file extension
-    if filename.endswith('.pdf'):
-        loader = UnstructuredPDFLoader(filename)
-        print(f"Processing: {filename}")
-    elif filename.endswith('.pptx'):
-        loader = UnstructuredPowerPointLoader(filename)
-        print(f"Processing: {filename}")
-    else:
-        continue  # Skip files with other extensions
+# Index used for retrieval: 'flat' (exact), 'ivf_flat', 'hnsw' or 'ivf_pq' (approximate, ~16x less memory)
+index_type = 'flat'
 
-    # Load and split the file, then add to pages
-    pages += loader.load_and_split()
+# Embedding backend: 'openai' or 'local' (CPU), retrieval scripts must use the same backend as the builder
+embedding_backend = 'openai'
 
-print(f"Length of pages: {len(pages)}")
+# Define the directory and the vector store
+directory = 'Vereijken_input'
+store_path = 'vector_stores/vereijken.faiss'
 
 # Add the website
 urls = [
     "https://vereijkenkwekerijen.nl/?lang=en",
 ]
 
-# collect data using selenium url loader
-loader = SeleniumURLLoader(urls=urls)
-pages += loader.load_and_split()
-
-print(f"Length of pages after URL loader: {len(pages)}")
-
-# Light preprocessing
-for page in pages:
-    page.page_content = str(page.page_content).replace("\\n", " ")\
-                                              .replace("\\t", " ")\
-                                              .replace("\n", " ")\
-                                              .replace("\t", " ")
-
-print(f"Length of pages after preprocessing: {len(pages)}")
-
-# Create the vectorstore
-vectorstore = FAISS.from_documents(pages, OpenAIEmbeddings())
-
-# Save the vectorstore
-vectorstore.save_local('vector_stores/vereijken.faiss')
-
 # Sections of example case study
 sections = [
 """
@@ -123,15 +101,51 @@ reduced 15-min intra-day baseline forecasting error
 """
 ]
 
-# Light preprocessing
-for i in range(len(sections)):
-    sections[i] = sections[i].replace("\\n", " ") \
-                             .replace("\\t", " ") \
-                             .replace("\n", " ") \
-                             .replace("\t", " ") \
 
-# Example vector store
-example_vector_store = FAISS.from_texts(sections, OpenAIEmbeddings())
+# Files are parsed in worker processes, which import this script again on some platforms
+if __name__ == "__main__":
+    # Embeddings with an on-disk cache, so unchanged chunks are never embedded twice
+    embeddings = load_embeddings(embedding_backend)
+
+    # Collect all PDF and PowerPoint files in the directory
+    files = [filename for filename in sorted(glob.glob(os.path.join(directory, '*'))) if is_supported(filename)]
+
+    print(f"Number of files: {len(files)}")
+
+    # collect data using selenium url loader
+    loader = SeleniumURLLoader(urls=urls)
+    url_pages = loader.load_and_split()
+
+    # Light preprocessing
+    for page in url_pages:
+        page.page_content = clean_text(page.page_content)
+
+    print(f"Length of pages from URL loader: {len(url_pages)}")
+
+    # Start from an empty vector store when not running incrementally
+    if not incremental and os.path.exists(store_path):
+        shutil.rmtree(store_path)
+
+    # Update the vectorstore, only new chunks are embedded (in batches) and it is saved together with its manifest
+    vectorstore = update_vector_store(store_path, files, embeddings,
+                                      documents={url: [page for page in url_pages
+                                                       if page.metadata.get('source') == url] for url in urls},
+                                      max_workers=max_workers, batch_size=batch_size)
+
+    # Also save it in the memory-mapped format with the chosen index, which the retrieval scripts load
+    # without unpickling. The flat index stays the one that is updated incrementally
+    if vectorstore is not None:
+        save_mmap_store(convert_vector_store(vectorstore, index_type), store_path)
+
+    # Light preprocessing
+    for i in range(len(sections)):
+        sections[i] = clean_text(sections[i])
+
+    # Example vector store
+    example_vector_store = FAISS.from_texts(sections, embeddings)
+
+    # Save the vectorstore
+    example_vector_store.save_local('../vector_stores/covolt_case_study_example.faiss')
+    save_mmap_store(example_vector_store, '../vector_stores/covolt_case_study_example.faiss')
 
-# Save the vectorstore
-example_vector_store.save_local('../vector_stores/covolt_case_study_example.faiss')
+    print(f"Embedding cache: {embeddings.stats()}")
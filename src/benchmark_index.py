@@ -0,0 +1,73 @@
+import time
+import faiss
+import numpy as np
+from index_factory import INDEX_TYPES, build_index
+
+# Synthetic corpus: clustered, normalized vectors resemble sentence embeddings better than uniform noise
+n_vectors = 20_000
+n_queries = 1_000
+dimension = 384
+n_clusters = 200
+k = 10
+
+# HNSW search depths tried in order, the first one that reaches the target recall is reported
+ef_search_values = (16, 32, 64, 128, 256, 512, 1024)
+target_recall = 0.95
+
+# Training the PQ codebooks takes minutes on a small machine
+benchmark_ivf_pq = False
+
+
+def generate_embeddings(n, d, n_clusters, seed=0):
+    """
+    Generate normalized vectors around random cluster centres.
+    n: Number of vectors
+    d: Dimension of the vectors
+    n_clusters: Number of clusters
+    seed: Seed of the random generator
+    """
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((n_clusters, d)).astype(np.float32)
+    vectors = centres[rng.integers(0, n_clusters, n)] + 0.5 * rng.standard_normal((n, d)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def recall_at_k(found, truth):
+    """
+    Fraction of the true k nearest neighbours that were found, averaged over the queries.
+    found: Array of shape (n_queries, k) with the ids returned by the index
+    truth: Array of shape (n_queries, k) with the exact nearest neighbours
+    """
+    return np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)])
+
+
+# Queries are held out from the same draw, so they come from the same clusters as the corpus
+vectors = generate_embeddings(n_vectors + n_queries, dimension, n_clusters)
+vectors, queries = vectors[:n_vectors], vectors[n_vectors:]
+
+results = {}
+for index_type in INDEX_TYPES:
+    if index_type == 'ivf_pq' and not benchmark_ivf_pq:
+        continue
+    start_time = time.time()
+    index = build_index(vectors, index_type)
+    build_time = time.time() - start_time
+    bytes_per_vector = faiss.serialize_index(index).size / n_vectors
+
+    for ef_search in ef_search_values if index_type == 'hnsw' else [None]:
+        if ef_search is not None:
+            index.hnsw.efSearch = ef_search
+        start_time = time.time()
+        _, ids = index.search(queries, k)
+        search_time = time.time() - start_time
+
+        results[index_type] = ids
+        recall = recall_at_k(ids, results['flat'])
+        setting = f" (ef_search {ef_search})" if ef_search is not None else ""
+        print(f"{index_type:>8}{setting}: recall@{k} {recall:.3f}, "
+              f"QPS {n_queries / search_time:,.0f}, "
+              f"{1000 * search_time / n_queries:.2f} ms/query, "
+              f"{bytes_per_vector:,.0f} bytes/vector, "
+              f"build {build_time:.1f} s")
+        if recall >= target_recall:
+            break
@@ -0,0 +1,81 @@
+import time
+import random
+import numpy as np
+from local_embeddings import LocalEmbeddings
+from zero_shot_classifier import LabelIndex, ZeroShotClassifier
+
+# Accuracy versus speed of cascaded zero-shot classification, to choose the number of labels (top_n) that go
+# through the NLI model. None is the full NLI model on all labels.
+model_name = 'MoritzLaurer/mDeBERTa-v3-base-mnli-xnli'
+embedding_model_name = 'paraphrase-multilingual-MiniLM-L12-v2'
+n_emails = 50
+top_ns = [None, 50, 20, 10, 5]
+
+# Labelled set: every label is an intent about a product, the emails paraphrase one of the intents
+intents = {'question about the delivery date of': ["When will my {} be delivered?",
+                                                   "I am still waiting for the {} I ordered, when does it arrive?"],
+           'complaint about a damaged': ["The {} I received is broken.",
+                                         "My {} arrived with a big scratch and a dent."],
+           'request to return': ["I would like to send the {} back.",
+                                 "How can I return the {}? It is not what I expected."],
+           'question about the price of': ["How much does the {} cost?",
+                                           "Is there a discount on the {} this week?"],
+           'request for an invoice for': ["Could you send me the invoice of the {}?",
+                                          "I need a receipt for the {} for my administration."],
+           'question about the warranty of': ["Is the {} still under warranty?",
+                                              "How long is the guarantee on the {}?"],
+           'request to cancel the order of': ["Please cancel my order of the {}.",
+                                              "I changed my mind, I no longer want the {}."],
+           'question about the availability of': ["Is the {} in stock?",
+                                                  "When will the {} be available again?"],
+           'request to change the delivery address of': ["Please deliver the {} to Kerkstraat 12 instead.",
+                                                         "I moved, can the {} go to my new address?"],
+           'question about the installation of': ["How do I set up the {}?",
+                                                  "Can your technician install the {} for me?"]}
+products = ['laptop', 'bicycle', 'sofa', 'washing machine', 'smartphone', 'dining table', 'television',
+            'coffee machine', 'mattress', 'lawn mower', 'printer', 'vacuum cleaner', 'desk chair', 'fridge',
+            'electric heater', 'headphones', 'camera', 'bookcase', 'dishwasher', 'tent']
+labels = [f'{intent} a {product}' for intent in intents for product in products]
+
+
+def generate_emails(n, seed=0):
+    """
+    Generate support emails with the label they belong to.
+    n: Number of emails
+    seed: Seed of the random generator
+    """
+    rng = random.Random(seed)
+    emails = []
+    targets = []
+    for i in range(n):
+        intent = rng.choice(list(intents))
+        product = rng.choice(products)
+        emails.append(f"Subject: Order {rng.randint(100000, 999999)}\n\nDear sir/madam,\n\n"
+                      f"{rng.choice(intents[intent]).format(product)}\n\nKind regards,\n\nCustomer {i}")
+        targets.append(f'{intent} a {product}')
+    return emails, targets
+
+
+if __name__ == "__main__":
+    emails, targets = generate_emails(n_emails)
+    classifier = ZeroShotClassifier(model_name)
+
+    start_time = time.perf_counter()
+    label_index = LabelIndex(labels, LocalEmbeddings(embedding_model_name))
+    print(f"{len(labels)} labels, label index built in {time.perf_counter() - start_time:.1f} s")
+
+    # Warm up, the first call includes one-off allocations
+    classifier.classify_cascade(emails[:1], label_index, top_n=5)
+
+    for top_n in top_ns:
+        start_time = time.perf_counter()
+        if top_n is None:
+            outputs = classifier.classify(emails, labels)
+        else:
+            outputs = classifier.classify_cascade(emails, label_index, top_n)
+        elapsed = time.perf_counter() - start_time
+
+        accuracy = np.mean([output['labels'][0] == target for output, target in zip(outputs, targets)])
+        recall = np.mean([target in output['labels'] for output, target in zip(outputs, targets)])
+        print(f"top_n {top_n or len(labels):>4}: accuracy {accuracy:.3f}, pre-filter recall {recall:.3f}, "
+              f"{len(emails) / elapsed:.1f} emails/sec")
@@ -0,0 +1,52 @@
+import os
+import time
+import random
+import tempfile
+import numpy as np
+from langchain_core.documents import Document
+from lexical_index import LexicalIndex
+
+# Benchmark settings: a synthetic corpus of meeting notes with a Zipf-like vocabulary
+corpus_sizes = [1_000, 10_000, 50_000]
+words_per_chunk = 150
+n_queries = 500
+
+rng = np.random.default_rng(0)
+vocabulary = [f"woord{i}" for i in range(20_000)]
+weights = 1 / np.arange(1, len(vocabulary) + 1)
+weights /= weights.sum()
+
+
+def make_chunk(i):
+    words = rng.choice(vocabulary, size=words_per_chunk, p=weights)
+    return Document(page_content=f"Notulen {i} ordernummer {100000 + i} " + ' '.join(words),
+                    metadata={'source': f'notulen_{i // 20}.pdf'})
+
+
+if __name__ == "__main__":
+    random.seed(0)
+    for corpus_size in corpus_sizes:
+        chunks = [(f'chunk-{i}', make_chunk(i)) for i in range(corpus_size)]
+        with tempfile.TemporaryDirectory() as directory:
+            index = LexicalIndex(os.path.join(directory, 'lexical.sqlite'))
+            start_time = time.perf_counter()
+            index.add(chunks)
+            build_time = time.perf_counter() - start_time
+
+            # Incremental update: replace 1% of the chunks
+            replaced = random.sample(range(corpus_size), corpus_size // 100)
+            start_time = time.perf_counter()
+            index.delete([f'chunk-{i}' for i in replaced])
+            index.add((f'chunk-{i}-new', make_chunk(i)) for i in replaced)
+            update_time = time.perf_counter() - start_time
+
+            queries = [f"ordernummer {100000 + random.randrange(corpus_size)} " +
+                       ' '.join(random.choices(vocabulary[:2000], k=3)) for _ in range(n_queries)]
+            latencies = []
+            for query in queries:
+                start_time = time.perf_counter()
+                index.similarity_search_with_score(query, k=5)
+                latencies.append(time.perf_counter() - start_time)
+            print(f"{corpus_size} chunks: build {build_time:.2f} s, update 1% {update_time:.2f} s, "
+                  f"index {os.path.getsize(index.path) / 1e6:.1f} MB, query mean {np.mean(latencies) * 1e3:.3f} ms "
+                  f"p95 {np.percentile(latencies, 95) * 1e3:.3f} ms")
@@ -0,0 +1,37 @@
+import time
+import numpy as np
+from langchain_community.vectorstores.utils import maximal_marginal_relevance as langchain_mmr
+from mmr import batch_maximal_marginal_relevance, maximal_marginal_relevance
+
+# Benchmark settings: OpenAI sized embeddings, the k of lean_RAG.py
+dimension = 1536
+k = 5
+n_queries = 200
+fetch_ks = [20, 50, 100, 200, 500]
+
+rng = np.random.default_rng(0)
+
+for fetch_k in fetch_ks:
+    queries = rng.standard_normal((n_queries, dimension)).astype(np.float32)
+    candidates = rng.standard_normal((n_queries, fetch_k, dimension)).astype(np.float32)
+
+    # Stock langchain implementation, one query at a time
+    start_time = time.perf_counter()
+    expected = [langchain_mmr(query.reshape(1, -1), list(c), k=k) for query, c in zip(queries, candidates)]
+    stock_time = (time.perf_counter() - start_time) / n_queries
+
+    # Vectorized implementation, one query at a time
+    start_time = time.perf_counter()
+    single = [maximal_marginal_relevance(query, c, k=k) for query, c in zip(queries, candidates)]
+    single_time = (time.perf_counter() - start_time) / n_queries
+
+    # Vectorized implementation, all queries at once
+    start_time = time.perf_counter()
+    batched = batch_maximal_marginal_relevance(queries, candidates, k=k)
+    batch_time = (time.perf_counter() - start_time) / n_queries
+
+    agreement = np.mean([list(e) == s == list(b) for e, s, b in zip(expected, single, batched)])
+    print(f"fetch_k {fetch_k:>3}: stock {stock_time * 1e3:.3f} ms/query, "
+          f"vectorized {single_time * 1e3:.3f} ms/query ({stock_time / single_time:.1f}x), "
+          f"batched {batch_time * 1e3:.3f} ms/query ({stock_time / batch_time:.1f}x), "
+          f"same selection for {agreement:.0%} of queries")
@@ -0,0 +1,71 @@
+import sys
+import time
+import subprocess
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from repl_pool import ReplWorkerPool
+
+n_runs = 16
+n_workers = 4
+
+# Code an agent writes for the task of react_agent.py, split into its tool calls
+tool_calls = [
+    """import torch
+import torch.nn as nn
+import torch.optim as optim
+x = torch.linspace(-1, 1, 100).unsqueeze(1)
+y = 2 * x""",
+    """model = nn.Linear(1, 1)
+optimizer = optim.SGD(model.parameters(), lr=0.1)
+loss_function = nn.MSELoss()
+for epoch in range(100):
+    optimizer.zero_grad()
+    loss = loss_function(model(x), y)
+    loss.backward()
+    optimizer.step()
+    if (epoch + 1) % 10 == 0:
+        print(f'Epoch {epoch + 1}, loss {loss.item():.4f}')""",
+    "print(model(torch.tensor([[5.0]])).item())",
+]
+
+
+def run_cold(i):
+    """
+    Run the task in a new interpreter, like a REPL without a pool: torch is imported on every run.
+    returns: Seconds of the run
+    """
+    start_time = time.perf_counter()
+    subprocess.run([sys.executable, '-c', '\n'.join(tool_calls)], check=True, capture_output=True)
+    return time.perf_counter() - start_time
+
+
+def run_warm(pool, i):
+    """
+    Run the task in its own session of the pool, one call per tool call.
+    returns: Seconds of the run
+    """
+    start_time = time.perf_counter()
+    for code in tool_calls:
+        pool.run(code, f'run-{i}')
+    return time.perf_counter() - start_time
+
+
+def report(name, latencies, elapsed):
+    print(f"{name}: {len(latencies) / elapsed:.2f} runs/s, latency mean {np.mean(latencies):.2f} s "
+          f"p95 {np.percentile(latencies, 95):.2f} s")
+
+
+if __name__ == "__main__":
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        start_time = time.perf_counter()
+        latencies = list(executor.map(run_cold, range(n_runs)))
+        report('Cold interpreter per run', latencies, time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
+        pool = ReplWorkerPool(n_workers=n_workers, preload="import torch", preload_modules=['torch'])
+        print(f"Pool startup: {time.perf_counter() - start_time:.2f} s")
+        with pool:
+            start_time = time.perf_counter()
+            latencies = list(executor.map(lambda i: run_warm(pool, i), range(n_runs)))
+            report('Warm pool', latencies, time.perf_counter() - start_time)
+            print(pool.summary())
@@ -0,0 +1,64 @@
+import os
+import time
+import numpy as np
+from langchain_community.tools.sql_database.tool import (InfoSQLDatabaseTool, ListSQLDatabaseTool,
+                                                         QuerySQLDataBaseTool)
+from langchain_community.utilities.sql_database import SQLDatabase
+from sql_toolkit import CachedSQLDatabase, GuardedSQLDatabase
+
+# The bundled database, regardless of the working directory
+database_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Chinook.db')
+n_runs = 20
+
+# Tool calls of typical agent runs: list the tables, look at the schema of a few, then query. Agents repeat
+# the same calls across questions and retries, often with different whitespace or casing.
+agent_steps = [
+    ('list', ''),
+    ('info', 'Artist, Album, Track'),
+    ('query', "SELECT a.Name, COUNT(*) AS n FROM Artist a JOIN Album al ON a.ArtistId = al.ArtistId "
+              "GROUP BY a.ArtistId ORDER BY n DESC LIMIT 5;"),
+    ('list', ''),
+    ('info', 'Invoice, Customer'),
+    ('query', "SELECT c.Country, SUM(i.Total) AS total FROM Invoice i JOIN Customer c "
+              "ON i.CustomerId = c.CustomerId GROUP BY c.Country ORDER BY total DESC LIMIT 10"),
+    ('query', "select c.Country, sum(i.Total) as total from Invoice i join Customer c\n"
+              "  on i.CustomerId = c.CustomerId group by c.Country order by total desc limit 10;"),
+    ('info', 'Track, Genre, InvoiceLine'),
+    ('query', "SELECT g.Name, SUM(il.UnitPrice * il.Quantity) AS revenue FROM InvoiceLine il "
+              "JOIN Track t ON il.TrackId = t.TrackId JOIN Genre g ON t.GenreId = g.GenreId "
+              "GROUP BY g.GenreId ORDER BY revenue DESC LIMIT 5"),
+    ('query', "SELECT e.FirstName, e.LastName, COUNT(c.CustomerId) FROM Employee e "
+              "LEFT JOIN Customer c ON c.SupportRepId = e.EmployeeId GROUP BY e.EmployeeId"),
+]
+
+
+def replay(db, steps, n_runs):
+    """
+    Replay agent tool calls against a database.
+    db: SQLDatabase
+    steps: List of (tool, input) tuples
+    n_runs: Number of times the steps are replayed
+    returns: Dictionary with the latencies per tool
+    """
+    tools = {'list': ListSQLDatabaseTool(db=db), 'info': InfoSQLDatabaseTool(db=db),
+             'query': QuerySQLDataBaseTool(db=db)}
+    latencies = {name: [] for name in tools}
+    for _ in range(n_runs):
+        for name, tool_input in steps:
+            start_time = time.perf_counter()
+            tools[name].invoke(tool_input)
+            latencies[name].append(time.perf_counter() - start_time)
+    return latencies
+
+
+if __name__ == "__main__":
+    for name, open_database in [('SQLDatabase', lambda: SQLDatabase.from_uri(f"sqlite:///{database_path}")),
+                                ('CachedSQLDatabase', lambda: CachedSQLDatabase.from_sqlite(database_path)),
+                                ('GuardedSQLDatabase', lambda: GuardedSQLDatabase.from_sqlite(database_path))]:
+        start_time = time.perf_counter()
+        db = open_database()
+        startup = time.perf_counter() - start_time
+        latencies = replay(db, agent_steps, n_runs)
+        print(f"{name}: startup {startup * 1000:.1f} ms, " + ", ".join(
+            f"{tool} mean {np.mean(values) * 1000:.2f} ms p95 {np.percentile(values, 95) * 1000:.2f} ms"
+            for tool, values in latencies.items()))
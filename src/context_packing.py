@@ -0,0 +1,172 @@
+import re
+import threading
+import warnings
+from langchain_core.documents import Document
+
+# Tokenizer of the GPT-3.5 and GPT-4 models, used for models tiktoken does not know
+DEFAULT_ENCODING = 'cl100k_base'
+
+# Encodings loaded in this process, None when tiktoken or its files are not available
+_encodings = {}
+_lock = threading.Lock()
+
+
+def get_encoding(name=DEFAULT_ENCODING, model=None):
+    """
+    Load a tiktoken encoding once per process, with a warning when it cannot be loaded.
+    name: Name of the encoding, used when no model is given or tiktoken does not know the model
+    model: Name of the model the text is for, e.g. 'gpt-4o', whose tokenizer is used
+    returns: The encoding, or None when it cannot be loaded, e.g. offline without a cached copy
+    """
+    key = model or name
+    with _lock:
+        if key not in _encodings:
+            try:
+                import tiktoken
+                try:
+                    _encodings[key] = tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding(name)
+                except KeyError:
+                    warnings.warn(f"tiktoken does not know the tokenizer of {model}, counting tokens with {name}")
+                    _encodings[key] = tiktoken.get_encoding(name)
+            except Exception as error:
+                warnings.warn(f"Cannot load the tokenizer of {key} ({type(error).__name__}: {error}), estimating "
+                              f"four characters per token instead")
+                _encodings[key] = None
+        return _encodings[key]
+
+
+def count_tokens(text, encoding=None):
+    """
+    Number of tokens of a text, estimated as four characters per token without an encoding.
+    text: String
+    encoding: tiktoken encoding, or None
+    """
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text, max_tokens, encoding=None):
+    """
+    Cut a text to at most a number of tokens, at a word boundary when possible.
+    text: String
+    max_tokens: Maximum number of tokens
+    encoding: tiktoken encoding, or None
+    """
+    if encoding is None:
+        text = text[:max_tokens * 4]
+    else:
+        text = encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+    cut = text.rfind(' ')
+    return text[:cut] if cut > len(text) // 2 else text
+
+
+def clean_text(text):
+    """
+    Collapse the whitespace of extracted text: runs of spaces and tabs to one space, three or more newlines to
+    a blank line.
+    text: String
+    """
+    text = re.sub(r'[ \t\u00a0]+', ' ', text)
+    text = re.sub(r' *\n *', '\n', text)
+    return re.sub(r'\n{3,}', '\n\n', text).strip()
+
+
+def shingles(text, size=3):
+    """
+    Set of the word n-grams of a text, case and punctuation insensitive.
+    text: String
+    size: Number of words per shingle
+    """
+    words = re.findall(r'\w+', text.lower())
+    if len(words) <= size:
+        return {' '.join(words)}
+    return {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+class ContextPacker:
+    """
+    Turns retrieved Documents into the context of a prompt: near-duplicate chunks are dropped, the rest is
+    ordered by relevance and the cleaned text is added until the token budget is full, cutting the last
+    chunk that does not fit. Only the text is used, not the repr of the Documents with their metadata.
+    Retrievers return Documents most relevant first; a relevance score in the metadata overrides that order.
+    """
+
+    def __init__(self, max_tokens=3000, duplicate_threshold=0.8, min_tokens=50, separator='\n\n',
+                 score_key='relevance_score', source_key=None, model=None, encoding=DEFAULT_ENCODING):
+        """
+        max_tokens: Token budget of the context
+        duplicate_threshold: Jaccard similarity of the word shingles above which a chunk is a duplicate of a more
+        relevant chunk
+        min_tokens: A chunk that does not fit is cut to the remaining budget if at least this many tokens remain
+        separator: Text between chunks
+        score_key: Metadata key of a relevance score, higher is more relevant
+        source_key: Metadata key printed before every chunk, e.g. 'source', nothing when None
+        model: Name of the model the context is for, e.g. 'gpt-4o', to count tokens with its tokenizer
+        encoding: Name of the tiktoken encoding used to count tokens when no model is given
+        """
+        self.max_tokens = max_tokens
+        self.duplicate_threshold = duplicate_threshold
+        self.min_tokens = min_tokens
+        self.separator = separator
+        self.score_key = score_key
+        self.source_key = source_key
+        self.encoding = get_encoding(encoding, model)
+        self.stats = {'documents': 0, 'duplicates': 0, 'dropped': 0, 'truncated': 0, 'tokens_in': 0,
+                      'tokens_out': 0}
+        self._lock = threading.Lock()
+
+    def select(self, documents):
+        """
+        Relevance ordered Documents without near-duplicates.
+        documents: List of Documents, most relevant first
+        """
+        documents = [document for _, document in sorted(
+            enumerate(documents), key=lambda pair: (-pair[1].metadata.get(self.score_key, 0.0), pair[0]))]
+        selected, selected_shingles = [], []
+        for document in documents:
+            current = shingles(document.page_content)
+            if not any(len(current & other) / len(current | other) >= self.duplicate_threshold
+                       for other in selected_shingles):
+                selected.append(document)
+                selected_shingles.append(current)
+        return selected
+
+    def _text(self, document):
+        text = clean_text(document.page_content)
+        if self.source_key is not None and document.metadata.get(self.source_key) is not None:
+            text = f"[{document.metadata[self.source_key]}]\n{text}"
+        return text
+
+    def pack(self, documents):
+        """
+        Context string of retrieved Documents within the token budget.
+        documents: List of Documents, or strings, most relevant first
+        """
+        documents = [Document(page_content=document) if isinstance(document, str) else document
+                     for document in documents]
+        selected = self.select(documents)
+        separator_tokens = count_tokens(self.separator, self.encoding)
+        parts, used, truncated, tokens_in = [], 0, 0, 0
+        for document in selected:
+            text = self._text(document)
+            tokens = count_tokens(text, self.encoding)
+            tokens_in += tokens
+            overhead = separator_tokens if parts else 0
+            budget = self.max_tokens - used - overhead
+            if tokens > budget:
+                if budget < self.min_tokens:
+                    continue
+                text = truncate_tokens(text, budget, self.encoding)
+                tokens = count_tokens(text, self.encoding)
+                truncated += 1
+            parts.append(text)
+            used += tokens + overhead
+        with self._lock:
+            self.stats['documents'] += len(documents)
+            self.stats['duplicates'] += len(documents) - len(selected)
+            self.stats['dropped'] += len(selected) - len(parts)
+            self.stats['truncated'] += truncated
+            self.stats['tokens_in'] += tokens_in
+            self.stats['tokens_out'] += used
+        return self.separator.join(parts)
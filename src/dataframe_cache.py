@@ -0,0 +1,58 @@
+import os
+import hashlib
+import pandas as pd
+
+# Cached datasets are kept next to the vector stores
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'vector_stores', 'dataframes')
+
+
+def cache_csv(location, cache_dir=DEFAULT_CACHE_DIR, **kwargs):
+    """
+    Download or read a CSV file once and keep it as an uncompressed Arrow file, which later loads are
+    memory-mapped from instead of parsing the CSV again.
+    location: URL or path of the CSV file
+    cache_dir: Directory of the cache
+    kwargs: Passed to pandas.read_csv
+    returns: Path of the Arrow file
+    """
+    digest = hashlib.sha256(location.encode('utf-8')).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(location))[0]
+    path = os.path.join(cache_dir, f'{name}-{digest}.arrow')
+    if not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        temporary_path = f'{path}.{os.getpid()}.tmp'
+        pd.read_csv(location, **kwargs).to_feather(temporary_path, compression='uncompressed')
+        os.replace(temporary_path, path)
+    return path
+
+
+def load_cached(path):
+    """
+    Memory-map a cached Arrow file as a DataFrame with the same NumPy dtypes as pandas.read_csv, so code
+    written for the CSV behaves the same. Numeric columns without missing values are views of the mapped file,
+    shared by all processes that load it; other columns, e.g. strings, are converted to a copy.
+    path: Path of the Arrow file
+    """
+    from pyarrow import feather
+    return feather.read_table(path, memory_map=True).to_pandas(split_blocks=True)
+
+
+def preload_code(path, name='df'):
+    """
+    Source for the preload of a ReplWorkerPool that loads a cached DataFrame into a variable. Copy-on-write
+    is switched on, so the shallow copy of session_code is enough to keep the changes of a session to itself.
+    path: Path of the Arrow file
+    name: Name of the variable
+    """
+    return (f"import pandas as pd\n"
+            f"from dataframe_cache import load_cached\n"
+            f"pd.options.mode.copy_on_write = True\n"
+            f"{name} = load_cached({os.path.abspath(path)!r})\n")
+
+
+def session_code(name='df'):
+    """
+    Source for the session setup of a ReplWorkerPool that gives every session its own view of a DataFrame.
+    name: Name of the variable
+    """
+    return f"{name} = {name}.copy(deep=False)\n"
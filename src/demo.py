@@ -1,5 +1,5 @@
 import asyncio
-from ollama import AsyncClient
+from ollama_client import OllamaChatClient
 import ollama
 
 # Regular
@@ -12,10 +12,17 @@ import ollama
 # print(response['message']['content'])
 
 
-# Streaming
-async def chat():
+# Streaming, over a pooled connection that is reused by every call of the client
+async def chat(client):
     message = {'role': 'user', 'content': 'Write a Haiku about the beauty of sunflowers'}
-    async for part in await AsyncClient().chat(model='llama3', messages=[message], stream=True):
-        print(part['message']['content'], end='', flush=True)
+    async for part in client.stream_chat('llama3', [message]):
+        print(part, end='', flush=True)
+    print()
 
-asyncio.run(chat())
+
+async def main():
+    async with OllamaChatClient() as client:
+        await chat(client)
+        print(client.metrics[-1])
+
+asyncio.run(main())
@@ -0,0 +1,164 @@
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Default location of the cache, shared by all scripts regardless of the working directory
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'vector_stores',
+                                  'embedding_cache.sqlite')
+
+# SQLite limits the number of variables in a single statement
+SQLITE_BATCH_SIZE = 500
+
+# Fraction of max_entries evicted at once, so the entries are only counted again after that many inserts
+EVICTION_FRACTION = 0.05
+
+
+def model_name_of(embeddings):
+    """
+    Best effort name of the model behind an embeddings object, used as part of the cache key.
+    embeddings: Any langchain Embeddings object
+    """
+    for attribute in ('model', 'model_name', 'model_id'):
+        name = getattr(embeddings, attribute, None)
+        if isinstance(name, str) and name:
+            return name
+    return type(embeddings).__name__
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Content-addressed, on-disk cache around any embeddings object. Vectors are stored in SQLite keyed by
+    the model name and the hash of the text, and once the cache holds more than max_entries vectors the least
+    recently used ones are evicted, EVICTION_FRACTION of max_entries below the limit. A call to embed_documents
+    does one cache pass and a single batched call to the underlying embeddings for all misses.
+    """
+
+    def __init__(self, embeddings, path=DEFAULT_CACHE_PATH, max_entries=1_000_000, model_name=None):
+        """
+        embeddings: Embeddings object that is called for cache misses
+        path: Location of the SQLite database
+        max_entries: Maximum number of vectors kept in the cache
+        model_name: Name used in the cache key, derived from the embeddings object when not given
+        """
+        self.embeddings = embeddings
+        self.model_name = model_name or model_name_of(embeddings)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, "
+            "last_used REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._connection.commit()
+        # Upper bound of the number of entries, counted exactly only when it exceeds max_entries
+        self._count = self._connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _key(self, kind, text):
+        return hashlib.sha256(f"{self.model_name}\0{kind}\0{text}".encode('utf-8')).hexdigest()
+
+    def _lookup(self, keys):
+        found = {}
+        for start in range(0, len(keys), SQLITE_BATCH_SIZE):
+            batch = keys[start:start + SQLITE_BATCH_SIZE]
+            rows = self._connection.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+            ).fetchall()
+            for key, vector in rows:
+                found[key] = np.frombuffer(vector, dtype=np.float32).tolist()
+        if found:
+            now = time.time()
+            self._connection.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                         [(now, key) for key in found])
+        return found
+
+    def _store(self, items):
+        now = time.time()
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+            [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items]
+        )
+        self._count += len(items)
+        if self._count <= self.max_entries:
+            return
+        self._count = self._connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if self._count > self.max_entries:
+            excess = self._count - self.max_entries + int(self.max_entries * EVICTION_FRACTION)
+            self._connection.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                (excess,)
+            )
+            self._count -= excess
+
+    def _embed(self, kind, texts, embed_function):
+        keys = [self._key(kind, text) for text in texts]
+        with self._lock:
+            found = self._lookup(keys)
+            self._connection.commit()
+            hits = sum(key in found for key in keys)
+            self.hits += hits
+            self.misses += len(keys) - hits
+
+        # Embed every missing text only once, even when it occurs multiple times
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+
+        if missing:
+            vectors = embed_function(list(missing.values()))
+            new = {key: np.asarray(vector, dtype=np.float32).tolist() for key, vector in zip(missing, vectors)}
+            with self._lock:
+                self._store(new.items())
+                self._connection.commit()
+            found.update(new)
+        return [found[key] for key in keys]
+
+    def embed_documents(self, texts):
+        return self._embed('document', list(texts), self.embeddings.embed_documents)
+
+    def embed_query(self, text):
+        return self._embed('query', [text], lambda texts: [self.embeddings.embed_query(texts[0])])[0]
+
+    def embed_queries(self, texts):
+        """
+        Embed queries, sharing the cache entries of embed_query, with one call to the underlying embeddings for
+        all misses. That call is embed_documents, which gives the same vectors as embed_query for the OpenAI
+        and local embeddings.
+        texts: List of query strings
+        """
+        return self._embed('query', list(texts), self.embeddings.embed_documents)
+
+    def stats(self):
+        """
+        Hit and miss counters of this process.
+        """
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0}
+
+
+def load_embeddings(backend='openai', cache=True, **kwargs):
+    """
+    Embeddings used by the builder and retrieval scripts, wrapped in the on-disk embedding cache.
+    backend: 'openai' for OpenAIEmbeddings, or 'local' for LocalEmbeddings
+    cache: Bool to wrap the embeddings in CachedEmbeddings
+    kwargs: Passed to the embeddings class
+    """
+    if backend == 'openai':
+        from langchain_openai import OpenAIEmbeddings
+        embeddings = OpenAIEmbeddings(**kwargs)
+    elif backend == 'local':
+        from local_embeddings import LocalEmbeddings
+        embeddings = LocalEmbeddings(**kwargs)
+    else:
+        raise ValueError(f"backend of {backend} not allowed, choose from 'openai' and 'local'")
+    return CachedEmbeddings(embeddings) if cache else embeddings
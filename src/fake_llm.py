@@ -0,0 +1,23 @@
+import time
+from langchain_core.language_models import LLM
+
+
+class FakeLLM(LLM):
+    """
+    Local stand-in for a model with a fixed latency, which echoes the prompt. For testing and demos without a
+    model, e.g. of the LLM cache.
+    """
+
+    latency: float = 0.5
+
+    @property
+    def _llm_type(self):
+        return 'fake-echo'
+
+    @property
+    def _identifying_params(self):
+        return {'latency': self.latency}
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        return f"Answer to: {prompt}"
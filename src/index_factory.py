@@ -0,0 +1,120 @@
+import math
+import uuid
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+# Supported index types, from exact to most compressed
+INDEX_TYPES = ('flat', 'ivf_flat', 'hnsw', 'ivf_pq')
+
+
+def default_nlist(count):
+    """
+    Number of IVF cells: about 4 * sqrt(n), with at least 39 training vectors per cell as faiss advises.
+    count: Number of vectors in the index
+    """
+    return max(1, min(int(4 * math.sqrt(count)), count // 39))
+
+
+def default_pq_m(dimension):
+    """
+    Number of PQ sub-quantizers: one byte per 4 dimensions, i.e. codes 16x smaller than float32 vectors. With
+    the ids in the IVF lists, the centroids and the codebooks an index is about 8.6x smaller in benchmark_index.py.
+    dimension: Dimension of the vectors
+    """
+    m = max(1, dimension // 4)
+    while dimension % m:
+        m -= 1
+    return m
+
+
+def factory_string(index_type, dimension, count, nlist=None, pq_m=None, hnsw_m=32):
+    """
+    faiss.index_factory description of an index type.
+    index_type: One of INDEX_TYPES
+    dimension: Dimension of the vectors
+    count: Number of vectors that will be indexed, used for the defaults
+    nlist: Number of IVF cells
+    pq_m: Number of PQ sub-quantizers, must divide the dimension
+    hnsw_m: Number of neighbours per node in the HNSW graph
+    """
+    if index_type == 'flat':
+        return 'Flat'
+    if index_type == 'hnsw':
+        return f'HNSW{hnsw_m}'
+    if index_type == 'ivf_flat':
+        return f'IVF{nlist or default_nlist(count)},Flat'
+    if index_type == 'ivf_pq':
+        return f'IVF{nlist or default_nlist(count)},PQ{pq_m or default_pq_m(dimension)}'
+    raise ValueError(f"index_type of {index_type} not allowed, choose from {INDEX_TYPES}")
+
+
+def build_index(vectors, index_type='flat', metric=faiss.METRIC_L2, sample_size=100_000, nprobe=16,
+                ef_search=128, seed=42, **kwargs):
+    """
+    Build a faiss index of the given type from a matrix of vectors. Indexes that need training are trained
+    on a random sample of the vectors, and fall back to a flat index when there are too few vectors to train.
+    IVF indexes get a direct map, which MMR needs to reconstruct vectors.
+    vectors: Array of shape (n, d)
+    index_type: One of INDEX_TYPES
+    metric: faiss metric, METRIC_L2 like langchain's FAISS by default
+    sample_size: Maximum number of vectors used for training
+    nprobe: Number of IVF cells visited per query
+    ef_search: Size of the HNSW candidate list per query, larger is slower but finds more of the true
+    neighbours; benchmark_index.py finds the value that reaches a target recall on a corpus
+    seed: Seed of the training sample
+    kwargs: Passed to factory_string (nlist, pq_m, hnsw_m)
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    count, dimension = vectors.shape
+
+    # k-means needs at least as many training vectors as centroids, PQ uses 256 centroids per sub-quantizer
+    nlist = kwargs.get('nlist') or default_nlist(count)
+    if (index_type == 'ivf_pq' and count < max(256, nlist)) or (index_type == 'ivf_flat' and count < nlist):
+        index_type = 'flat'
+    index = faiss.index_factory(dimension, factory_string(index_type, dimension, count, **kwargs), metric)
+
+    if not index.is_trained:
+        rng = np.random.default_rng(seed)
+        sample = vectors[rng.choice(count, min(sample_size, count), replace=False)]
+        index.train(sample)
+    index.add(vectors)
+
+    if index_type in ('ivf_flat', 'ivf_pq'):
+        index.nprobe = nprobe
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+    elif index_type == 'hnsw':
+        index.hnsw.efSearch = ef_search
+    return index
+
+
+def convert_vector_store(vectorstore, index_type, **kwargs):
+    """
+    Copy a flat FAISS vector store into one with another index type, sharing the documents. Note that HNSW
+    indexes do not support deleting vectors, so keep the flat store as the one that is updated incrementally.
+    vectorstore: langchain FAISS vector store with a flat index
+    index_type: One of INDEX_TYPES
+    kwargs: Passed to build_index
+    """
+    if index_type == 'flat':
+        return vectorstore
+    vectors = vectorstore.index.reconstruct_n(0, vectorstore.index.ntotal)
+    index = build_index(vectors, index_type, metric=vectorstore.index.metric_type, **kwargs)
+    return FAISS(vectorstore.embedding_function, index, vectorstore.docstore, dict(vectorstore.index_to_docstore_id),
+                 normalize_L2=vectorstore._normalize_L2, distance_strategy=vectorstore.distance_strategy)
+
+
+def from_documents(documents, embeddings, index_type='flat', **kwargs):
+    """
+    Counterpart of FAISS.from_documents with a configurable index type.
+    documents: List of langchain Documents
+    embeddings: Embeddings used for the documents
+    index_type: One of INDEX_TYPES
+    kwargs: Passed to build_index
+    """
+    vectors = embeddings.embed_documents([document.page_content for document in documents])
+    index = build_index(np.array(vectors), index_type, **kwargs)
+    ids = [str(uuid.uuid4()) for _ in documents]
+    docstore = InMemoryDocstore(dict(zip(ids, documents)))
+    return FAISS(embeddings, index, docstore, dict(enumerate(ids)))
@@ -0,0 +1,343 @@
+import os
+import json
+import hashlib
+import uuid
+import itertools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from langchain_community.vectorstores import FAISS
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_community.document_loaders import UnstructuredPDFLoader, UnstructuredPowerPointLoader
+from lexical_index import LEXICAL_NAME, LexicalIndex, index_vector_store
+
+# Loaders per supported file extension
+LOADERS = {
+    '.pdf': UnstructuredPDFLoader,
+    '.pptx': UnstructuredPowerPointLoader,
+}
+
+# Name of the manifest that is stored inside the vector store folder
+MANIFEST_NAME = 'manifest.json'
+
+
+def clean_text(text):
+    """
+    Light preprocessing: replace (escaped) newlines and tabs by spaces.
+    text: String to clean
+    """
+    return str(text).replace("\\n", " ")\
+                    .replace("\\t", " ")\
+                    .replace("\n", " ")\
+                    .replace("\t", " ")
+
+
+def is_supported(filename):
+    """
+    Check whether there is a loader for the extension of a file.
+    filename: Path of the file
+    """
+    return os.path.splitext(filename)[1].lower() in LOADERS
+
+
+def load_file(filename, clean=True, split=True):
+    """
+    Load and split a PDF or PowerPoint file into pages.
+    filename: Path of the file
+    clean: Bool to apply the light preprocessing to the pages
+    split: Bool to split the file into chunks, otherwise the documents of the loader are returned as they are
+    """
+    loader = LOADERS[os.path.splitext(filename)[1].lower()](filename)
+    pages = loader.load_and_split() if split else loader.load()
+    if clean:
+        for page in pages:
+            page.page_content = clean_text(page.page_content)
+    return pages
+
+
+def ordered_map(function, arguments, max_workers=None):
+    """
+    Call a function on every tuple of arguments in a pool of worker processes and yield the results in the
+    order of the arguments. Every result is yielded as soon as it and all results before it are done, and at
+    most two calls per worker are in flight, so results do not pile up in memory.
+    Scripts calling this need an `if __name__ == "__main__":` guard on platforms that spawn processes.
+    function: Picklable function, defined at the top level of a module
+    arguments: List of argument tuples
+    max_workers: Number of worker processes, defaults to the number of CPUs. 1 calls in this process
+    """
+    arguments = list(arguments)
+    if max_workers == 1 or len(arguments) <= 1:
+        for args in arguments:
+            yield function(*args)
+        return
+
+    max_workers = min(max_workers or os.cpu_count() or 1, len(arguments))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        remaining = iter(arguments)
+        pending = deque(executor.submit(function, *args) for args in itertools.islice(remaining, 2 * max_workers))
+        while pending:
+            future = pending.popleft()
+            for args in itertools.islice(remaining, 1):
+                pending.append(executor.submit(function, *args))
+            yield future.result()
+
+
+def parse_files(filenames, max_workers=None, clean=True, split=True):
+    """
+    Parse files in a pool of worker processes and yield (filename, pages) tuples in the order of filenames,
+    holding at most two parsed files per worker in memory.
+    Scripts calling this need an `if __name__ == "__main__":` guard on platforms that spawn processes.
+    filenames: List of PDF / PowerPoint files
+    max_workers: Number of worker processes, defaults to the number of CPUs. 1 parses in this process
+    clean: Bool to apply the light preprocessing to the pages
+    split: Bool to split the files into chunks
+    """
+    filenames = list(filenames)
+    results = ordered_map(load_file, [(filename, clean, split) for filename in filenames], max_workers)
+    yield from zip(filenames, results)
+
+
+def batched(iterable, batch_size):
+    """
+    Yield lists of at most batch_size consecutive items of an iterable.
+    iterable: Any iterable, consumed lazily
+    batch_size: Maximum number of items per list
+    """
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, batch_size)):
+        yield batch
+
+
+def stream_documents(filenames, max_workers=None):
+    """
+    Yield the unsplit documents of files, holding at most a few parsed files in memory.
+    filenames: List of PDF / PowerPoint files
+    max_workers: Number of worker processes used to parse the files
+    """
+    for filename, documents in parse_files(filenames, max_workers, clean=False, split=False):
+        yield from documents
+
+
+def clean_documents(documents):
+    """
+    Apply the light preprocessing to a stream of documents.
+    documents: Iterable of langchain Documents
+    """
+    for document in documents:
+        document.page_content = clean_text(document.page_content)
+        yield document
+
+
+def split_documents(documents, text_splitter=None):
+    """
+    Split a stream of documents into chunks, one document at a time.
+    documents: Iterable of langchain Documents
+    text_splitter: Splitter to use, defaults to the splitter of load_and_split
+    """
+    text_splitter = text_splitter or RecursiveCharacterTextSplitter()
+    for document in documents:
+        yield from text_splitter.split_documents([document])
+
+
+def add_documents_in_batches(vectorstore, items, embeddings, batch_size=256, lexical_index=None):
+    """
+    Embed a stream of documents in fixed-size batches and add every batch to a FAISS vector store right away,
+    so only one batch of texts and vectors is held outside the index at any time.
+    vectorstore: FAISS vector store, or None to create one from the first batch
+    items: Iterable of (id, Document) tuples
+    embeddings: Embeddings used for the documents
+    batch_size: Number of documents embedded per call
+    lexical_index: Optional LexicalIndex that every batch is added to as well, under the same ids, once it is
+    in the vector store
+    """
+    for batch in batched(items, batch_size):
+        ids = [i for i, _ in batch]
+        texts = [document.page_content for _, document in batch]
+        metadatas = [document.metadata for _, document in batch]
+        text_embeddings = list(zip(texts, embeddings.embed_documents(texts)))
+        if vectorstore is None:
+            vectorstore = FAISS.from_embeddings(text_embeddings, embeddings, metadatas=metadatas, ids=ids)
+        else:
+            vectorstore.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+        if lexical_index is not None:
+            lexical_index.add(batch)
+    return vectorstore
+
+
+def build_vector_store(filenames, embeddings, batch_size=256, max_workers=None, clean=True, text_splitter=None,
+                       lexical_index=None):
+    """
+    Streaming ingestion: load -> clean -> split -> embed in batches -> add to the index. Peak memory is
+    bounded by the batch size and the few files in flight instead of by the size of the corpus.
+    filenames: List of PDF / PowerPoint files
+    embeddings: Embeddings used for the chunks
+    batch_size: Number of chunks embedded per call
+    max_workers: Number of worker processes used to parse the files
+    clean: Bool to apply the light preprocessing
+    text_splitter: Splitter to use, defaults to the splitter of load_and_split
+    lexical_index: Optional LexicalIndex that the chunks are added to as well
+    """
+    documents = stream_documents(filenames, max_workers)
+    if clean:
+        documents = clean_documents(documents)
+    chunks = split_documents(documents, text_splitter)
+    return add_documents_in_batches(None, ((str(uuid.uuid4()), chunk) for chunk in chunks), embeddings, batch_size,
+                                    lexical_index)
+
+
+def file_hash(filename, block_size=1 << 20):
+    """
+    Compute the SHA-256 hash of the raw bytes of a file.
+    filename: Path of the file
+    block_size: Number of bytes read at once
+    """
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def documents_hash(documents):
+    """
+    Compute a single SHA-256 hash over the content of a list of documents.
+    documents: List of langchain Documents
+    """
+    digest = hashlib.sha256()
+    for document in documents:
+        digest.update(document.page_content.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def chunk_id(source, text):
+    """
+    Content-addressed id of a chunk, which is also used as its id in the vector store.
+    source: File path or URL the chunk came from
+    text: Content of the chunk
+    """
+    return hashlib.sha256(f"{source}\0{text}".encode('utf-8')).hexdigest()
+
+
+def load_manifest(store_path):
+    """
+    Load the manifest of a vector store, or an empty manifest if there is none.
+    store_path: Folder of the vector store
+    """
+    manifest_path = os.path.join(store_path, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {'sources': {}}
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(store_path, manifest):
+    """
+    Atomically write the manifest of a vector store.
+    store_path: Folder of the vector store
+    manifest: Dictionary with the hashes of all sources and chunks
+    """
+    os.makedirs(store_path, exist_ok=True)
+    manifest_path = os.path.join(store_path, MANIFEST_NAME)
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+def update_vector_store(store_path, files, embeddings, documents=None, max_workers=None, batch_size=256,
+                        lexical=True):
+    """
+    Incrementally bring a FAISS vector store in line with its sources. Unchanged sources are skipped
+    entirely, changed sources only get their new chunks embedded and vectors of chunks that disappeared
+    are deleted in place. The file and chunk hashes are kept in a manifest next to the index.
+    store_path: Folder of the vector store, e.g. 'vector_stores/vereijken.faiss'
+    files: List of PDF / PowerPoint files
+    embeddings: Embeddings used for new chunks
+    documents: Optional dictionary of already loaded documents per source (e.g. an URL)
+    max_workers: Number of worker processes used to parse the changed files
+    batch_size: Number of new chunks embedded per call
+    lexical: Bool to keep a LexicalIndex of the chunks in the same folder up to date as well
+    """
+    documents = documents or {}
+    manifest = load_manifest(store_path)
+
+    # Without an index the manifest is meaningless
+    vectorstore = None
+    if os.path.exists(os.path.join(store_path, 'index.faiss')):
+        vectorstore = FAISS.load_local(store_path, embeddings, allow_dangerous_deserialization=True)
+    else:
+        manifest = {'sources': {}}
+
+    lexical_index = None
+    if lexical:
+        os.makedirs(store_path, exist_ok=True)
+        lexical_index = LexicalIndex(os.path.join(store_path, LEXICAL_NAME))
+        if vectorstore is None:
+            lexical_index.clear()
+        else:
+            # Bring the lexical index in line with the saved vector store, e.g. one built before the lexical
+            # index existed or an update that stopped before the vector store was saved
+            indexed = set(vectorstore.index_to_docstore_id.values())
+            lexical_index.delete(i for i in lexical_index.ids() if i not in indexed)
+            if len(lexical_index) < len(indexed):
+                index_vector_store(lexical_index, vectorstore)
+    old_sources = manifest['sources']
+    new_sources = {}
+
+    ids_to_delete = []
+    added = []
+
+    # Fingerprint every source, unchanged sources are kept as they are
+    current = [(filename, file_hash(filename)) for filename in files]
+    current += [(source, documents_hash(docs)) for source, docs in documents.items()]
+    changed = []
+    for source, fingerprint in current:
+        old = old_sources.get(source)
+        if old is not None and old['hash'] == fingerprint:
+            new_sources[source] = old
+        else:
+            changed.append((source, fingerprint))
+
+    # Sources that are gone
+    current_sources = {source for source, _ in current}
+    for source, old in old_sources.items():
+        if source not in current_sources:
+            print(f"Removing: {source}")
+            ids_to_delete += old['chunks']
+
+    def new_chunks():
+        # Only the changed files are parsed, in parallel, and their new chunks are streamed to the index
+        fingerprints = dict(changed)
+        changed_documents = [(source, documents[source]) for source, _ in changed if source in documents]
+        changed_files = [source for source, _ in changed if source not in documents]
+        for source, pages in itertools.chain(changed_documents, parse_files(changed_files, max_workers)):
+            print(f"Processing: {source}")
+            old = old_sources.get(source)
+
+            # Chunks keep their id as long as their content does not change
+            chunks = {}
+            for page in pages:
+                chunks.setdefault(chunk_id(source, page.page_content), page)
+            old_chunks = set(old['chunks']) if old is not None else set()
+            ids_to_delete.extend(i for i in old_chunks if i not in chunks)
+            for i, page in chunks.items():
+                if i not in old_chunks:
+                    added.append(i)
+                    yield i, page
+            new_sources[source] = {'hash': fingerprints[source], 'chunks': list(chunks)}
+
+    vectorstore = add_documents_in_batches(vectorstore, new_chunks(), embeddings, batch_size, lexical_index)
+    # Chunks of the manifest can be missing from the index, e.g. duplicates or after an interrupted update
+    if vectorstore is not None:
+        indexed = set(vectorstore.index_to_docstore_id.values())
+        ids_to_delete = [i for i in ids_to_delete if i in indexed]
+    if vectorstore is not None and ids_to_delete:
+        vectorstore.delete(ids_to_delete)
+    if lexical_index is not None and ids_to_delete:
+        lexical_index.delete(ids_to_delete)
+
+    print(f"Chunks added: {len(added)}, chunks deleted: {len(ids_to_delete)}")
+
+    if vectorstore is not None:
+        vectorstore.save_local(store_path)
+        save_manifest(store_path, {'sources': new_sources})
+    return vectorstore
@@ -1,62 +1,91 @@
 import os
 import openai
 from dotenv import load_dotenv
-from langchain_community.vectorstores import FAISS
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import RunnableParallel, RunnablePassthrough
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_community.document_loaders import UnstructuredPDFLoader, UnstructuredPowerPointLoader
+from langchain_openai import ChatOpenAI
+from embedding_cache import load_embeddings
+from ingestion import build_vector_store
+from lexical_index import LEXICAL_NAME, HybridRetriever, LexicalIndex, index_vector_store
+from context_packing import ContextPacker
+from mmr import MMRRetriever
+from mmap_store import is_mmap_store, load_mmap_store, save_mmap_store, HEADER_NAME
+from prompt_registry import get_prompt
 
 
 load_dotenv()
 openai.api_key = os.environ["OPENAI_API_KEY"]
 
-
-# Load PDF
-loader = UnstructuredPDFLoader("../examle_data/Notulen_Vergadering_van_eigenaars_11-03-2024.pdf")
-pages = loader.load_and_split()
-
-# Load another PDF
-loader = UnstructuredPDFLoader("../examle_data/5611XD_97-20240629-071044.pdf")
-pages += loader.load_and_split()
-
-# Load a PowerPoint document
-loader = UnstructuredPowerPointLoader("../examle_data/process_mining_example.pptx")
-pages += loader.load_and_split()
-
-# Create the model
-model = ChatOpenAI(model="gpt-3.5-turbo-0125")
-
-# Create the vectorstore
-vectorstore = FAISS.from_documents(pages, OpenAIEmbeddings())
-
-# Create retriever
-retriever = vectorstore.as_retriever(search_type='mmr',
-                                     search_kwargs={'k': 5})
-
-# Your query
-query = "What is the impact of process mining?"
-
-# Use the retriever
-relevant_documents = retriever.invoke(query)
-
-# Build a prompt template
-template = """
-Answer the question below using the context:
-{context}
-
-Vraag: {question}
-"""
-
-prompt = ChatPromptTemplate.from_template(template)
-output_parser = StrOutputParser()
-
-setup_and_retrieval = RunnableParallel(
-    {"context": retriever, "question": RunnablePassthrough()}
-)
-chain = setup_and_retrieval | prompt | model | output_parser
-
-response = chain.invoke("Wa?")
-
-print(response)
+# Documents to load: two PDFs and a PowerPoint document
+files = [
+    "../examle_data/Notulen_Vergadering_van_eigenaars_11-03-2024.pdf",
+    "../examle_data/5611XD_97-20240629-071044.pdf",
+    "../examle_data/process_mining_example.pptx",
+]
+
+# Number of processes that parse the files, None uses all CPUs
+max_workers = None
+
+# Number of chunks embedded per call
+batch_size = 256
+
+# Embedding backend: 'openai' or 'local' (CPU)
+embedding_backend = 'openai'
+
+# The vector store is kept on disk and only rebuilt when one of the files is newer
+store_path = '../vector_stores/lean_rag.faiss'
+
+# Retrieval: 'hybrid' fuses BM25 and vector search, 'lexical' needs no embedding call, 'dense' is vector search
+retrieval_mode = 'hybrid'
+
+# Maximum number of tokens of the retrieved context in the prompt
+context_tokens = 2000
+
+# Files are parsed in worker processes, which import this script again on some platforms
+if __name__ == "__main__":
+    # Create the model
+    model = ChatOpenAI(model="gpt-3.5-turbo-0125")
+
+    embeddings = load_embeddings(embedding_backend)
+    lexical_index = LexicalIndex(os.path.join(store_path, LEXICAL_NAME)) if os.path.isdir(store_path) else None
+    if is_mmap_store(store_path) and \
+            os.path.getmtime(os.path.join(store_path, HEADER_NAME)) > max(map(os.path.getmtime, files)):
+        # Memory-map the saved vectorstore
+        vectorstore = load_mmap_store(store_path, embeddings)
+        if len(lexical_index) == 0:
+            index_vector_store(lexical_index, vectorstore)
+    else:
+        # Create the vectorstore and its lexical index: files are parsed in parallel, split and embedded in
+        # batches as they stream in
+        os.makedirs(store_path, exist_ok=True)
+        lexical_index = LexicalIndex(os.path.join(store_path, LEXICAL_NAME))
+        lexical_index.clear()
+        vectorstore = build_vector_store(files, embeddings, batch_size=batch_size,
+                                         max_workers=max_workers, clean=False, lexical_index=lexical_index)
+        save_mmap_store(vectorstore, store_path)
+
+    # Create retriever: BM25 and MMR results are fused, exact terms like order numbers are found by BM25
+    retriever = HybridRetriever(lexical_index=lexical_index, retriever=MMRRetriever(vectorstore=vectorstore, k=20),
+                                mode=retrieval_mode, k=5, fetch_k=20)
+
+    # Your query
+    query = "What is the impact of process mining?"
+
+    # Use the retriever
+    relevant_documents = retriever.invoke(query)
+
+    prompt = get_prompt('lean-rag-answer')
+    output_parser = StrOutputParser()
+
+    # Pack the retrieved chunks into clean text within the token budget
+    context_packer = ContextPacker(max_tokens=context_tokens, model=model.model_name)
+
+    setup_and_retrieval = RunnableParallel(
+        {"context": retriever | context_packer.pack, "question": RunnablePassthrough()}
+    )
+    chain = setup_and_retrieval | prompt | model | output_parser
+
+    response = chain.invoke("Wa?")
+
+    print(response)
+    print(context_packer.stats)
@@ -0,0 +1,356 @@
+import re
+import json
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import Any, Optional
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+# Name of the lexical index inside the folder of a vector store
+LEXICAL_NAME = 'lexical.sqlite'
+
+# SQLite limits the number of variables in a single statement
+SQLITE_BATCH_SIZE = 500
+
+
+def tokenize(text):
+    """
+    Terms of a text for the lexical index: lowercase words and numbers with the accents removed, so 'coöperatie'
+    matches 'cooperatie'. There is no stemming, the corpus mixes Dutch and English.
+    text: String
+    """
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(character for character in text if not unicodedata.combining(character))
+    return re.findall(r'\w+', text)
+
+
+def encode_varints(values):
+    """
+    Encode non-negative integers as LEB128 varints, seven bits per byte.
+    values: Iterable of ints
+    returns: bytes
+    """
+    output = bytearray()
+    for value in values:
+        while value >= 128:
+            output.append((value & 127) | 128)
+            value >>= 7
+        output.append(value)
+    return bytes(output)
+
+
+def decode_varints(data):
+    """
+    Decode LEB128 varints, vectorized: every byte below 128 ends a value.
+    data: bytes
+    returns: Array of int64
+    """
+    raw = np.frombuffer(data, dtype=np.uint8)
+    if len(raw) == 0:
+        return np.zeros(0, dtype=np.int64)
+    ends = np.flatnonzero(raw < 128)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    shifts = 7 * (np.arange(len(raw)) - np.repeat(starts, ends - starts + 1))
+    return np.add.reduceat((raw & 127).astype(np.int64) << shifts, starts)
+
+
+def encode_postings(documents, frequencies, previous=0):
+    """
+    Postings as interleaved varints of the gap to the previous document and the term frequency.
+    documents: Increasing document numbers
+    frequencies: Term frequency per document
+    previous: Last document number of the postings these are appended to
+    """
+    gaps = np.diff(np.asarray(documents, dtype=np.int64), prepend=previous)
+    return encode_varints(int(value) for pair in zip(gaps, frequencies) for value in pair)
+
+
+def decode_postings(data):
+    """
+    Document numbers and term frequencies of encoded postings.
+    data: bytes of encode_postings
+    """
+    values = decode_varints(data)
+    return np.cumsum(values[0::2]), values[1::2]
+
+
+class LexicalIndex:
+    """
+    BM25 index of Documents in SQLite: an inverted index with one row per term, its postings compressed as
+    delta-encoded varints. Documents can be added and deleted incrementally; new documents get increasing
+    numbers, so adding only appends to the postings of their terms. Document lengths and the postings of
+    recently queried terms are kept in memory, so a query does not touch the disk for those.
+    """
+
+    def __init__(self, path, k1=1.5, b=0.75, cache_size=4096):
+        """
+        path: Location of the SQLite database, e.g. inside the folder of a vector store
+        k1: BM25 term frequency saturation
+        b: BM25 length normalization
+        cache_size: Number of terms whose decoded postings are kept in memory
+        """
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.cache_size = cache_size
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS documents (number INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT NOT NULL "
+            "UNIQUE, length INTEGER NOT NULL, content TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS postings (term TEXT PRIMARY KEY, frequency INTEGER NOT NULL, "
+            "last INTEGER NOT NULL, data BLOB NOT NULL) WITHOUT ROWID"
+        )
+        self._connection.commit()
+        self._postings = OrderedDict()
+        self._load_lengths()
+
+    def _load_lengths(self):
+        rows = self._connection.execute("SELECT number, length FROM documents").fetchall()
+        size = max((number for number, _ in rows), default=0) + 1
+        self._lengths = np.zeros(size, dtype=np.float32)
+        for number, length in rows:
+            self._lengths[number] = length
+        self._count = len(rows)
+        self._total_length = float(self._lengths.sum())
+
+    def __len__(self):
+        return self._count
+
+    def ids(self):
+        with self._lock:
+            return [key for (key,) in self._connection.execute("SELECT id FROM documents")]
+
+    def add(self, items):
+        """
+        Index Documents, ids that are already indexed are skipped.
+        items: Iterable of (id, Document) tuples
+        returns: Number of added Documents
+        """
+        items = list(items)
+        with self._lock:
+            existing = set()
+            keys = [key for key, _ in items]
+            for start in range(0, len(keys), SQLITE_BATCH_SIZE):
+                batch = keys[start:start + SQLITE_BATCH_SIZE]
+                existing.update(key for (key,) in self._connection.execute(
+                    f"SELECT id FROM documents WHERE id IN ({','.join('?' * len(batch))})", batch))
+
+            new_postings = {}
+            lengths = {}
+            for key, document in items:
+                if key in existing:
+                    continue
+                existing.add(key)
+                terms = tokenize(document.page_content)
+                number = self._connection.execute(
+                    "INSERT INTO documents (id, length, content, metadata) VALUES (?, ?, ?, ?)",
+                    (key, len(terms), document.page_content, json.dumps(document.metadata, default=str))
+                ).lastrowid
+                lengths[number] = len(terms)
+                for term, frequency in Counter(terms).items():
+                    new_postings.setdefault(term, []).append((number, frequency))
+
+            for term, postings in new_postings.items():
+                row = self._connection.execute("SELECT frequency, last, data FROM postings WHERE term = ?",
+                                               (term,)).fetchone()
+                frequency, last, data = row if row is not None else (0, 0, b'')
+                data += encode_postings([number for number, _ in postings], [tf for _, tf in postings], last)
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO postings (term, frequency, last, data) VALUES (?, ?, ?, ?)",
+                    (term, frequency + len(postings), postings[-1][0], data))
+                self._postings.pop(term, None)
+            self._connection.commit()
+
+            if lengths:
+                size = max(lengths) + 1
+                if size > len(self._lengths):
+                    self._lengths = np.concatenate([self._lengths, np.zeros(size - len(self._lengths), np.float32)])
+                for number, length in lengths.items():
+                    self._lengths[number] = length
+                self._count += len(lengths)
+                self._total_length += sum(lengths.values())
+            return len(lengths)
+
+    def delete(self, ids):
+        """
+        Remove Documents from the index.
+        ids: Iterable of ids, unknown ids are ignored
+        """
+        ids = list(ids)
+        with self._lock:
+            rows = []
+            for start in range(0, len(ids), SQLITE_BATCH_SIZE):
+                batch = ids[start:start + SQLITE_BATCH_SIZE]
+                rows += self._connection.execute(
+                    f"SELECT number, content FROM documents WHERE id IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+            removed = {}
+            for number, content in rows:
+                for term in set(tokenize(content)):
+                    removed.setdefault(term, []).append(number)
+
+            for term, numbers in removed.items():
+                row = self._connection.execute("SELECT data FROM postings WHERE term = ?", (term,)).fetchone()
+                if row is None:
+                    continue
+                documents, frequencies = decode_postings(row[0])
+                keep = ~np.isin(documents, numbers)
+                if keep.any():
+                    self._connection.execute(
+                        "UPDATE postings SET frequency = ?, last = ?, data = ? WHERE term = ?",
+                        (int(keep.sum()), int(documents[keep][-1]),
+                         encode_postings(documents[keep], frequencies[keep].tolist()), term))
+                else:
+                    self._connection.execute("DELETE FROM postings WHERE term = ?", (term,))
+                self._postings.pop(term, None)
+            numbers = [number for number, _ in rows]
+            for start in range(0, len(numbers), SQLITE_BATCH_SIZE):
+                batch = numbers[start:start + SQLITE_BATCH_SIZE]
+                self._connection.execute(f"DELETE FROM documents WHERE number IN ({','.join('?' * len(batch))})",
+                                         batch)
+            self._connection.commit()
+
+            for number in numbers:
+                self._total_length -= float(self._lengths[number])
+                self._lengths[number] = 0
+            self._count -= len(numbers)
+            return len(numbers)
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM documents")
+            self._connection.execute("DELETE FROM postings")
+            self._connection.commit()
+            self._postings.clear()
+        self._load_lengths()
+
+    def _term_postings(self, term):
+        # Decoded postings of a term, from the in-memory cache when possible
+        if term in self._postings:
+            self._postings.move_to_end(term)
+            return self._postings[term]
+        row = self._connection.execute("SELECT data FROM postings WHERE term = ?", (term,)).fetchone()
+        postings = decode_postings(row[0]) if row is not None else None
+        self._postings[term] = postings
+        if len(self._postings) > self.cache_size:
+            self._postings.popitem(last=False)
+        return postings
+
+    def search(self, query, k=4):
+        """
+        Numbers and BM25 scores of the best matching Documents.
+        query: Query string
+        k: Number of results
+        returns: List of (number, score) tuples, best first
+        """
+        with self._lock:
+            if self._count == 0:
+                return []
+            average_length = self._total_length / self._count
+            scores = np.zeros(len(self._lengths), dtype=np.float32)
+            for term in set(tokenize(query)):
+                postings = self._term_postings(term)
+                if postings is None:
+                    continue
+                documents, frequencies = postings
+                idf = np.log(1 + (self._count - len(documents) + 0.5) / (len(documents) + 0.5))
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[documents] / average_length)
+                scores[documents] += idf * frequencies * (self.k1 + 1) / (frequencies + norm)
+        matches = np.flatnonzero(scores)
+        if len(matches) > k:
+            matches = matches[np.argpartition(-scores[matches], k - 1)[:k]]
+        matches = matches[np.argsort(-scores[matches], kind='stable')]
+        return [(int(number), float(scores[number])) for number in matches]
+
+    def documents(self, numbers):
+        """
+        Documents by number, in the given order.
+        numbers: List of document numbers of search
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT number, content, metadata FROM documents WHERE number IN ({','.join('?' * len(numbers))})",
+                list(numbers)
+            ).fetchall()
+        found = {number: Document(page_content=content, metadata=json.loads(metadata))
+                 for number, content, metadata in rows}
+        return [found[number] for number in numbers if number in found]
+
+    def similarity_search_with_score(self, query, k=4):
+        """
+        Best matching Documents and their BM25 scores, like the method of a vector store.
+        query: Query string
+        k: Number of results
+        """
+        results = self.search(query, k)
+        return list(zip(self.documents([number for number, _ in results]), [score for _, score in results]))
+
+
+def index_vector_store(lexical_index, vectorstore):
+    """
+    Add the Documents of a FAISS vector store to a lexical index under their ids in the vector store, e.g. for a
+    vector store that was built before it had a lexical index.
+    lexical_index: LexicalIndex
+    vectorstore: FAISS vector store
+    returns: Number of added Documents
+    """
+    return lexical_index.add((i, vectorstore.docstore.search(i)) for i in vectorstore.index_to_docstore_id.values())
+
+
+def reciprocal_rank_fusion(rankings, k=4, rrf_k=60, score_key='relevance_score'):
+    """
+    Fuse ranked lists of Documents by the sum of 1 / (rrf_k + rank) over the lists a Document appears in.
+    Documents are the same when their source and content are.
+    rankings: List of lists of Documents, best first
+    k: Number of Documents to return
+    rrf_k: Constant that dampens the weight of the top ranks
+    score_key: Metadata key the fused score is stored under
+    returns: List of Documents, best first
+    """
+    scores = {}
+    documents = {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking):
+            key = (document.metadata.get('source'), document.page_content)
+            scores[key] = scores.get(key, 0.0) + 1 / (rrf_k + rank + 1)
+            documents.setdefault(key, document)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [Document(page_content=documents[key].page_content,
+                     metadata={**documents[key].metadata, score_key: scores[key]}) for key in best]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever that fuses BM25 results of a LexicalIndex with the results of a dense retriever by reciprocal
+    rank fusion. The dense retriever should return fetch_k Documents. In 'lexical' mode no embedding call is
+    made, in 'dense' mode only the dense retriever is used.
+    """
+
+    lexical_index: Any
+    retriever: Optional[BaseRetriever] = None
+    mode: str = 'hybrid'
+    k: int = 4
+    fetch_k: int = 20
+    rrf_k: int = 60
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query, *, run_manager: CallbackManagerForRetrieverRun):
+        if self.mode not in ('hybrid', 'lexical', 'dense'):
+            raise ValueError(f"Unknown mode '{self.mode}', use 'hybrid', 'lexical' or 'dense'")
+        rankings = []
+        if self.mode != 'dense':
+            results = self.lexical_index.search(query, self.fetch_k if self.mode == 'hybrid' else self.k)
+            rankings.append(self.lexical_index.documents([number for number, _ in results]))
+        if self.mode != 'lexical':
+            rankings.append(self.retriever.invoke(query, config={'callbacks': run_manager.get_child()}))
+        return reciprocal_rank_fusion(rankings, self.k, self.rrf_k)
@@ -0,0 +1,251 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+import numpy as np
+from langchain_core.caches import BaseCache
+from langchain_core.globals import set_llm_cache
+from langchain_core.load import dumps, loads
+
+# Default location of the cache, shared by all scripts regardless of the working directory
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'vector_stores',
+                                  'llm_cache.sqlite')
+
+# Fraction of max_entries evicted at once, so the responses are only counted again after that many inserts
+EVICTION_FRACTION = 0.05
+
+# Seconds after which a missed lookup without an update, e.g. a failed model call, is forgotten
+MAX_PENDING_AGE = 3600
+
+
+def prompt_text(prompt):
+    """
+    Text of a prompt as seen by the cache, used for the semantic tier. Chat models pass their messages
+    serialized as JSON; only the contents of the messages are kept.
+    prompt: Prompt string passed to the cache
+    """
+    try:
+        messages = json.loads(prompt)
+    except ValueError:
+        return prompt
+    if not isinstance(messages, list):
+        return prompt
+    contents = [message.get('kwargs', {}).get('content') for message in messages if isinstance(message, dict)]
+    return "\n".join(content for content in contents if isinstance(content, str)) or prompt
+
+
+class LLMCache(BaseCache):
+    """
+    Two-tier, on-disk response cache for every langchain LLM and chat model. The exact tier is keyed on the
+    hash of the model configuration (model name and parameters) and the rendered prompt. The optional
+    semantic tier embeds the prompt and returns the response of the most similar cached prompt of the same
+    model configuration when the cosine similarity exceeds a threshold; its vectors are kept in memory as one
+    NumPy matrix per configuration. Entries expire after ttl seconds, and once the cache holds more than
+    max_entries responses the least recently used ones are evicted, EVICTION_FRACTION of max_entries below the
+    limit.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, embeddings=None, similarity_threshold=0.95, ttl=None,
+                 max_entries=100_000):
+        """
+        path: Location of the SQLite database
+        embeddings: Embeddings used for the semantic tier, no semantic tier when None
+        similarity_threshold: Minimal cosine similarity of a semantic hit
+        ttl: Number of seconds an entry stays valid, forever when None
+        max_entries: Maximum number of responses kept in the cache
+        """
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.saved_latency = 0.0
+        self._pending = OrderedDict()
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, llm_key TEXT NOT NULL, "
+            "response TEXT NOT NULL, vector BLOB, latency REAL NOT NULL, created REAL NOT NULL, "
+            "last_used REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_llm_key ON responses (llm_key)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses (created)")
+        self._connection.commit()
+        # Upper bound of the number of responses, counted exactly only when it exceeds max_entries
+        self._count = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def _hash(*parts):
+        return hashlib.sha256("\0".join(parts).encode('utf-8')).hexdigest()
+
+    def _expired(self, now):
+        return now - self.ttl if self.ttl is not None else -np.inf
+
+    def _embed(self, prompt):
+        vector = np.asarray(self.embeddings.embed_query(prompt_text(prompt)), dtype=np.float32)
+        return vector / max(np.linalg.norm(vector), 1e-12)
+
+    def _index(self, llm_key, now):
+        # Keys and vectors of the semantic tier, loaded from SQLite once per model configuration
+        if llm_key not in self._indexes:
+            rows = self._connection.execute(
+                "SELECT key, vector FROM responses WHERE llm_key = ? AND vector IS NOT NULL AND created >= ?",
+                (llm_key, self._expired(now))
+            ).fetchall()
+            keys = [key for key, _ in rows]
+            vectors = np.array([np.frombuffer(vector, dtype=np.float32) for _, vector in rows], dtype=np.float32)
+            self._indexes[llm_key] = (keys, vectors)
+        return self._indexes[llm_key]
+
+    def _get(self, key, now):
+        row = self._connection.execute(
+            "SELECT response, latency FROM responses WHERE key = ? AND created >= ?", (key, self._expired(now))
+        ).fetchone()
+        if row is not None:
+            self._connection.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self._connection.commit()
+        return row
+
+    def lookup(self, prompt, llm_string):
+        now = time.time()
+        llm_key = self._hash(llm_string)
+        key = self._hash(llm_string, prompt)
+        with self._lock:
+            row = self._get(key, now)
+            if row is not None:
+                self.exact_hits += 1
+                self.saved_latency += row[1]
+                return [loads(generation) for generation in json.loads(row[0])]
+
+        # The prompt is only embedded for the semantic tier after a miss of the exact tier
+        vector = self._embed(prompt) if self.embeddings is not None else None
+        with self._lock:
+            if vector is not None:
+                keys, vectors = self._index(llm_key, now)
+                if keys:
+                    similarities = vectors @ vector
+                    best = int(np.argmax(similarities))
+                    if similarities[best] >= self.similarity_threshold:
+                        row = self._get(keys[best], now)
+                if row is not None:
+                    self.semantic_hits += 1
+
+            if row is None:
+                self.misses += 1
+                self._pending[key] = (now, vector)
+                self._pending.move_to_end(key)
+                # Model calls that failed never update, their entries are dropped once they are old
+                while self._pending and next(iter(self._pending.values()))[0] < now - MAX_PENDING_AGE:
+                    self._pending.popitem(last=False)
+                return None
+            response, latency = row
+            self.saved_latency += latency
+        return [loads(generation) for generation in json.loads(response)]
+
+    def update(self, prompt, llm_string, return_val):
+        now = time.time()
+        llm_key = self._hash(llm_string)
+        key = self._hash(llm_string, prompt)
+        response = json.dumps([dumps(generation) for generation in return_val])
+
+        with self._lock:
+            # The time between the missed lookup and the update is the latency of the model call
+            started, vector = self._pending.pop(key, (now, None))
+            if vector is None and self.embeddings is not None:
+                vector = self._embed(prompt)
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, llm_key, response, vector, latency, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, llm_key, response, vector.tobytes() if vector is not None else None, now - started, now, now)
+            )
+            self._count += 1
+            if llm_key in self._indexes and vector is not None:
+                keys, vectors = self._indexes[llm_key]
+                if key not in keys:
+                    self._indexes[llm_key] = (keys + [key], np.vstack([vectors.reshape(-1, len(vector)), vector]))
+            self._evict(now)
+            self._connection.commit()
+
+    def _evict(self, now):
+        deleted = 0
+        if self.ttl is not None:
+            deleted = self._connection.execute("DELETE FROM responses WHERE created < ?",
+                                               (self._expired(now),)).rowcount
+            self._count -= deleted
+        if self._count > self.max_entries:
+            self._count = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            if self._count > self.max_entries:
+                excess = self._count - self.max_entries + int(self.max_entries * EVICTION_FRACTION)
+                evicted = self._connection.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used LIMIT ?)",
+                    (excess,)
+                ).rowcount
+                self._count -= evicted
+                deleted += evicted
+        if deleted:
+            # Rebuilt from SQLite on the next semantic lookup
+            self._indexes.clear()
+
+    def clear(self, **kwargs):
+        with self._lock:
+            self._connection.execute("DELETE FROM responses")
+            self._connection.commit()
+            self._count = 0
+            self._indexes.clear()
+            self._pending.clear()
+
+    def stats(self):
+        """
+        Hit and miss counters of this process, and the model latency saved by the hits.
+        """
+        hits = self.exact_hits + self.semantic_hits
+        total = hits + self.misses
+        return {'exact_hits': self.exact_hits, 'semantic_hits': self.semantic_hits, 'misses': self.misses,
+                'hit_rate': hits / total if total else 0.0, 'saved_latency': self.saved_latency}
+
+
+def enable_llm_cache(semantic=False, **kwargs):
+    """
+    Put an LLMCache in front of every LLM and chat model of the process.
+    semantic: Bool to add the semantic tier, with local embeddings unless embeddings are given
+    kwargs: Passed to LLMCache
+    returns: The cache, for its stats
+    """
+    if semantic and kwargs.get('embeddings') is None:
+        from embedding_cache import load_embeddings
+        kwargs['embeddings'] = load_embeddings('local')
+    cache = LLMCache(**kwargs)
+    set_llm_cache(cache)
+    return cache
+
+
+if __name__ == "__main__":
+    from langchain_core.output_parsers import StrOutputParser
+    from langchain_core.prompts import PromptTemplate
+    from fake_llm import FakeLLM
+
+    # Exact and semantic tier in a temporary database, with a fake model of 0.5 s per call
+    path = os.path.join(os.path.dirname(DEFAULT_CACHE_PATH), 'llm_cache_demo.sqlite')
+    cache = enable_llm_cache(semantic=True, path=path, similarity_threshold=0.9, ttl=3600, max_entries=1000)
+    cache.clear()
+    chain = PromptTemplate.from_template("Tell me a short joke about a {job} going to {place}") | FakeLLM() \
+        | StrOutputParser()
+
+    inputs = [{'job': 'chef', 'place': 'France'}, {'job': 'chef', 'place': 'France'},
+              {'job': 'chef', 'place': 'france'}, {'job': 'pilot', 'place': 'Spain'},
+              {'job': 'pilot', 'place': 'Spain'}]
+    for run_input in inputs:
+        start_time = time.perf_counter()
+        chain.invoke(run_input)
+        print(f"{run_input}: {time.perf_counter() - start_time:.2f} s")
+    print(cache.stats())
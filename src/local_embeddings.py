@@ -0,0 +1,137 @@
+import os
+import numpy as np
+import torch
+from langchain_core.embeddings import Embeddings
+from transformers import AutoModel, AutoTokenizer
+
+# Exported ONNX models are kept next to the vector stores
+ONNX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'vector_stores', 'onnx')
+
+
+class _LastHiddenState(torch.nn.Module):
+    """
+    Wrapper that returns only the last hidden state, so the model can be exported to ONNX.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+
+
+class LocalEmbeddings(Embeddings):
+    """
+    Sentence embeddings computed locally on the CPU with a Hugging Face model (mean pooling, normalized),
+    as done by sentence-transformers. Texts are sorted by token length and grouped into batches with a
+    bounded number of tokens, so little compute is wasted on padding. Runs with PyTorch or ONNX Runtime,
+    optionally with dynamic int8 quantization.
+    """
+
+    def __init__(self, model_name='sentence-transformers/all-MiniLM-L6-v2', backend='torch', quantize=False,
+                 num_threads=None, max_batch_tokens=16_384, max_batch_size=256, max_length=256):
+        """
+        model_name: Hugging Face model name or path
+        backend: 'torch' or 'onnx'
+        quantize: Bool to run with int8 weights
+        num_threads: Number of CPU threads used for inference, defaults to the number of CPUs
+        max_batch_tokens: Maximum of batch size times padded length per batch
+        max_batch_size: Maximum number of texts per batch
+        max_length: Texts are truncated to this number of tokens
+        """
+        if '/' not in model_name and not os.path.exists(model_name):
+            model_name = f'sentence-transformers/{model_name}'
+        self.model_name = model_name + ('-int8' if quantize else '')
+        self.backend = backend
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_length = max_length
+        num_threads = num_threads or os.cpu_count() or 1
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name).eval()
+        if backend == 'torch':
+            torch.set_num_threads(num_threads)
+            if quantize:
+                model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            self.model = model
+        elif backend == 'onnx':
+            self.session = self._onnx_session(model_name, model, quantize, num_threads)
+        else:
+            raise ValueError(f"backend of {backend} not allowed, choose from 'torch' and 'onnx'")
+
+    def _onnx_session(self, model_name, model, quantize, num_threads):
+        import onnxruntime
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        directory = os.path.join(ONNX_DIR, model_name.replace('/', '__'))
+        path = os.path.join(directory, 'model.onnx')
+        if not os.path.exists(path):
+            os.makedirs(directory, exist_ok=True)
+            dummy = self.tokenizer(['Hello world'], return_tensors='pt')
+            torch.onnx.export(_LastHiddenState(model), (dummy['input_ids'], dummy['attention_mask']), path,
+                              input_names=['input_ids', 'attention_mask'], output_names=['last_hidden_state'],
+                              dynamic_axes={'input_ids': {0: 'batch', 1: 'sequence'},
+                                            'attention_mask': {0: 'batch', 1: 'sequence'},
+                                            'last_hidden_state': {0: 'batch', 1: 'sequence'}},
+                              opset_version=14)
+        if quantize:
+            quantized_path = os.path.join(directory, 'model.int8.onnx')
+            if not os.path.exists(quantized_path):
+                quantize_dynamic(path, quantized_path, weight_type=QuantType.QInt8)
+            path = quantized_path
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = num_threads
+        return onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+
+    def batches(self, texts):
+        """
+        Tokenize texts and group them into length-sorted batches with a bounded number of tokens.
+        texts: List of strings
+        returns: List of (positions, padded encoding) tuples
+        """
+        encodings = self.tokenizer(texts, truncation=True, max_length=self.max_length)['input_ids']
+        order = sorted(range(len(texts)), key=lambda i: len(encodings[i]))
+        batches = []
+        batch = []
+        for position in order:
+            # The order is sorted by length, so the current text sets the padded length of the batch
+            if batch and ((len(batch) + 1) * len(encodings[position]) > self.max_batch_tokens
+                          or len(batch) == self.max_batch_size):
+                batches.append(batch)
+                batch = []
+            batch.append(position)
+        if batch:
+            batches.append(batch)
+        return [(batch, self.tokenizer.pad({'input_ids': [encodings[i] for i in batch]}, return_tensors='np'))
+                for batch in batches]
+
+    def _forward(self, input_ids, attention_mask):
+        if self.backend == 'onnx':
+            return self.session.run(None, {'input_ids': input_ids.astype(np.int64),
+                                           'attention_mask': attention_mask.astype(np.int64)})[0]
+        with torch.inference_mode():
+            return self.model(input_ids=torch.from_numpy(input_ids.astype(np.int64)),
+                              attention_mask=torch.from_numpy(attention_mask.astype(np.int64))
+                              ).last_hidden_state.numpy()
+
+    def embed_documents(self, texts):
+        texts = [text.replace("\n", " ") for text in texts]
+        if not texts:
+            return []
+        embeddings = np.zeros((len(texts), 0), dtype=np.float32)
+        for positions, encoding in self.batches(texts):
+            hidden = self._forward(encoding['input_ids'], encoding['attention_mask'])
+            mask = encoding['attention_mask'][:, :, None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+            if embeddings.shape[1] == 0:
+                embeddings = np.zeros((len(texts), pooled.shape[1]), dtype=np.float32)
+            embeddings[positions] = pooled
+        return embeddings.tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
@@ -0,0 +1,152 @@
+import os
+import json
+import sqlite3
+import threading
+import warnings
+from collections.abc import Mapping
+import faiss
+from langchain_community.docstore.base import Docstore
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
+
+# Header of the on-disk format, bump the version when the layout changes
+FORMAT_NAME = 'langchain-demo-mmap-faiss'
+FORMAT_VERSION = 1
+
+# File names inside the vector store folder
+INDEX_NAME = 'vectors.faiss'
+DOCSTORE_NAME = 'docstore.sqlite'
+HEADER_NAME = 'header.json'
+
+# Memory-map the vectors instead of reading them. Only faiss builds with IO_FLAG_MMAP_IFC (faiss >= 1.11) can do
+# so for flat indexes, older builds ignore IO_FLAG_MMAP for them and read the whole index into memory
+CAN_MMAP = hasattr(faiss, 'IO_FLAG_MMAP_IFC')
+MMAP_FLAGS = (faiss.IO_FLAG_MMAP_IFC if CAN_MMAP else 0) | faiss.IO_FLAG_READ_ONLY
+
+
+def is_mmap_store(path):
+    """
+    Check whether a folder contains a vector store in the memory-mapped format.
+    path: Folder of the vector store
+    """
+    return os.path.exists(os.path.join(path, HEADER_NAME))
+
+
+def save_mmap_store(vectorstore, path):
+    """
+    Save a FAISS vector store in the memory-mapped format: the raw faiss index, the documents in an indexed
+    SQLite table (no pickle) and a header with the format version. Every part is written to a temporary file
+    and moved into place, and the header is removed first and written last, so a crash leaves no header
+    next to a torn index.
+    vectorstore: langchain FAISS vector store
+    path: Folder to write to
+    """
+    os.makedirs(path, exist_ok=True)
+    header_path = os.path.join(path, HEADER_NAME)
+    if os.path.exists(header_path):
+        os.remove(header_path)
+
+    index_path = os.path.join(path, INDEX_NAME)
+    faiss.write_index(vectorstore.index, index_path + '.tmp')
+    os.replace(index_path + '.tmp', index_path)
+
+    docstore_path = os.path.join(path, DOCSTORE_NAME)
+    if os.path.exists(docstore_path + '.tmp'):
+        os.remove(docstore_path + '.tmp')
+    connection = sqlite3.connect(docstore_path + '.tmp')
+    connection.execute("CREATE TABLE documents (position INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, "
+                       "content TEXT NOT NULL, metadata TEXT NOT NULL)")
+    rows = []
+    for position, document_id in vectorstore.index_to_docstore_id.items():
+        document = vectorstore.docstore.search(document_id)
+        rows.append((position, document_id, document.page_content, json.dumps(document.metadata, default=str)))
+    connection.executemany("INSERT INTO documents VALUES (?, ?, ?, ?)", rows)
+    connection.commit()
+    connection.close()
+    os.replace(docstore_path + '.tmp', docstore_path)
+
+    with open(header_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'format': FORMAT_NAME, 'version': FORMAT_VERSION, 'count': vectorstore.index.ntotal,
+                   'dimension': vectorstore.index.d, 'distance_strategy': vectorstore.distance_strategy.value,
+                   'normalize_L2': vectorstore._normalize_L2}, f, indent=1)
+    os.replace(header_path + '.tmp', header_path)
+
+
+class SQLiteDocstore(Docstore):
+    """
+    Read-only docstore that fetches documents from SQLite only when they are needed, i.e. for the hits. It has
+    no add method and delete raises NotImplementedError (from Docstore), so adding to or deleting from a loaded
+    memory-mapped vector store fails: update the FAISS store and save it again instead.
+    """
+
+    def __init__(self, path):
+        """
+        path: Location of the SQLite database
+        """
+        self._connection = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True,
+                                           check_same_thread=False)
+        self._lock = threading.Lock()
+
+    def execute(self, query, parameters):
+        with self._lock:
+            return self._connection.execute(query, parameters).fetchall()
+
+    def search(self, search):
+        rows = self.execute("SELECT content, metadata FROM documents WHERE id = ?", (search,))
+        if not rows:
+            return f"ID {search} not found."
+        content, metadata = rows[0]
+        return Document(page_content=content, metadata=json.loads(metadata))
+
+
+class LazyIndexMapping(Mapping):
+    """
+    Mapping from faiss position to document id that looks the ids up in the docstore on demand.
+    """
+
+    def __init__(self, docstore, count):
+        """
+        docstore: SQLiteDocstore of the vector store
+        count: Number of vectors in the index
+        """
+        self._docstore = docstore
+        self._count = count
+
+    def __getitem__(self, position):
+        rows = self._docstore.execute("SELECT id FROM documents WHERE position = ?", (int(position),))
+        if not rows:
+            raise KeyError(position)
+        return rows[0][0]
+
+    def __iter__(self):
+        return iter(range(self._count))
+
+    def __len__(self):
+        return self._count
+
+
+def load_mmap_store(path, embeddings):
+    """
+    Load a vector store saved with save_mmap_store. With a faiss build that supports it (CAN_MMAP) the vectors
+    are memory-mapped, so startup does not depend on the size of the index and processes share the page cache;
+    other builds read the index into memory, with a warning. Documents are read lazily.
+    path: Folder of the vector store
+    embeddings: Embeddings used for queries against the vector store
+    """
+    with open(os.path.join(path, HEADER_NAME), 'r', encoding='utf-8') as f:
+        header = json.load(f)
+    if header.get('format') != FORMAT_NAME or header.get('version') != FORMAT_VERSION:
+        raise ValueError(f"Unsupported vector store format in {path}: {header.get('format')} "
+                         f"version {header.get('version')}, expected {FORMAT_NAME} version {FORMAT_VERSION}")
+
+    if not CAN_MMAP:
+        warnings.warn(f"faiss {faiss.__version__} cannot memory-map flat indexes, the index in {path} is read into "
+                      f"memory; install faiss-cpu >= 1.11, as pinned in requirements.txt, to memory-map it")
+    index = faiss.read_index(os.path.join(path, INDEX_NAME), MMAP_FLAGS)
+    if index.ntotal != header['count'] or index.d != header['dimension']:
+        raise ValueError(f"Index in {path} does not match its header, rebuild the vector store")
+
+    docstore = SQLiteDocstore(os.path.join(path, DOCSTORE_NAME))
+    return FAISS(embeddings, index, docstore, LazyIndexMapping(docstore, header['count']),
+                 normalize_L2=header['normalize_L2'], distance_strategy=DistanceStrategy(header['distance_strategy']))
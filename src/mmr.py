@@ -0,0 +1,153 @@
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+
+# Bytes of candidate vectors re-ranked together, small enough to stay in the CPU cache during the k passes
+BLOCK_BYTES = 1 << 22
+
+
+def normalize(vectors):
+    """
+    Scale vectors to unit length along the last axis, leaving zero vectors at zero.
+    vectors: float32 array
+    """
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, np.finfo(np.float32).tiny)
+
+
+def batch_maximal_marginal_relevance(query_embeddings, candidate_embeddings, k=4, lambda_mult=0.5, valid=None):
+    """
+    Maximal marginal relevance for a batch of queries, vectorized in float32. The relevance of all
+    candidates is computed in one go, and after every pick only the similarity to the newly selected
+    candidate is computed to update a running maximum, instead of recomputing the similarity to all selected
+    candidates. Every pick reads all candidate vectors again, so the queries are re-ranked in blocks of about
+    BLOCK_BYTES that stay in the CPU cache; larger blocks are bound by memory bandwidth and get slower than
+    one query at a time. Selects the same candidates as langchain's maximal_marginal_relevance.
+    query_embeddings: Array of shape (q, d)
+    candidate_embeddings: Array of shape (q, n, d), the fetched candidates of every query
+    k: Number of candidates to select
+    lambda_mult: Trade-off between relevance (1) and diversity (0)
+    valid: Optional boolean array of shape (q, n) that masks out padding candidates
+    returns: Array of shape (q, k) with the positions of the selected candidates, -1 when there are fewer
+    """
+    queries = np.asarray(query_embeddings, dtype=np.float32)
+    candidates = np.asarray(candidate_embeddings, dtype=np.float32)
+    n_queries, n_candidates = candidates.shape[:2]
+    valid = np.ones((n_queries, n_candidates), dtype=bool) if valid is None else np.asarray(valid, dtype=bool)
+
+    selected = np.full((n_queries, min(k, n_candidates)), -1)
+    if n_candidates == 0:
+        return selected
+    block = max(1, BLOCK_BYTES // max(1, candidates[0].nbytes))
+    for start in range(0, n_queries, block):
+        selected[start:start + block] = _mmr_block(queries[start:start + block], candidates[start:start + block],
+                                                   selected.shape[1], lambda_mult, valid[start:start + block])
+    return selected
+
+
+def _mmr_block(queries, candidates, k, lambda_mult, valid):
+    # MMR of a block of queries whose candidates fit in the CPU cache
+    queries = normalize(queries)
+    candidates = normalize(candidates)
+    n_queries, n_candidates = candidates.shape[:2]
+    rows = np.arange(n_queries)
+    available = valid.copy()
+    selected = np.full((n_queries, k), -1)
+    relevance = np.matmul(candidates, queries[:, :, None])[:, :, 0]
+    max_similarity = np.full((n_queries, n_candidates), -np.inf, dtype=np.float32)
+
+    for step in range(selected.shape[1]):
+        if step == 0:
+            scores = relevance.copy()
+        else:
+            scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        best = np.argmax(scores, axis=1)
+        found = available[rows, best]
+        selected[found, step] = best[found]
+        available[rows[found], best[found]] = False
+
+        # Only the similarity to the newly selected candidate is needed to update the redundancy
+        new_similarity = np.matmul(candidates, candidates[rows, best][:, :, None])[:, :, 0]
+        np.maximum(max_similarity, new_similarity, out=max_similarity)
+    return selected
+
+
+def maximal_marginal_relevance(query_embedding, embedding_list, k=4, lambda_mult=0.5):
+    """
+    Drop-in replacement of langchain's maximal_marginal_relevance for a single query.
+    query_embedding: Array of shape (d,) or (1, d)
+    embedding_list: Array or list of shape (n, d)
+    k: Number of candidates to select
+    lambda_mult: Trade-off between relevance (1) and diversity (0)
+    returns: List with the positions of the selected candidates
+    """
+    query = np.asarray(query_embedding, dtype=np.float32).reshape(1, -1)
+    candidates = np.asarray(embedding_list, dtype=np.float32).reshape(1, -1, query.shape[1])
+    selected = batch_maximal_marginal_relevance(query, candidates, k, lambda_mult)[0]
+    return [int(i) for i in selected if i >= 0]
+
+
+def faiss_mmr_search(vectorstore, embeddings, k=4, fetch_k=20, lambda_mult=0.5):
+    """
+    MMR search on a langchain FAISS vector store for a batch of query vectors: one faiss search for all
+    queries, one reconstruction of the candidate vectors and one batched MMR re-ranking.
+    vectorstore: langchain FAISS vector store
+    embeddings: List of query vectors
+    k: Number of documents to return per query
+    fetch_k: Number of candidates fetched per query
+    lambda_mult: Trade-off between relevance (1) and diversity (0)
+    returns: List with a list of Documents per query
+    """
+    queries = np.asarray(embeddings, dtype=np.float32)
+    if vectorstore._normalize_L2:
+        queries = normalize(queries)
+    _, ids = vectorstore.index.search(queries, fetch_k)
+
+    valid = ids >= 0
+    flat_ids = np.where(valid, ids, 0).ravel()
+    if hasattr(vectorstore.index, 'reconstruct_batch'):
+        vectors = vectorstore.index.reconstruct_batch(flat_ids)
+    else:
+        vectors = np.vstack([vectorstore.index.reconstruct(int(i)) for i in flat_ids])
+    candidates = vectors.reshape(ids.shape[0], ids.shape[1], -1)
+
+    selected = batch_maximal_marginal_relevance(queries, candidates, k, lambda_mult, valid)
+    results = []
+    for query_ids, query_selected in zip(ids, selected):
+        documents = []
+        for position in query_selected:
+            if position < 0:
+                continue
+            document = vectorstore.docstore.search(vectorstore.index_to_docstore_id[int(query_ids[position])])
+            documents.append(document)
+        results.append(documents)
+    return results
+
+
+class MMRRetriever(BaseRetriever):
+    """
+    MMR retriever on a FAISS vector store that re-ranks with the vectorized implementation in this module.
+    Use search_batch to retrieve for many queries with one embedding call and one faiss search.
+    """
+
+    vectorstore: VectorStore
+    k: int = 4
+    fetch_k: int = 20
+    lambda_mult: float = 0.5
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def search_batch(self, queries):
+        """
+        Retrieve documents for a list of queries.
+        queries: List of query strings
+        """
+        embeddings = self.vectorstore.embeddings.embed_documents(list(queries))
+        return faiss_mmr_search(self.vectorstore, embeddings, self.k, self.fetch_k, self.lambda_mult)
+
+    def _get_relevant_documents(self, query, *, run_manager: CallbackManagerForRetrieverRun):
+        embedding = self.vectorstore.embeddings.embed_query(query)
+        return faiss_mmr_search(self.vectorstore, [embedding], self.k, self.fetch_k, self.lambda_mult)[0]
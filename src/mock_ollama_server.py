@@ -0,0 +1,82 @@
+import json
+import time
+import asyncio
+from aiohttp import web
+
+# Port of the mock server, next to the default Ollama port 11434
+DEFAULT_PORT = 11435
+
+
+def create_app(ttft=0.2, token_interval=0.02, n_tokens=32, num_parallel=4):
+    """
+    Mock of the Ollama chat API that streams a fixed number of tokens with a fixed latency, for testing and
+    load testing clients without a model. Like Ollama, at most num_parallel requests are generated at the
+    same time and the other requests wait in a queue.
+    ttft: Seconds before the first token, the prompt evaluation
+    token_interval: Seconds per generated token
+    n_tokens: Number of tokens per response
+    num_parallel: Number of requests generated in parallel, OLLAMA_NUM_PARALLEL
+    """
+    semaphore = asyncio.Semaphore(num_parallel)
+
+    def chunk(model, content, done, **kwargs):
+        return {'model': model, 'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                'message': {'role': 'assistant', 'content': content}, 'done': done, **kwargs}
+
+    async def chat(request):
+        payload = await request.json()
+        model = payload.get('model', 'mock')
+        words = (payload.get('messages') or [{}])[-1].get('content', '').split() or ['token']
+        tokens = [words[i % len(words)] + ' ' for i in range(n_tokens)]
+
+        async with semaphore:
+            start_time = time.perf_counter()
+            await asyncio.sleep(ttft)
+            prompt_eval_duration = time.perf_counter() - start_time
+            statistics = {'prompt_eval_count': sum(len(m.get('content', '').split())
+                                                   for m in payload.get('messages', [])),
+                          'eval_count': n_tokens}
+
+            if not payload.get('stream', True):
+                await asyncio.sleep(token_interval * n_tokens)
+                total_duration = time.perf_counter() - start_time
+                return web.json_response(chunk(model, ''.join(tokens), True, done_reason='stop',
+                                               total_duration=int(total_duration * 1e9),
+                                               prompt_eval_duration=int(prompt_eval_duration * 1e9),
+                                               eval_duration=int((total_duration - prompt_eval_duration) * 1e9),
+                                               **statistics))
+
+            response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+            await response.prepare(request)
+            for token in tokens:
+                await response.write((json.dumps(chunk(model, token, False)) + '\n').encode('utf-8'))
+                await asyncio.sleep(token_interval)
+            total_duration = time.perf_counter() - start_time
+            await response.write((json.dumps(chunk(model, '', True, done_reason='stop',
+                                                   total_duration=int(total_duration * 1e9),
+                                                   prompt_eval_duration=int(prompt_eval_duration * 1e9),
+                                                   eval_duration=int((total_duration - prompt_eval_duration) * 1e9),
+                                                   **statistics)) + '\n').encode('utf-8'))
+            await response.write_eof()
+            return response
+
+    app = web.Application()
+    app.router.add_post('/api/chat', chat)
+    return app
+
+
+async def start_mock_server(port=DEFAULT_PORT, **kwargs):
+    """
+    Start the mock server on localhost in the running event loop.
+    port: Port to listen on
+    kwargs: Passed to create_app
+    returns: The runner, stop the server with await runner.cleanup()
+    """
+    runner = web.AppRunner(create_app(**kwargs))
+    await runner.setup()
+    await web.TCPSite(runner, 'localhost', port).start()
+    return runner
+
+
+if __name__ == "__main__":
+    web.run_app(create_app(), host='localhost', port=DEFAULT_PORT)
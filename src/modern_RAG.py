@@ -6,13 +6,15 @@
 from langchain_community.vectorstores import Chroma, FAISS
 from langchain_community.vectorstores import DocArrayInMemorySearch
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import RunnableParallel, RunnablePassthrough
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_experimental.text_splitter import SemanticChunker
+from langchain_openai import ChatOpenAI
 from langchain_community.document_loaders import SeleniumURLLoader
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_community.document_loaders import UnstructuredPDFLoader
+from context_packing import ContextPacker
+from embedding_cache import load_embeddings
+from lexical_index import reciprocal_rank_fusion
+from prompt_registry import get_prompt
+from semantic_chunking import FastSemanticChunker
 
 # From website
 urls = [
@@ -30,9 +32,14 @@ for doc in documents:
     d = str(doc.page_content).replace("\\n", " ").replace("\\t", " ").replace("\n", " ").replace("\t", " ")
     document_list.append(d)
 
-embedding_function = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-text_splitter = SemanticChunker(embedding_function)
-docs = text_splitter.create_documents(document_list)
+embedding_function = load_embeddings('local', model_name="all-MiniLM-L6-v2")
+text_splitter = FastSemanticChunker(embedding_function)
+docs, doc_embeddings = text_splitter.create_documents_with_embeddings(document_list,
+                                                                     [doc.metadata for doc in documents])
+
+# The chunks already have an embedding from the chunker, so they are indexed without embedding them again
+web_vectorstore = FAISS.from_embeddings(zip([doc.page_content for doc in docs], doc_embeddings), embedding_function,
+                                        metadatas=[doc.metadata for doc in docs])
 
 # From PDF
 loader = UnstructuredPDFLoader("example_data/layout-parser-paper.pdf")
@@ -42,25 +49,26 @@ data = loader.load()
 model = ChatOpenAI(model="gpt-3.5-turbo-0125")
 
 # Create the vectorstore
-vectorstore = FAISS.from_documents(data, OpenAIEmbeddings())
+vectorstore = FAISS.from_documents(data, load_embeddings('openai'))
 
 # docs = vectorstore.similarity_search("How will the community be engaged?", k=2)
 # for doc in docs:
 #     print(str(doc.metadata["page"]) + ":", doc.page_content[:300])
 
-retriever = vectorstore.as_retriever()
-
-# Build a prompt template
-template = """Answer the question based only on the following context:
-{context}
+# The web pages and the PDF are embedded with different models, their rankings are fused
+retriever = RunnableParallel(
+    {"web": web_vectorstore.as_retriever(), "pdf": vectorstore.as_retriever()}
+) | (lambda rankings: reciprocal_rank_fusion([rankings["web"], rankings["pdf"]], k=4))
 
-Question: {question}
-"""
-prompt = ChatPromptTemplate.from_template(template)
+# Load the prompt template
+prompt = get_prompt('rag-answer')
 output_parser = StrOutputParser()
 
+# Pack the retrieved chunks into clean text of at most 3000 tokens
+context_packer = ContextPacker(max_tokens=3000, model=model.model_name)
+
 setup_and_retrieval = RunnableParallel(
-    {"context": retriever, "question": RunnablePassthrough()}
+    {"context": retriever | context_packer.pack, "question": RunnablePassthrough()}
 )
 chain = setup_and_retrieval | prompt | model | output_parser
 
@@ -1,57 +1,44 @@
+from langchain_core.output_parsers import StrOutputParser
+from langchain_openai import ChatOpenAI
 from langchain_text_splitters import CharacterTextSplitter
-from unstructured.partition.pdf import partition_pdf
+from unstructured.documents.elements import CompositeElement, Table
+from embedding_cache import load_embeddings
+from multi_vector import MultiVectorIndex
+from pdf_extraction import stream_pdf_elements
+from prompt_registry import get_prompt
+from scheduler import AdaptiveScheduler, ProgressStore
 
 
 # Extract elements from PDF
-def extract_pdf_elements(path, fname):
+def extract_pdf_elements(path, fname, pages_per_shard=20, max_workers=None):
     """
-    Extract images, tables, and chunk text from a PDF file.
+    Extract images, tables, and chunk text from a PDF file. Page ranges are extracted in parallel and cached,
+    and the elements are yielded in page order.
     path: File path, which is used to dump images (.jpg)
     fname: File name
+    pages_per_shard: Maximum number of pages extracted by one worker process at a time
+    max_workers: Number of worker processes, defaults to the number of CPUs
     """
-    return partition_pdf(
-        filename=path + fname,
-        extract_images_in_pdf=False,
-        infer_table_structure=True,
-        chunking_strategy="by_title",
-        max_characters=4000,
-        new_after_n_chars=3800,
-        combine_text_under_n_chars=2000,
-        image_output_dir_path=path,
-    )
+    return stream_pdf_elements([path + fname], pages_per_shard, max_workers, image_output_dir_path=path)
 
 
 # Categorize elements by type
 def categorize_elements(raw_pdf_elements):
     """
     Categorize extracted elements from a PDF into tables and texts.
-    raw_pdf_elements: List of unstructured.documents.elements
+    raw_pdf_elements: Iterable of unstructured.documents.elements
     """
     tables = []
     texts = []
     for element in raw_pdf_elements:
-        if "unstructured.documents.elements.Table" in str(type(element)):
+        # Table chunks are Tables as well
+        if isinstance(element, Table):
             tables.append(str(element))
-        elif "unstructured.documents.elements.CompositeElement" in str(type(element)):
+        elif isinstance(element, CompositeElement):
             texts.append(str(element))
     return texts, tables
 
 
-# File path
-fpath = "/Users/rlm/Desktop/cj/"
-fname = "cj.pdf"
-
-# Get elements
-raw_pdf_elements = extract_pdf_elements(fpath, fname)
-
-# Get text, tables
-texts, tables = categorize_elements(raw_pdf_elements)
-
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
-
-
 # Generate summaries of text elements
 def generate_text_summaries(texts, tables, summarize_texts=False):
     """
@@ -62,34 +49,66 @@ def generate_text_summaries(texts, tables, summarize_texts=False):
     """
 
     # Prompt
-    prompt_text = """You are an assistant tasked with summarizing tables and text for retrieval. \
-    These summaries will be embedded and used to retrieve the raw text or table elements. \
-    Give a concise summary of the table or text that is well optimized for retrieval. Table or text: {element} """
-    prompt = ChatPromptTemplate.from_template(prompt_text)
+    prompt = get_prompt('element-summary')
 
-    # Text summary chain
-    model = ChatOpenAI(temperature=0, model="gpt-4")
+    # Text summary chain, retries are left to the scheduler so it sees the rate limit responses
+    model = ChatOpenAI(temperature=0, model="gpt-4", max_retries=0)
     summarize_chain = {"element": lambda x: x} | prompt | model | StrOutputParser()
 
+    # Adaptive concurrency with retries, finished summaries are persisted so an interrupted job resumes
+    scheduler = AdaptiveScheduler(max_concurrency=16, progress=ProgressStore(job='multi_modal_summaries'))
+
     # Initialize empty summaries
     text_summaries = []
     table_summaries = []
 
     # Apply to text if texts are provided and summarization is requested
     if texts and summarize_texts:
-        text_summaries = summarize_chain.batch(texts, {"max_concurrency": 5})
+        text_summaries = scheduler.run(summarize_chain, texts)
     elif texts:
         text_summaries = texts
 
     # Apply to tables if tables are provided
     if tables:
-        table_summaries = summarize_chain.batch(tables, {"max_concurrency": 5})
+        table_summaries = scheduler.run(summarize_chain, tables)
 
     return text_summaries, table_summaries
 
 
-# Get text, table summaries
-text_summaries, table_summaries = generate_text_summaries(
-    texts_4k_token, tables, summarize_texts=True
-)
+if __name__ == "__main__":
+    # File path
+    fpath = "/Users/rlm/Desktop/cj/"
+    fname = "cj.pdf"
+
+    # Get text, tables from the stream of elements
+    texts, tables = categorize_elements(extract_pdf_elements(fpath, fname))
+
+    # Optional: enforce a specific token size for texts
+    text_splitter = CharacterTextSplitter.from_tiktoken_encoder(chunk_size=4000, chunk_overlap=0)
+    texts_4k_token = text_splitter.split_text(" ".join(texts))
+
+    # Multi-vector index: the summaries are embedded, the raw texts and tables are stored in a docstore
+    index = MultiVectorIndex('../vector_stores/multi_modal', load_embeddings('openai'))
+    source = fpath + fname
+    contents = texts_4k_token + tables
+    kinds = ['text'] * len(texts_4k_token) + ['table'] * len(tables)
+
+    # Get text, table summaries, only for the elements that are not indexed yet
+    missing = index.missing(source, contents)
+    new_texts = [contents[i] for i in missing if kinds[i] == 'text']
+    new_tables = [contents[i] for i in missing if kinds[i] == 'table']
+    text_summaries, table_summaries = generate_text_summaries(
+        new_texts, new_tables, summarize_texts=True
+    )
 
+    # Add the new elements and remove the ones that are no longer in the file
+    summaries = [None] * len(contents)
+    new_summaries = iter(text_summaries + table_summaries)
+    for i in [i for i in missing if kinds[i] == 'text'] + [i for i in missing if kinds[i] == 'table']:
+        summaries[i] = next(new_summaries)
+    added, removed = index.update(source, contents, summaries, kinds)
+    print(f"{added} elements added, {removed} elements removed")
+
+    # Retrieve raw texts and tables via their summaries
+    retriever = index.as_retriever(search_kwargs={'k': 4})
+    print(retriever.invoke("What are the EV / NTM and NTM rev growth for MongoDB, Cloudflare, and Datadog?"))
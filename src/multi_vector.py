@@ -0,0 +1,191 @@
+import os
+import json
+import sqlite3
+import threading
+from langchain.retrievers.multi_vector import MultiVectorRetriever
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.stores import BaseStore
+from ingestion import chunk_id
+
+# SQLite limits the number of variables in a single statement
+SQLITE_BATCH_SIZE = 500
+
+# Names of the parts of a multi-vector index inside its folder
+SUMMARIES_NAME = 'summaries.faiss'
+DOCSTORE_NAME = 'docstore.sqlite'
+
+
+class SQLiteDocumentStore(BaseStore):
+    """
+    Persistent key-value store of Documents in SQLite, the docstore of a multi-vector retriever. Every key is
+    the primary key of a row, so a batch of hits is fetched with one indexed query. The source of every
+    Document is stored in an indexed column, to find the keys of a source on an incremental update.
+    """
+
+    def __init__(self, path):
+        """
+        path: Location of the SQLite database
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS documents (key TEXT PRIMARY KEY, source TEXT, content TEXT NOT NULL, "
+            "metadata TEXT NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS documents_source ON documents (source)")
+        self._connection.commit()
+
+    def mget(self, keys):
+        keys = list(keys)
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), SQLITE_BATCH_SIZE):
+                batch = keys[start:start + SQLITE_BATCH_SIZE]
+                rows = self._connection.execute(
+                    f"SELECT key, content, metadata FROM documents WHERE key IN ({','.join('?' * len(batch))})",
+                    batch
+                ).fetchall()
+                for key, content, metadata in rows:
+                    found[key] = Document(page_content=content, metadata=json.loads(metadata))
+        return [found.get(key) for key in keys]
+
+    def mset(self, key_value_pairs):
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO documents (key, source, content, metadata) VALUES (?, ?, ?, ?)",
+                [(key, document.metadata.get('source'), document.page_content, json.dumps(document.metadata))
+                 for key, document in key_value_pairs]
+            )
+            self._connection.commit()
+
+    def mdelete(self, keys):
+        keys = list(keys)
+        with self._lock:
+            for start in range(0, len(keys), SQLITE_BATCH_SIZE):
+                batch = keys[start:start + SQLITE_BATCH_SIZE]
+                self._connection.execute(f"DELETE FROM documents WHERE key IN ({','.join('?' * len(batch))})",
+                                         batch)
+            self._connection.commit()
+
+    def yield_keys(self, prefix=None):
+        with self._lock:
+            if prefix is None:
+                rows = self._connection.execute("SELECT key FROM documents").fetchall()
+            else:
+                rows = self._connection.execute("SELECT key FROM documents WHERE key LIKE ? ESCAPE '\\'",
+                                                (prefix.replace('\\', '\\\\').replace('%', '\\%')
+                                                 .replace('_', '\\_') + '%',)).fetchall()
+        for (key,) in rows:
+            yield key
+
+    def keys_of(self, source):
+        """
+        Keys of all Documents of a source.
+        source: Value of the source metadata
+        """
+        with self._lock:
+            return [key for (key,) in self._connection.execute("SELECT key FROM documents WHERE source = ?",
+                                                               (source,))]
+
+
+class MultiVectorIndex:
+    """
+    Multi-vector index of raw elements (texts, tables) and their summaries, saved in one folder: the
+    summaries are embedded into a FAISS index, the raw elements are kept in a SQLiteDocumentStore, and both
+    use the same id, the hash of the source and the raw content. Updates are incremental: elements that are
+    already indexed are not summarized or embedded again, and elements that disappeared from a source are
+    removed. The docstore is the record of what is indexed and is only changed after the FAISS index is saved,
+    so an update that stops in between is redone by the next one.
+    """
+
+    def __init__(self, path, embeddings, id_key='doc_id'):
+        """
+        path: Folder of the index
+        embeddings: Embeddings used for the summaries
+        id_key: Metadata key of the summaries that holds the id of the raw element
+        """
+        self.path = path
+        self.embeddings = embeddings
+        self.id_key = id_key
+        self.docstore = SQLiteDocumentStore(os.path.join(path, DOCSTORE_NAME))
+        summaries_path = os.path.join(path, SUMMARIES_NAME)
+        self.vectorstore = None
+        if os.path.exists(summaries_path):
+            self.vectorstore = FAISS.load_local(summaries_path, embeddings, allow_dangerous_deserialization=True)
+
+    def missing(self, source, contents):
+        """
+        Positions of the contents of a source that are not in the index yet, so only those are summarized.
+        source: Name of the source, e.g. the PDF file
+        contents: List of raw element texts
+        """
+        ids = [chunk_id(source, content) for content in contents]
+        found = self.docstore.mget(ids)
+        return [position for position, document in enumerate(found) if document is None]
+
+    def _in_vectorstore(self, keys):
+        # The keys that have a vector, e.g. left by an update that stopped before the docstore was written
+        if self.vectorstore is None:
+            return set()
+        return {key for key in keys if isinstance(self.vectorstore.docstore.search(key), Document)}
+
+    def update(self, source, contents, summaries, kinds=None):
+        """
+        Make the index hold exactly the given elements of a source: add the new ones, remove the ones that
+        are gone, and save. Summaries are only used, and embedded, for elements that are not indexed yet.
+        source: Name of the source, e.g. the PDF file
+        contents: List of raw element texts of the source
+        summaries: List with the summary of every content, None for contents that are already indexed
+        kinds: Optional list with the kind of every element, e.g. 'text' or 'table'
+        returns: Number of added and removed elements
+        """
+        kinds = kinds or ['text'] * len(contents)
+        ids = [chunk_id(source, content) for content in contents]
+        new = set(self.missing(source, contents))
+        stale = set(self.docstore.keys_of(source)) - set(ids)
+
+        added = {}
+        for position in sorted(new):
+            added.setdefault(ids[position], position)
+        removed = self._in_vectorstore(stale | set(added))
+        if removed:
+            self.vectorstore.delete(list(removed))
+        if added:
+            positions = list(added.values())
+            metadatas = [{self.id_key: ids[p], 'source': source, 'kind': kinds[p]} for p in positions]
+            texts = [summaries[p] for p in positions]
+            vectors = self.embeddings.embed_documents(texts)
+            if self.vectorstore is None:
+                self.vectorstore = FAISS.from_embeddings(list(zip(texts, vectors)), self.embeddings,
+                                                         metadatas=metadatas, ids=list(added))
+            else:
+                self.vectorstore.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=list(added))
+        if added or removed:
+            self.save()
+
+        # The docstore only follows the saved FAISS index
+        if stale:
+            self.docstore.mdelete(stale)
+        if added:
+            self.docstore.mset([(key, Document(page_content=contents[p],
+                                               metadata={'source': source, 'kind': kinds[p]}))
+                                for key, p in added.items()])
+        return len(added), len(stale)
+
+    def save(self):
+        if self.vectorstore is not None:
+            self.vectorstore.save_local(os.path.join(self.path, SUMMARIES_NAME))
+
+    def as_retriever(self, **kwargs):
+        """
+        MultiVectorRetriever that searches the summaries and returns the raw elements, fetched from the
+        docstore in one batched lookup per query.
+        kwargs: Passed to MultiVectorRetriever, e.g. search_kwargs
+        """
+        if self.vectorstore is None:
+            raise ValueError(f"The multi-vector index at {self.path} is empty, update it first")
+        return MultiVectorRetriever(vectorstore=self.vectorstore, docstore=self.docstore, id_key=self.id_key,
+                                    **kwargs)
@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import asyncio
+import httpx
+import numpy as np
+from typing import Any
+from langchain_community.chat_models import ChatOllama
+
+# Same default as the ollama package
+DEFAULT_HOST = os.environ.get('OLLAMA_HOST', 'http://localhost:11434')
+
+# Parameters of the Ollama API that go into the options of a request, others are top level fields like format
+MODEL_OPTIONS = {'num_keep', 'seed', 'num_predict', 'top_k', 'top_p', 'min_p', 'tfs_z', 'typical_p', 'repeat_last_n',
+                 'temperature', 'repeat_penalty', 'presence_penalty', 'frequency_penalty', 'mirostat', 'mirostat_tau',
+                 'mirostat_eta', 'penalize_newline', 'stop', 'numa', 'num_ctx', 'num_batch', 'num_gpu', 'main_gpu',
+                 'low_vram', 'vocab_only', 'use_mmap', 'use_mlock', 'num_thread'}
+
+
+class OllamaChatClient:
+    """
+    Async client of the Ollama chat API that reuses one pool of HTTP connections for all requests and limits
+    the number of concurrent requests with a semaphore. Every request is streamed, and the time to first
+    token, tokens per second and total latency are recorded in metrics. Create the client inside the event
+    loop that uses it, preferably as an async context manager.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, max_concurrency=8, timeout=300.0):
+        """
+        host: URL of the Ollama server
+        max_concurrency: Maximum number of requests in flight, and size of the connection pool
+        timeout: Seconds to wait for the server, per read
+        """
+        self.host = host
+        self.max_concurrency = max_concurrency
+        self.metrics = []
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client = httpx.AsyncClient(base_url=host, timeout=timeout,
+                                         limits=httpx.Limits(max_connections=max_concurrency,
+                                                             max_keepalive_connections=max_concurrency))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    async def stream(self, path, payload, headers=None):
+        """
+        Stream the raw NDJSON lines of a request and record its metrics.
+        path: API path, e.g. '/api/chat'
+        payload: JSON payload of the request
+        headers: Optional extra HTTP headers, e.g. for authentication
+        """
+        queued = time.perf_counter()
+        async with self._semaphore:
+            start_time = time.perf_counter()
+            first_token = None
+            n_chunks = 0
+            final = {}
+            async with self._client.stream('POST', path, json={**payload, 'stream': True},
+                                           headers=headers) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    raise ValueError(f"Ollama call failed with status code {response.status_code}. "
+                                     f"Details: {response.text}")
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    part = json.loads(line)
+                    if part.get('message', {}).get('content') or part.get('response'):
+                        n_chunks += 1
+                        if first_token is None:
+                            first_token = time.perf_counter()
+                    if part.get('done'):
+                        final = part
+                    yield line
+            end_time = time.perf_counter()
+
+        # Ollama reports the number of generated tokens in the final chunk, otherwise every chunk is a token
+        tokens = final.get('eval_count', n_chunks)
+        first_token = first_token or end_time
+        self.metrics.append({'model': payload.get('model'),
+                             'queue_time': start_time - queued,
+                             'ttft': first_token - start_time,
+                             'tokens': tokens,
+                             'tokens_per_sec': tokens / (end_time - first_token) if end_time > first_token else 0.0,
+                             'latency': end_time - start_time})
+
+    async def stream_chat(self, model, messages, **options):
+        """
+        Stream the content of a chat response.
+        model: Name of the Ollama model
+        messages: List of {'role': ..., 'content': ...} dictionaries
+        options: Model options, e.g. temperature
+        """
+        payload = {'model': model, 'messages': messages}
+        if options:
+            payload['options'] = options
+        async for line in self.stream('/api/chat', payload):
+            content = json.loads(line).get('message', {}).get('content')
+            if content:
+                yield content
+
+    async def chat(self, model, messages, **options):
+        """
+        Full content of a chat response, streamed from the server.
+        model: Name of the Ollama model
+        messages: List of {'role': ..., 'content': ...} dictionaries
+        options: Model options, e.g. temperature
+        """
+        return ''.join([content async for content in self.stream_chat(model, messages, **options)])
+
+    async def chat_many(self, model, conversations, **options):
+        """
+        Run many conversations concurrently, at most max_concurrency at the same time.
+        model: Name of the Ollama model
+        conversations: List with a list of messages per conversation
+        options: Model options, e.g. temperature
+        """
+        return await asyncio.gather(*[self.chat(model, messages, **options) for messages in conversations])
+
+    def summary(self, metrics=None):
+        """
+        Aggregate metrics of the recorded requests.
+        metrics: List of request metrics, all recorded requests when None
+        """
+        metrics = self.metrics if metrics is None else metrics
+        if not metrics:
+            return {}
+        values = {key: np.array([m[key] for m in metrics]) for key in ('ttft', 'tokens_per_sec', 'latency')}
+        return {'requests': len(metrics),
+                'tokens': int(sum(m['tokens'] for m in metrics)),
+                'p50_ttft': float(np.percentile(values['ttft'], 50)),
+                'p95_ttft': float(np.percentile(values['ttft'], 95)),
+                'mean_tokens_per_sec': float(values['tokens_per_sec'].mean()),
+                'p50_latency': float(np.percentile(values['latency'], 50)),
+                'p95_latency': float(np.percentile(values['latency'], 95))}
+
+
+class PooledChatOllama(ChatOllama):
+    """
+    ChatOllama whose async calls (ainvoke, abatch, astream) go through a shared OllamaChatClient instead of a
+    new HTTP session per call, so LCEL chains reuse pooled connections and record token-level metrics. Call
+    arguments that are model options (MODEL_OPTIONS) go into the options of the request, the others, e.g.
+    format or keep_alive, are top level fields. Sync calls keep using ChatOllama's own implementation.
+    """
+
+    client: Any = None
+
+    async def _acreate_stream(self, api_url, payload, stop=None, **kwargs):
+        if self.client is None:
+            async for line in super()._acreate_stream(api_url, payload, stop, **kwargs):
+                yield line
+            return
+        if self.stop is not None and stop is not None:
+            raise ValueError("`stop` found in both the input and default params.")
+        params = self._default_params
+        options = kwargs.pop('options', None)
+        if options is None:
+            options = {**params['options'], 'stop': stop or self.stop,
+                       **{key: value for key, value in kwargs.items() if key in MODEL_OPTIONS}}
+        params.update({key: value for key, value in kwargs.items() if key not in MODEL_OPTIONS})
+        params['options'] = {key: value for key, value in options.items() if value is not None}
+        request_payload = {**{key: value for key, value in params.items() if value is not None}, **payload}
+        headers = self.headers if isinstance(self.headers, dict) else None
+        async for line in self.client.stream(api_url[len(self.base_url):], request_payload, headers):
+            yield line
+
+
+async def load_test(host=DEFAULT_HOST, model='llama3', concurrency_levels=(1, 2, 4, 8, 16), n_requests=32,
+                    messages=None):
+    """
+    Throughput of the server at increasing concurrency, with a new pooled client per level.
+    host: URL of the Ollama server
+    model: Name of the Ollama model
+    concurrency_levels: Numbers of concurrent requests
+    n_requests: Number of requests per level
+    messages: Messages of every request
+    returns: List with a dictionary of results per concurrency level
+    """
+    messages = messages or [{'role': 'user', 'content': 'Write a Haiku about the beauty of sunflowers'}]
+    results = []
+    for concurrency in concurrency_levels:
+        async with OllamaChatClient(host, max_concurrency=concurrency) as client:
+            start_time = time.perf_counter()
+            await client.chat_many(model, [messages] * n_requests)
+            elapsed = time.perf_counter() - start_time
+            summary = client.summary()
+        results.append({'concurrency': concurrency,
+                        'requests_per_sec': n_requests / elapsed,
+                        'tokens_per_sec': summary['tokens'] / elapsed,
+                        **summary})
+    return results
+
+
+if __name__ == "__main__":
+    from mock_ollama_server import DEFAULT_PORT, start_mock_server
+
+    # Load test against the mock server, or against a running Ollama server with use_mock_server = False
+    use_mock_server = True
+    model = 'llama3'
+    concurrency_levels = [1, 2, 4, 8, 16]
+    n_requests = 32
+
+    async def main():
+        runner = await start_mock_server(DEFAULT_PORT) if use_mock_server else None
+        host = f'http://localhost:{DEFAULT_PORT}' if use_mock_server else DEFAULT_HOST
+        try:
+            for result in await load_test(host, model, concurrency_levels, n_requests):
+                print(f"concurrency {result['concurrency']:>3}: {result['requests_per_sec']:.1f} requests/sec, "
+                      f"{result['tokens_per_sec']:.0f} tokens/sec, "
+                      f"TTFT p50 {result['p50_ttft']:.2f} s p95 {result['p95_ttft']:.2f} s, "
+                      f"latency p50 {result['p50_latency']:.2f} s p95 {result['p95_latency']:.2f} s")
+        finally:
+            if runner is not None:
+                await runner.cleanup()
+
+    asyncio.run(main())
@@ -1,23 +1,59 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from langchain.agents.agent_types import AgentType
 from langchain_openai import OpenAI, ChatOpenAI
 import openai
 from langchain_experimental.agents.agent_toolkits import create_pandas_dataframe_agent
-import pandas as pd
+from dataframe_cache import cache_csv, load_cached, preload_code, session_code
+from repl_pool import ReplPoolTool, ReplWorkerPool
 
 # Load the .env file
 load_dotenv()
 openai.api_key = os.environ["OPENAI_API_KEY"]
 
-# Load a dataset
-titanic = pd.read_csv(
-    "https://raw.githubusercontent.com/pandas-dev/pandas/main/doc/data/titanic.csv"
-)
+# Settings of the sandbox that runs the code of the agents
+n_workers = 4
+timeout = 30
+memory_limit_mb = 4096
 
-agent = create_pandas_dataframe_agent(OpenAI(model='gpt-3.5-turbo-instruct', temperature=0),
-                                      titanic,
-                                      verbose=True,
-                                      allow_dangerous_code=True)
+questions = [
+    "What is the correlation between the fare and the rate of survival?",
+    "What was the survival rate per passenger class?",
+    "How many passengers were younger than 18, and how many of them survived?",
+]
 
-agent.invoke("What is the correlation between the fare and the rate of survival?")
+
+def create_agent(llm, titanic, pool, session_id):
+    """
+    Pandas dataframe agent whose code runs in a session of the worker pool instead of in this process.
+    llm: Language model of the agent
+    titanic: The DataFrame, for the prompt
+    pool: ReplWorkerPool with the DataFrame preloaded as df
+    session_id: Name of the session of the agent
+    """
+    agent = create_pandas_dataframe_agent(llm,
+                                          titanic,
+                                          verbose=True,
+                                          allow_dangerous_code=True)
+    # The prompt refers to the tool by name, the sandboxed tool takes the place of the in-process one
+    agent.tools = [ReplPoolTool(pool=pool, session_id=session_id)]
+    return agent
+
+
+if __name__ == "__main__":
+    # Load the dataset, downloaded only once
+    path = cache_csv("https://raw.githubusercontent.com/pandas-dev/pandas/main/doc/data/titanic.csv")
+    titanic = load_cached(path)
+
+    llm = OpenAI(model='gpt-3.5-turbo-instruct', temperature=0)
+    with ReplWorkerPool(n_workers=n_workers, preload=preload_code(path), session_setup=session_code(),
+                        preload_modules=['pandas', 'pyarrow'], timeout=timeout,
+                        memory_limit_mb=memory_limit_mb) as pool:
+        # Every question gets its own agent and session, the questions are answered concurrently
+        agents = [create_agent(llm, titanic, pool, f'question-{i}') for i in range(len(questions))]
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            answers = list(executor.map(lambda pair: pair[0].invoke(pair[1]), zip(agents, questions)))
+        for answer in answers:
+            print(answer['output'])
+        print(pool.summary())
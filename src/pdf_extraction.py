@@ -0,0 +1,119 @@
+import os
+import json
+import hashlib
+import tempfile
+from pypdf import PdfReader, PdfWriter
+from unstructured.partition.pdf import partition_pdf
+from unstructured.staging.base import elements_from_json, elements_to_json
+from ingestion import file_hash, ordered_map
+
+# Extracted elements are cached next to the vector stores
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'vector_stores', 'pdf_elements')
+
+# Options of partition_pdf, as used by multi_modal_RAG.py
+DEFAULT_OPTIONS = {
+    'extract_images_in_pdf': False,
+    'infer_table_structure': True,
+    'chunking_strategy': "by_title",
+    'max_characters': 4000,
+    'new_after_n_chars': 3800,
+    'combine_text_under_n_chars': 2000,
+}
+
+
+def page_count(filename):
+    """
+    Number of pages of a PDF file.
+    filename: Path of the PDF file
+    """
+    return len(PdfReader(filename).pages)
+
+
+def page_ranges(n_pages, pages_per_shard=20):
+    """
+    Split the pages of a document into consecutive shards.
+    n_pages: Number of pages
+    pages_per_shard: Maximum number of pages per shard
+    returns: List of (first_page, last_page) tuples, 1-based and inclusive
+    """
+    return [(first, min(first + pages_per_shard - 1, n_pages)) for first in range(1, n_pages + 1, pages_per_shard)]
+
+
+def shard_cache_path(cache_dir, key, first_page, last_page, options):
+    """
+    Location of the cached elements of a shard, unique per file content, page range and options.
+    cache_dir: Directory of the cache
+    key: Hash of the file
+    first_page: First page of the shard
+    last_page: Last page of the shard
+    options: Options of partition_pdf
+    """
+    digest = hashlib.sha256(json.dumps({'file': key, 'pages': [first_page, last_page], 'options': options},
+                                       sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, f'{digest}.json')
+
+
+def extract_shard(filename, first_page, last_page, options, cache_path=None):
+    """
+    Partition a page range of a PDF file, or read it from the cache. Runs in a worker process.
+    filename: Path of the PDF file
+    first_page: First page of the shard, 1-based
+    last_page: Last page of the shard, inclusive
+    options: Options of partition_pdf
+    cache_path: Location of the cached elements, no caching when None
+    returns: The elements serialized as JSON, which is cheaper to send between processes than the elements
+    """
+    if cache_path is not None and os.path.exists(cache_path):
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    reader = PdfReader(filename)
+    if first_page == 1 and last_page == len(reader.pages):
+        elements = partition_pdf(filename=filename, **options)
+    else:
+        # Only the pages of the shard are written to a temporary file; page numbers and the file name in the
+        # metadata refer to the original file
+        writer = PdfWriter()
+        for page in reader.pages[first_page - 1:last_page]:
+            writer.add_page(page)
+        with tempfile.TemporaryDirectory() as directory:
+            shard_path = os.path.join(directory, os.path.basename(filename))
+            writer.write(shard_path)
+            elements = partition_pdf(filename=shard_path, metadata_filename=filename,
+                                     starting_page_number=first_page, **options)
+    text = elements_to_json(elements)
+
+    if cache_path is not None:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        temporary_path = f'{cache_path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(temporary_path, cache_path)
+    return text
+
+
+def stream_pdf_elements(filenames, pages_per_shard=20, max_workers=None, cache_dir=DEFAULT_CACHE_DIR, **options):
+    """
+    Extract the elements of PDF files, split into page ranges that are partitioned in a pool of worker
+    processes, and yield them in document order as soon as every shard before them is done. The elements of
+    every shard are cached per file hash, page range and options, so unchanged files are not partitioned
+    again. Chunks of a chunking strategy do not cross shard boundaries.
+    Scripts calling this need an `if __name__ == "__main__":` guard on platforms that spawn processes.
+    filenames: List of PDF files
+    pages_per_shard: Maximum number of pages per shard
+    max_workers: Number of worker processes, defaults to the number of CPUs. 1 extracts in this process
+    cache_dir: Directory of the cache, no caching when None
+    options: Options of partition_pdf, added to DEFAULT_OPTIONS
+    """
+    options = {**DEFAULT_OPTIONS, **options}
+    shards = []
+    for filename in filenames:
+        key = file_hash(filename)
+        for first_page, last_page in page_ranges(page_count(filename), pages_per_shard):
+            cache_path = None
+            if cache_dir is not None:
+                cache_path = shard_cache_path(cache_dir, key, first_page, last_page, options)
+            shards.append((filename, first_page, last_page, options, cache_path))
+
+    for text in ordered_map(extract_shard, shards, max_workers):
+        yield from elements_from_json(text=text)
@@ -0,0 +1,186 @@
+import os
+import json
+import threading
+from langchain_core.prompts import ChatPromptTemplate, PromptTemplate
+
+# The prompts are kept in the repository, next to the source
+DEFAULT_PROMPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'prompts')
+
+# Manifest of the registry inside its folder
+MANIFEST_NAME = 'registry.json'
+
+# Registries loaded in this process, per folder
+_registries = {}
+_lock = threading.Lock()
+
+
+class PromptRegistry:
+    """
+    Versioned prompt templates in a folder: every version of a prompt is a text file, <name>/v<version>.txt,
+    and the manifest pins the version every prompt resolves to, its kind ('chat' or 'text'), its input
+    variables and optionally the LangChain Hub repo it is synced from. Templates are compiled once per
+    version, so loading a prompt does not parse or fetch anything.
+    """
+
+    def __init__(self, path=DEFAULT_PROMPTS_DIR):
+        """
+        path: Folder of the registry
+        """
+        self.path = path
+        with open(os.path.join(path, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            self._manifest = json.load(f)
+        self._compiled = {}
+        self._lock = threading.Lock()
+
+    def names(self):
+        return sorted(self._manifest)
+
+    def versions(self, name):
+        """
+        Versions of a prompt that are on disk, oldest first.
+        name: Name of the prompt
+        """
+        files = os.listdir(os.path.join(self.path, name))
+        return sorted((file[1:-4] for file in files if file.startswith('v') and file.endswith('.txt')), key=int)
+
+    def text(self, name, version=None):
+        """
+        Source of a template.
+        name: Name of the prompt
+        version: Version to load, by default the version pinned in the manifest
+        """
+        if name not in self._manifest:
+            raise KeyError(f"Unknown prompt '{name}', the registry at {self.path} has: {', '.join(self.names())}")
+        version = version or self._manifest[name]['version']
+        with open(os.path.join(self.path, name, f'v{version}.txt'), 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def get(self, name, version=None):
+        """
+        Compiled template of a prompt, the same object on every call.
+        name: Name of the prompt
+        version: Version to load, by default the version pinned in the manifest
+        returns: ChatPromptTemplate or PromptTemplate
+        """
+        version = version or self._manifest.get(name, {}).get('version')
+        with self._lock:
+            if (name, version) not in self._compiled:
+                entry = self._manifest.get(name, {})
+                text = self.text(name, version)
+                if entry.get('kind', 'chat') == 'chat':
+                    template = ChatPromptTemplate.from_template(text)
+                else:
+                    template = PromptTemplate.from_template(text)
+                if entry.get('partial_variables'):
+                    template = template.partial(**entry['partial_variables'])
+                template.metadata = {'prompt_name': name, 'prompt_version': version}
+                self._compiled[(name, version)] = template
+            return self._compiled[(name, version)]
+
+    def validate(self):
+        """
+        Compile every version of every prompt and compare its variables with the manifest.
+        returns: List of problems, empty when all templates are valid
+        """
+        problems = []
+        for name in self.names():
+            expected = set(self._manifest[name].get('input_variables', []))
+            for version in self.versions(name):
+                try:
+                    found = set(self.get(name, version).input_variables)
+                except Exception as error:
+                    problems.append(f"{name} v{version}: {type(error).__name__}: {error}")
+                    continue
+                if version == self._manifest[name]['version'] and found != expected:
+                    problems.append(f"{name} v{version}: variables {sorted(found)}, expected {sorted(expected)}")
+        return problems
+
+    def register(self, name, text, kind='chat', **fields):
+        """
+        Add a template as the new version of a prompt and pin it in the manifest, unless it equals the pinned
+        version.
+        name: Name of the prompt
+        text: Source of the template
+        kind: 'chat' for a ChatPromptTemplate, 'text' for a PromptTemplate
+        fields: Other fields of the manifest entry, e.g. hub or partial_variables
+        returns: The pinned version
+        """
+        with self._lock:
+            entry = self._manifest.get(name)
+            if entry is not None and self.text(name) == text and entry.get('kind') == kind:
+                return entry['version']
+            os.makedirs(os.path.join(self.path, name), exist_ok=True)
+            existing = self.versions(name)
+            version = str(int(existing[-1]) + 1) if existing else '1'
+            with open(os.path.join(self.path, name, f'v{version}.txt'), 'w', encoding='utf-8', newline='') as f:
+                f.write(text)
+            template = PromptTemplate.from_template(text)
+            partials = fields.get('partial_variables') or (entry or {}).get('partial_variables') or {}
+            self._manifest[name] = {**(entry or {}), **fields, 'version': version, 'kind': kind,
+                                    'input_variables': sorted(set(template.input_variables) - set(partials))}
+            temporary_path = os.path.join(self.path, f'{MANIFEST_NAME}.{os.getpid()}.tmp')
+            with open(temporary_path, 'w', encoding='utf-8') as f:
+                json.dump(self._manifest, f, indent=2, sort_keys=True)
+                f.write('\n')
+            os.replace(temporary_path, os.path.join(self.path, MANIFEST_NAME))
+            return version
+
+    def sync(self, names=None):
+        """
+        Pull the prompts that have a hub repo from LangChain Hub once, and register the ones that changed as a
+        new version. Needs network access and langchainhub, loading prompts never does.
+        names: Names of the prompts to sync, by default all prompts with a hub repo
+        returns: Dictionary of name to pinned version
+        """
+        from langchain import hub
+
+        versions = {}
+        for name in names or [name for name in self.names() if self._manifest[name].get('hub')]:
+            entry = self._manifest[name]
+            prompt = hub.pull(entry['hub'])
+            if isinstance(prompt, ChatPromptTemplate):
+                if len(prompt.messages) != 1:
+                    raise ValueError(f"Prompt {entry['hub']} has {len(prompt.messages)} messages, only single "
+                                     f"message prompts can be stored as text")
+                text, kind = prompt.messages[0].prompt.template, 'chat'
+            else:
+                text, kind = prompt.template, 'text'
+            versions[name] = self.register(name, text, kind=kind, hub=entry['hub'],
+                                           partial_variables=dict(prompt.partial_variables))
+        return versions
+
+
+def load_prompt_registry(path=DEFAULT_PROMPTS_DIR):
+    """
+    Load a prompt registry once per process, later calls return the same object.
+    path: Folder of the registry
+    """
+    key = os.path.abspath(path)
+    with _lock:
+        if key not in _registries:
+            _registries[key] = PromptRegistry(path)
+        return _registries[key]
+
+
+def get_prompt(name, version=None):
+    """
+    Compiled template of a prompt in the default registry.
+    name: Name of the prompt
+    version: Version to load, by default the version pinned in the manifest
+    """
+    return load_prompt_registry().get(name, version)
+
+
+if __name__ == "__main__":
+    # Pull the prompts that come from LangChain Hub again before checking the registry
+    sync = False
+
+    registry = load_prompt_registry()
+    if sync:
+        print(registry.sync())
+    problems = registry.validate()
+    for name in registry.names():
+        prompt = registry.get(name)
+        print(f"{name}: v{prompt.metadata['prompt_version']} of {len(registry.versions(name))}, variables "
+              f"{prompt.input_variables}")
+    print('\n'.join(problems) if problems else "All prompts are valid")
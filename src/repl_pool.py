@@ -0,0 +1,322 @@
+import re
+import ast
+import time
+import zlib
+import threading
+import traceback
+import multiprocessing
+from io import StringIO
+from contextlib import redirect_stdout, redirect_stderr
+from typing import Any
+from langchain_core.runnables.config import run_in_executor
+from langchain_core.tools import BaseTool
+
+try:
+    import resource
+except ImportError:
+    # Windows has no resource limits, only the time limit applies there
+    resource = None
+
+
+def sanitize_input(query):
+    """
+    Remove the backticks, whitespace and 'python' an LLM puts around code.
+    query: Code written by the LLM
+    """
+    query = re.sub(r"^(\s|`)*(?i:python)?\s*", "", query)
+    return re.sub(r"(\s|`)*$", "", query)
+
+
+def compact(text, max_chars):
+    """
+    Shorten a long output to its start and end, so a large print does not flood the context of the agent.
+    text: Output of a snippet
+    max_chars: Maximum number of characters, no limit when None
+    """
+    if max_chars is None or len(text) <= max_chars:
+        return text
+    half = max_chars // 2
+    return f"{text[:half]}\n... [{len(text) - 2 * half} characters truncated] ...\n{text[-half:]}"
+
+
+def execute(code, namespace):
+    """
+    Execute a snippet like a REPL: everything it prints is returned, followed by the value of the last
+    statement when that is an expression that is not None. Errors are returned as text.
+    code: Python source
+    namespace: Dictionary of the global variables of the session, updated in place
+    """
+    output = StringIO()
+    try:
+        with redirect_stdout(output), redirect_stderr(output):
+            tree = ast.parse(code)
+            last = tree.body.pop() if tree.body and isinstance(tree.body[-1], ast.Expr) else None
+            exec(compile(tree, '<agent>', 'exec'), namespace)
+            if last is not None:
+                value = eval(compile(ast.Expression(last.value), '<agent>', 'eval'), namespace)
+                if value is not None:
+                    print(repr(value))
+    except (Exception, SystemExit) as error:
+        output.write(f"{type(error).__name__}: {error}")
+    return output.getvalue()
+
+
+def _limit_cpu(cpu_seconds):
+    # RLIMIT_CPU counts the whole life of the process, so the limit of a call is set above the time used so far.
+    # The kernel sends SIGXCPU when it is exceeded, which ends the worker.
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = int(usage.ru_utime + usage.ru_stime) + cpu_seconds
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _worker_main(connection, preload, session_setup, memory_limit_mb):
+    # Runs in the worker process: preload once, then execute snippets until the pool closes the pipe
+    start_time = time.perf_counter()
+    base = {'__name__': '__main__', '__builtins__': __builtins__}
+    try:
+        if preload:
+            exec(preload, base)
+    except BaseException:
+        connection.send(('failed', traceback.format_exc()))
+        return
+    if resource is not None and memory_limit_mb:
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    connection.send(('ready', time.perf_counter() - start_time))
+
+    sessions = {}
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+        command, session_id, code, cpu_seconds, max_output_chars = message
+        if command == 'reset':
+            sessions.pop(session_id, None)
+            connection.send(('ok', ''))
+            continue
+        if session_id not in sessions:
+            namespace = dict(base)
+            if session_setup:
+                exec(session_setup, namespace)
+            sessions[session_id] = namespace
+        if resource is not None and cpu_seconds:
+            _limit_cpu(cpu_seconds)
+        connection.send(('ok', compact(execute(code, sessions[session_id]), max_output_chars)))
+
+
+class _Worker:
+    """
+    One worker process of a pool and the pipe to it.
+    """
+
+    def __init__(self, context, arguments):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_connection, *arguments), daemon=True)
+        self.spawned = time.perf_counter()
+        self.process.start()
+        child_connection.close()
+        self.ready = False
+
+    def wait_ready(self, timeout=None):
+        """
+        Block until the preload is done.
+        timeout: Seconds to wait, forever when None
+        returns: Seconds from the start of the process until it was ready
+        """
+        if not self.ready:
+            if not self.connection.poll(timeout):
+                raise TimeoutError(f"REPL worker was not ready within {timeout} seconds")
+            try:
+                status, value = self.connection.recv()
+            except EOFError:
+                raise RuntimeError(f"REPL worker exited with code {self.process.exitcode} while preloading")
+            if status == 'failed':
+                raise RuntimeError(f"Preload of the REPL worker failed:\n{value}")
+            self.ready = True
+            return time.perf_counter() - self.spawned
+        return 0.0
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+
+class ReplWorkerPool:
+    """
+    Pool of warm Python worker processes that execute the code of agents outside the agent's own process.
+    Every worker runs the preload code once, e.g. heavy imports or loading a dataset, and keeps a namespace
+    per session on top of it, so variables survive between the tool calls of one agent. A session always
+    runs on the same worker, sessions on different workers run in parallel. Every call has a wall-clock
+    timeout and, on POSIX, a CPU time limit and a cap on the address space of the worker. A worker that
+    exceeds a limit or crashes is replaced by a fresh one, which loses the sessions it held.
+    The worker processes are forked from a server that imported the preload modules, where available, so a
+    replacement starts warm. This server is shared by all pools of a program, the preload modules of the
+    first pool apply to all of them. The workers import the script that creates the pool, which needs an
+    `if __name__ == "__main__":` guard.
+    """
+
+    def __init__(self, n_workers=4, preload='', session_setup='', preload_modules=(), timeout=30,
+                 cpu_seconds=None, memory_limit_mb=4096, max_output_chars=2000, startup_timeout=300):
+        """
+        n_workers: Number of worker processes
+        preload: Python source executed once per worker, its variables are visible to every session
+        session_setup: Python source executed at the start of every session, e.g. to copy mutable data
+        preload_modules: Module names imported by the fork server, e.g. ['pandas']
+        timeout: Seconds a call may take before its worker is killed
+        cpu_seconds: CPU seconds a call may use, defaults to the timeout
+        memory_limit_mb: Maximum address space of a worker in MB, no limit when None
+        max_output_chars: Outputs longer than this are shortened to their start and end
+        startup_timeout: Seconds a worker may take to run the preload
+        """
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            self._context = multiprocessing.get_context('forkserver')
+            if preload_modules:
+                self._context.set_forkserver_preload(list(preload_modules))
+        else:
+            self._context = multiprocessing.get_context('spawn')
+        self._arguments = (preload, session_setup, memory_limit_mb)
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds if cpu_seconds is not None else int(timeout) + 1
+        self.max_output_chars = max_output_chars
+        self.startup_timeout = startup_timeout
+        self.metrics = []
+        self.startups = []
+        self.restarts = 0
+        self._workers = [_Worker(self._context, self._arguments) for _ in range(n_workers)]
+        # One lock per slot, kept when the worker in the slot is replaced
+        self._locks = [threading.Lock() for _ in range(n_workers)]
+        for worker in self._workers:
+            self.startups.append(worker.wait_ready(startup_timeout))
+
+    def _worker_of(self, session_id):
+        return zlib.crc32(session_id.encode('utf-8')) % len(self._workers)
+
+    def _replace(self, index):
+        # Called with the lock of the slot held
+        self._workers[index].kill()
+        self._workers[index] = _Worker(self._context, self._arguments)
+        self.restarts += 1
+
+    def run(self, code, session_id='default'):
+        """
+        Execute code in the namespace of a session.
+        code: Python source
+        session_id: Name of the session, e.g. one per agent run
+        returns: The printed output and the value of the last expression, or the error, as text
+        """
+        index = self._worker_of(session_id)
+        requested = time.perf_counter()
+        with self._locks[index]:
+            worker = self._workers[index]
+            start_time = time.perf_counter()
+            status = 'ok'
+            try:
+                startup = worker.wait_ready(self.startup_timeout)
+                if startup:
+                    self.startups.append(startup)
+                start_time = time.perf_counter()
+                worker.connection.send(('run', session_id, code, self.cpu_seconds, self.max_output_chars))
+                if worker.connection.poll(self.timeout):
+                    _, output = worker.connection.recv()
+                else:
+                    status = 'timeout'
+                    output = (f"TimeoutError: the code did not finish within {self.timeout} seconds and was "
+                              f"stopped, variables defined before were lost")
+            except (RuntimeError, TimeoutError) as error:
+                status = 'crashed'
+                output = f"RuntimeError: the interpreter could not be started, {error}"
+            except (EOFError, OSError):
+                status = 'crashed'
+                worker.process.join(timeout=1)
+                output = (f"RuntimeError: the interpreter stopped while running the code (exit code "
+                          f"{worker.process.exitcode}), e.g. on the CPU or memory limit, variables defined before "
+                          f"were lost")
+            if status != 'ok':
+                self._replace(index)
+            self.metrics.append({'session_id': session_id, 'worker': index, 'status': status,
+                                 'queue_time': start_time - requested, 'seconds': time.perf_counter() - start_time,
+                                 'output_chars': len(output)})
+            return output
+
+    def reset(self, session_id='default'):
+        """
+        Drop the variables of a session.
+        """
+        index = self._worker_of(session_id)
+        with self._locks[index]:
+            worker = self._workers[index]
+            try:
+                worker.wait_ready(self.startup_timeout)
+                worker.connection.send(('reset', session_id, None, None, None))
+                if worker.connection.poll(self.timeout):
+                    worker.connection.recv()
+                    return
+            except (RuntimeError, TimeoutError, EOFError, OSError):
+                pass
+            # A worker that does not answer is replaced, which drops the session as well
+            self._replace(index)
+
+    def summary(self):
+        """
+        Number of calls per status, execution time percentiles, mean queue time and worker start times.
+        """
+        seconds = sorted(metric['seconds'] for metric in self.metrics)
+        summary = {'calls': len(self.metrics), 'restarts': self.restarts}
+        for metric in self.metrics:
+            summary[metric['status']] = summary.get(metric['status'], 0) + 1
+        if seconds:
+            summary['p50_seconds'] = seconds[len(seconds) // 2]
+            summary['p95_seconds'] = seconds[min(len(seconds) - 1, int(0.95 * len(seconds)))]
+            summary['mean_queue_time'] = sum(metric['queue_time'] for metric in self.metrics) / len(self.metrics)
+        if self.startups:
+            summary['mean_startup'] = sum(self.startups) / len(self.startups)
+        return summary
+
+    def close(self):
+        for worker in self._workers:
+            try:
+                worker.connection.send(None)
+            except OSError:
+                pass
+            worker.process.join(timeout=1)
+            if worker.process.is_alive():
+                worker.process.kill()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ReplPoolTool(BaseTool):
+    """
+    Python REPL tool of an agent that runs the code in a session of a ReplWorkerPool. It replaces
+    PythonAstREPLTool, under the same name, or PythonREPLTool.
+    """
+
+    name: str = "python_repl_ast"
+    description: str = (
+        "A Python shell. Use this to execute python commands. "
+        "Input should be a valid python command. "
+        "When using this tool, sometimes output is abbreviated - "
+        "make sure it does not look abbreviated before using it in your answer."
+    )
+    pool: Any
+    session_id: str = 'default'
+    sanitize_input: bool = True
+
+    def _run(self, query, run_manager=None):
+        if self.sanitize_input:
+            query = sanitize_input(query)
+        return self.pool.run(query, self.session_id)
+
+    async def _arun(self, query, run_manager=None):
+        return await run_in_executor(None, self._run, query)
@@ -0,0 +1,99 @@
+import os
+import threading
+from collections import OrderedDict
+from langchain_community.vectorstores import FAISS
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.pydantic_v1 import Field
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+from embedding_cache import model_name_of
+from mmap_store import is_mmap_store, load_mmap_store
+from mmr import faiss_mmr_search
+
+# Process wide caches: loaded vector stores, query vectors and retrieval results
+_lock = threading.Lock()
+_vector_stores = {}
+_query_vectors = OrderedDict()
+_results = OrderedDict()
+
+# Maximum number of memoized query vectors and retrieval results, the least recently used are dropped first
+MAX_QUERY_VECTORS = 4096
+MAX_RESULTS = 4096
+
+
+def load_vector_store(path, embeddings):
+    """
+    Load a FAISS vector store from disk once per process, later calls return the same object. Stores saved
+    in the memory-mapped format are memory-mapped, others are read with FAISS.load_local.
+    path: Folder of the vector store
+    embeddings: Embeddings used for queries against the vector store
+    """
+    key = os.path.abspath(path)
+    with _lock:
+        if key not in _vector_stores and is_mmap_store(path):
+            _vector_stores[key] = load_mmap_store(path, embeddings)
+        elif key not in _vector_stores:
+            _vector_stores[key] = FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+        return _vector_stores[key]
+
+
+def embed_queries(embeddings, queries):
+    """
+    Embed queries with a single call for all queries that have not been embedded with the same model in this
+    process yet: embed_queries of a CachedEmbeddings, else embed_documents.
+    embeddings: Embeddings object
+    queries: List of query strings
+    """
+    model = model_name_of(embeddings)
+    found = {}
+    with _lock:
+        for query in queries:
+            if (model, query) in _query_vectors:
+                _query_vectors.move_to_end((model, query))
+                found[query] = _query_vectors[(model, query)]
+    missing = list(dict.fromkeys(query for query in queries if query not in found))
+    if missing:
+        vectors = getattr(embeddings, 'embed_queries', embeddings.embed_documents)(missing)
+        with _lock:
+            for query, vector in zip(missing, vectors):
+                found[query] = vector
+                _query_vectors[(model, query)] = vector
+            while len(_query_vectors) > MAX_QUERY_VECTORS:
+                _query_vectors.popitem(last=False)
+    return [found[query] for query in queries]
+
+
+class MemoizedRetriever(BaseRetriever):
+    """
+    Retriever on a vector store that embeds queries through embed_queries and memoizes its results per
+    (query, search type, search kwargs), so equal queries are only embedded and searched once per process.
+    """
+
+    vectorstore: VectorStore
+    search_type: str = 'similarity'
+    search_kwargs: dict = Field(default_factory=dict)
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query, *, run_manager: CallbackManagerForRetrieverRun):
+        # The key holds the vector store itself, not its id, which can be reused by a later store
+        key = (self.vectorstore, query, self.search_type, tuple(sorted(self.search_kwargs.items())))
+        with _lock:
+            if key in _results:
+                _results.move_to_end(key)
+                return list(_results[key])
+
+        embedding = embed_queries(self.vectorstore.embeddings, [query])[0]
+        if self.search_type == 'mmr':
+            documents = faiss_mmr_search(self.vectorstore, [embedding], **self.search_kwargs)[0]
+        elif self.search_type == 'similarity':
+            documents = self.vectorstore.similarity_search_by_vector(embedding, **self.search_kwargs)
+        else:
+            raise ValueError(f"search_type of {self.search_type} not allowed.")
+
+        with _lock:
+            _results[key] = documents
+            while len(_results) > MAX_RESULTS:
+                _results.popitem(last=False)
+        return list(documents)
@@ -0,0 +1,365 @@
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import sqlite3
+from langchain_core.language_models import LLM, BaseLanguageModel
+from langchain_core.prompts import BasePromptTemplate
+from langchain_core.runnables import Runnable
+
+# Default location of the progress database, shared by all scripts regardless of the working directory
+DEFAULT_PROGRESS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'vector_stores',
+                                     'progress.sqlite')
+
+
+class RateLimitError(Exception):
+    """
+    HTTP 429 of a model endpoint, raised by FakeRateLimitedLLM.
+    """
+
+    status_code = 429
+
+
+def status_code_of(error):
+    """
+    HTTP status code of an error raised by a model client, None when unknown.
+    error: Exception
+    """
+    status_code = getattr(error, 'status_code', None)
+    if status_code is None:
+        status_code = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status_code if isinstance(status_code, int) else None
+
+
+def is_rate_limited(error):
+    """
+    Bool whether an error is a rate limit response, e.g. openai.RateLimitError.
+    error: Exception
+    """
+    return status_code_of(error) == 429 or 'RateLimit' in type(error).__name__
+
+
+def is_retryable(error):
+    """
+    Bool whether a call may succeed when retried: rate limits, server errors, timeouts and connection errors.
+    error: Exception
+    """
+    if is_rate_limited(error):
+        return True
+    status_code = status_code_of(error)
+    if status_code is not None:
+        return status_code >= 500 or status_code == 408
+    return (isinstance(error, (TimeoutError, ConnectionError, asyncio.TimeoutError))
+            or any(name in type(error).__name__ for name in ('Timeout', 'Connection')))
+
+
+def retry_after(error):
+    """
+    Seconds to wait according to the Retry-After header of the response of an error, None when absent.
+    error: Exception
+    """
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_tokens(value):
+    """
+    Rough number of tokens of an input, about four characters per token.
+    value: Input of a runnable
+    """
+    return len(value if isinstance(value, str) else json.dumps(value, default=str)) // 4
+
+
+def runnable_fingerprint(runnable):
+    """
+    Stable description of what a runnable does: the templates of its prompts, the parameters of its models,
+    e.g. the model name and temperature, and the types of its other steps.
+    runnable: Runnable, e.g. an LCEL chain
+    """
+    parts = []
+    for node in runnable.get_graph().nodes.values():
+        if isinstance(node.data, BasePromptTemplate):
+            parts.append(node.data.pretty_repr())
+        elif isinstance(node.data, BaseLanguageModel):
+            parameters = json.dumps(node.data._identifying_params, sort_keys=True, default=str)
+            parts.append(f"{type(node.data).__name__} {parameters}")
+        elif isinstance(node.data, Runnable):
+            parts.append(type(node.data).__name__)
+    return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+def input_key(value, fingerprint=''):
+    """
+    Stable key of an input, used to recognize finished work when a job is resumed.
+    value: JSON serializable input of a runnable
+    fingerprint: Fingerprint of the runnable, so outputs of a changed prompt or model are not reused
+    """
+    return hashlib.sha256(json.dumps([fingerprint, value], sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class ProgressStore:
+    """
+    Outputs of finished work items in SQLite, committed one by one, so an interrupted job can be resumed
+    without redoing them. Outputs must be JSON serializable, like the strings of a StrOutputParser.
+    """
+
+    def __init__(self, path=DEFAULT_PROGRESS_PATH, job='default'):
+        """
+        path: Location of the SQLite database
+        job: Name of the job, several jobs can share one database
+        """
+        self.job = job
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS progress (job TEXT NOT NULL, key TEXT NOT NULL, output TEXT NOT NULL, "
+            "PRIMARY KEY (job, key))"
+        )
+        self._connection.commit()
+
+    def load(self, keys):
+        """
+        Outputs of the finished keys.
+        keys: List of keys
+        returns: Dictionary of key to output
+        """
+        found = {}
+        wanted = set(keys)
+        for key, output in self._connection.execute("SELECT key, output FROM progress WHERE job = ?", (self.job,)):
+            if key in wanted:
+                found[key] = json.loads(output)
+        return found
+
+    def save(self, key, output):
+        self._connection.execute("INSERT OR REPLACE INTO progress (job, key, output) VALUES (?, ?, ?)",
+                                 (self.job, key, json.dumps(output)))
+        self._connection.commit()
+
+    def clear(self):
+        self._connection.execute("DELETE FROM progress WHERE job = ?", (self.job,))
+        self._connection.commit()
+
+
+class AdaptiveScheduler:
+    """
+    Runs a runnable over many inputs with a concurrency limit that adapts to the endpoint (AIMD): the limit
+    grows by one per window of successful calls and is halved on a rate limit response or when the latency
+    exceeds the target. Failed calls are retried with exponential backoff and full jitter, honouring
+    Retry-After. The largest inputs are started first, so a long call does not end up in the tail of the job.
+    With a progress store every output is persisted as soon as it arrives and skipped when the job reruns.
+    """
+
+    def __init__(self, min_concurrency=1, max_concurrency=16, initial_concurrency=4, target_latency=None,
+                 max_retries=6, base_delay=1.0, max_delay=60.0, progress=None):
+        """
+        min_concurrency: Lower bound of the concurrency limit
+        max_concurrency: Upper bound of the concurrency limit
+        initial_concurrency: Concurrency limit at the start
+        target_latency: Seconds per call above which the limit is decreased, by default three times the
+        lowest latency observed
+        max_retries: Number of retries per input before its error is given up on
+        base_delay: Seconds of the first backoff
+        max_delay: Maximum seconds of a backoff
+        progress: ProgressStore to resume from and persist to, no persistence when None
+        """
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.initial_concurrency = initial_concurrency
+        self.target_latency = target_latency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.progress = progress
+        self.concurrency = float(initial_concurrency)
+        self.stats = {}
+
+    def _on_success(self, latency):
+        self.stats['latencies'].append(latency)
+        self._lowest_latency = min(self._lowest_latency, latency)
+        target = self.target_latency or 3 * self._lowest_latency
+        if latency > target:
+            self._decrease()
+        else:
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+
+    def _decrease(self):
+        # At most one decrease per window of calls, the calls in flight saw the same congestion
+        if time.perf_counter() >= self._hold_until:
+            self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+            self._hold_until = time.perf_counter() + (self.stats['latencies'][-1] if self.stats['latencies']
+                                                      else self.base_delay)
+
+    async def _call(self, runnable, value, config, condition):
+        for attempt in range(self.max_retries + 1):
+            async with condition:
+                await condition.wait_for(lambda: self._in_flight < int(self.concurrency))
+                self._in_flight += 1
+            start_time = time.perf_counter()
+            try:
+                output = await runnable.ainvoke(value, config)
+                self._on_success(time.perf_counter() - start_time)
+                return output
+            except Exception as error:
+                if not is_retryable(error) or attempt == self.max_retries:
+                    raise
+                if is_rate_limited(error):
+                    self.stats['rate_limited'] += 1
+                    self._decrease()
+                self.stats['retries'] += 1
+                delay = retry_after(error)
+                if delay is None:
+                    delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+            finally:
+                async with condition:
+                    self._in_flight -= 1
+                    condition.notify_all()
+            await asyncio.sleep(delay)
+
+    async def arun(self, runnable, inputs, config=None, keys=None, size=estimate_tokens, return_exceptions=False):
+        """
+        Invoke a runnable on every input.
+        runnable: Runnable, e.g. an LCEL chain
+        inputs: List of inputs
+        config: Optional RunnableConfig passed to every call
+        keys: Optional list with a unique key per input for the progress store, by default the input. Keys are
+        hashed together with the fingerprint of the runnable, so a changed prompt or model starts over
+        size: Function that estimates the size of an input, larger inputs are started first
+        return_exceptions: Bool to return the error of a failed input as its output, instead of raising the
+        first error once all other inputs are done
+        returns: List with the output of every input, in input order
+        """
+        inputs = list(inputs)
+        fingerprint = runnable_fingerprint(runnable)
+        keys = [input_key(key, fingerprint) for key in (keys if keys is not None else inputs)]
+        outputs = self.progress.load(keys) if self.progress is not None else {}
+        self.concurrency = float(self.initial_concurrency)
+        self.stats = {'skipped': sum(key in outputs for key in set(keys)), 'completed': 0, 'failed': 0,
+                      'retries': 0, 'rate_limited': 0, 'latencies': []}
+        self._in_flight = 0
+        self._lowest_latency = float('inf')
+        self._hold_until = 0.0
+
+        # Every key only once, sorted so that popping from the end starts the largest inputs first
+        todo = {}
+        for key, value in zip(keys, inputs):
+            if key not in outputs:
+                todo.setdefault(key, value)
+        queue = sorted(todo, key=lambda key: size(todo[key]))
+        condition = asyncio.Condition()
+        errors = {}
+
+        async def worker():
+            while queue:
+                key = queue.pop()
+                try:
+                    output = await self._call(runnable, todo[key], config, condition)
+                except Exception as error:
+                    self.stats['failed'] += 1
+                    errors[key] = error
+                    continue
+                outputs[key] = output
+                self.stats['completed'] += 1
+                if self.progress is not None:
+                    self.progress.save(key, output)
+
+        start_time = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(min(self.max_concurrency, len(queue)))])
+        self.stats['elapsed'] = time.perf_counter() - start_time
+        self.stats['final_concurrency'] = self.concurrency
+
+        if errors and not return_exceptions:
+            raise next(iter(errors.values()))
+        return [outputs[key] if key in outputs else errors[key] for key in keys]
+
+    def run(self, runnable, inputs, **kwargs):
+        """
+        Blocking version of arun, for scripts. Inside a running event loop, e.g. in Jupyter, use arun instead.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.arun(runnable, inputs, **kwargs))
+        raise RuntimeError("AdaptiveScheduler.run cannot be called from a running event loop, use "
+                           "'await scheduler.arun(...)' instead")
+
+    def summary(self):
+        """
+        Counters of the last run and its latency percentiles.
+        """
+        latencies = sorted(self.stats.get('latencies', []))
+        summary = {key: value for key, value in self.stats.items() if key != 'latencies'}
+        if latencies:
+            summary['p50_latency'] = latencies[len(latencies) // 2]
+            summary['p95_latency'] = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+        return summary
+
+
+class FakeRateLimitedLLM(LLM):
+    """
+    Local stand-in for a rate limited endpoint, for testing the scheduler. The latency grows with the number
+    of concurrent calls above the capacity, calls beyond the rate limit get a RateLimitError, and a fraction
+    of the calls fails with a TimeoutError.
+    """
+
+    latency: float = 0.1
+    capacity: int = 8
+    rate_limit: int = 12
+    error_rate: float = 0.0
+    in_flight: int = 0
+    calls: int = 0
+
+    @property
+    def _llm_type(self):
+        return 'fake-rate-limited'
+
+    def _start(self):
+        # Latency of a new call, or a RateLimitError when too many calls are in flight
+        self.calls += 1
+        if self.in_flight >= self.rate_limit:
+            raise RateLimitError("Rate limit reached")
+        self.in_flight += 1
+        return self.latency * max(1.0, self.in_flight / self.capacity)
+
+    def _finish(self, prompt):
+        if random.random() < self.error_rate:
+            raise TimeoutError("Request timed out")
+        return f"Summary of: {prompt[:40]}"
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        latency = self._start()
+        try:
+            time.sleep(latency)
+            return self._finish(prompt)
+        finally:
+            self.in_flight -= 1
+
+    async def _acall(self, prompt, stop=None, run_manager=None, **kwargs):
+        latency = self._start()
+        try:
+            await asyncio.sleep(latency)
+            return self._finish(prompt)
+        finally:
+            self.in_flight -= 1
+
+
+if __name__ == "__main__":
+    from langchain_core.output_parsers import StrOutputParser
+    from langchain_core.prompts import PromptTemplate
+
+    # Summarize generated elements with the fake endpoint; rerun to see the finished items being skipped
+    n_elements = 1000
+    random.seed(0)
+    elements = [f"Element {i}: " + "lorem ipsum " * random.randint(10, 500) for i in range(n_elements)]
+    chain = PromptTemplate.from_template("Summarize: {element}") | FakeRateLimitedLLM(error_rate=0.02) \
+        | StrOutputParser()
+
+    scheduler = AdaptiveScheduler(max_concurrency=32, base_delay=0.1, max_delay=2.0,
+                                  progress=ProgressStore(job='scheduler_demo'))
+    summaries = scheduler.run(chain, [{'element': element} for element in elements])
+    print(scheduler.summary())
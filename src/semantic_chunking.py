@@ -0,0 +1,104 @@
+import re
+import numpy as np
+from langchain_core.documents import Document
+
+
+def split_sentences(text):
+    """
+    Split text into sentences on '.', '?' and '!' followed by whitespace, like SemanticChunker.
+    text: String to split
+    """
+    return re.split(r"(?<=[.?!])\s+", text)
+
+
+def combine_sentences(sentences, buffer_size=1):
+    """
+    Combine every sentence with buffer_size sentences before and after it, the texts that get embedded.
+    sentences: List of sentences of one document
+    buffer_size: Number of neighbouring sentences on each side
+    """
+    return [" ".join(sentences[max(0, i - buffer_size):i + buffer_size + 1]) for i in range(len(sentences))]
+
+
+class FastSemanticChunker:
+    """
+    Semantic chunker that gives the same chunks as langchain_experimental's SemanticChunker with the
+    percentile threshold, but embeds the sentences of all documents in one batched call and computes the
+    breakpoints with NumPy. The sentence embeddings are reused to give every chunk an embedding, so the
+    chunks can be indexed without a second embedding pass.
+    """
+
+    def __init__(self, embeddings, buffer_size=1, breakpoint_percentile=95):
+        """
+        embeddings: Embeddings used for the sentences, preferably a batched local model
+        buffer_size: Number of neighbouring sentences embedded with every sentence
+        breakpoint_percentile: Percentile of the distances above which a document is split
+        """
+        self.embeddings = embeddings
+        self.buffer_size = buffer_size
+        self.breakpoint_percentile = breakpoint_percentile
+
+    def split_with_embeddings(self, texts):
+        """
+        Split texts into chunks and compute an embedding per chunk: the normalized mean of the embeddings
+        of its sentences. This approximates, but is not identical to, embedding the chunk text itself.
+        texts: List of strings
+        returns: List of chunks per text and a list of arrays with the chunk embeddings per text
+        """
+        sentences = [split_sentences(text) for text in texts]
+        combined = [combine_sentences(s, self.buffer_size) for s in sentences]
+
+        # One batched embedding call for the sentences of all documents
+        vectors = np.asarray(self.embeddings.embed_documents([c for cs in combined for c in cs]), dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        offsets = np.cumsum([0] + [len(s) for s in sentences])
+
+        all_chunks = []
+        all_embeddings = []
+        for document_sentences, start, end in zip(sentences, offsets[:-1], offsets[1:]):
+            document_vectors = vectors[start:end]
+            if len(document_sentences) == 1:
+                breakpoints = np.array([], dtype=int)
+            else:
+                # Cosine distance between consecutive sentences, for the whole document at once
+                distances = 1 - np.sum(document_vectors[:-1] * document_vectors[1:], axis=1)
+                threshold = np.percentile(distances, self.breakpoint_percentile)
+                breakpoints = np.flatnonzero(distances > threshold)
+
+            bounds = list(zip(np.concatenate([[0], breakpoints + 1]), np.concatenate([breakpoints + 1,
+                                                                                     [len(document_sentences)]])))
+            chunks = [" ".join(document_sentences[a:b]) for a, b in bounds if a < b]
+            chunk_embeddings = np.array([document_vectors[a:b].mean(axis=0) for a, b in bounds if a < b],
+                                        dtype=np.float32)
+            chunk_embeddings /= np.maximum(np.linalg.norm(chunk_embeddings, axis=1, keepdims=True), 1e-12)
+            all_chunks.append(chunks)
+            all_embeddings.append(chunk_embeddings)
+        return all_chunks, all_embeddings
+
+    def split_text(self, text):
+        return self.split_with_embeddings([text])[0][0]
+
+    def create_documents(self, texts, metadatas=None):
+        """
+        Counterpart of SemanticChunker.create_documents.
+        texts: List of strings
+        metadatas: Optional list with the metadata of every text
+        """
+        documents, _ = self.create_documents_with_embeddings(texts, metadatas)
+        return documents
+
+    def create_documents_with_embeddings(self, texts, metadatas=None):
+        """
+        Split texts into Documents and return the chunk embeddings as well, ready for FAISS.from_embeddings.
+        texts: List of strings
+        metadatas: Optional list with the metadata of every text
+        returns: List of Documents and a list with the embedding of every Document
+        """
+        metadatas = metadatas or [{} for _ in texts]
+        chunks, embeddings = self.split_with_embeddings(texts)
+        documents = []
+        vectors = []
+        for text_chunks, text_embeddings, metadata in zip(chunks, embeddings, metadatas):
+            documents += [Document(page_content=chunk, metadata=dict(metadata)) for chunk in text_chunks]
+            vectors += text_embeddings.tolist()
+        return documents, vectors
@@ -0,0 +1,361 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from langchain_community.utilities.sql_database import SQLDatabase, truncate_word
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import QueuePool
+
+# Statements whose results may be cached, they do not change the database
+CACHEABLE = re.compile(r"^\s*(select|with|explain)\b", re.IGNORECASE)
+
+# Quoted strings and identifiers, which are kept as they are when SQL is normalized
+QUOTED = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`|\[[^\]]*\])")
+
+# Statements the guarded database runs
+READ_ONLY = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+
+# Tables, and their aliases, in FROM and JOIN clauses
+TABLE_REFERENCE = re.compile(r"\b(?:from|join)\s+[\"`\[]?(\w+)[\"`\]]?(?:\s+(?:as\s+)?(\w+))?", re.IGNORECASE)
+
+# Words that can follow a table name but are not an alias
+NOT_ALIASES = {'where', 'join', 'inner', 'left', 'right', 'full', 'cross', 'natural', 'outer', 'on', 'using',
+               'group', 'order', 'limit', 'having', 'union', 'intersect', 'except', 'window', 'as'}
+
+# Aggregating queries return a bounded number of rows, even when they scan a large table
+AGGREGATE = re.compile(r"\b(count|sum|avg|min|max|total|group_concat)\s*\(|\bgroup\s+by\b", re.IGNORECASE)
+
+# Rough number of characters per token of query results
+CHARS_PER_TOKEN = 4
+
+
+def normalize_sql(sql):
+    """
+    Normalized form of a query, used as cache key: whitespace collapsed, keywords and names lowercased and
+    trailing semicolons removed, leaving quoted strings and identifiers as they are.
+    sql: SQL query
+    """
+    parts = QUOTED.split(sql.strip().rstrip(';').strip())
+    return ''.join(part if i % 2 else re.sub(r"\s+", " ", part).lower() for i, part in enumerate(parts)).strip()
+
+
+class CachedSQLDatabase(SQLDatabase):
+    """
+    SQLDatabase for agents that call the same tools many times. The table info of every table, including its
+    sample rows, is computed once at startup, the results of read-only queries are kept in a bounded LRU
+    cache keyed by the normalized SQL, and both are invalidated when the database file changes. Use
+    from_sqlite for a pool of read-only connections. The latency of every run is recorded in timings.
+    """
+
+    def __init__(self, engine, path=None, max_cached_results=1024, **kwargs):
+        """
+        engine: SQLAlchemy engine
+        path: Database file whose modification time invalidates the caches, by default the file of the engine
+        max_cached_results: Maximum number of query results kept in the cache
+        kwargs: Passed to SQLDatabase
+        """
+        self._path = path or engine.url.database
+        self._max_cached_results = max_cached_results
+        self._init_kwargs = kwargs
+        self._lock = threading.RLock()
+        self._results = OrderedDict()
+        self.timings = []
+        self.cache_hits = 0
+        self.cache_misses = 0
+        super().__init__(engine, **kwargs)
+        self._load_schema()
+
+    @classmethod
+    def from_sqlite(cls, path, pool_size=4, **kwargs):
+        """
+        Open a SQLite database file with a pool of read-only connections, shared by the threads of the agent.
+        path: Location of the database file
+        pool_size: Number of pooled connections
+        kwargs: Passed to CachedSQLDatabase
+        """
+        path = os.path.abspath(path)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Database {path} not found")
+        engine = create_engine('sqlite://', poolclass=QueuePool, pool_size=pool_size, max_overflow=0,
+                               creator=lambda: sqlite3.connect(f'file:{path}?mode=ro', uri=True,
+                                                               check_same_thread=False))
+        return cls(engine, path=path, **kwargs)
+
+    def _signature(self):
+        # Writes in WAL mode only touch the -wal file until a checkpoint
+        if not self._path or self._path == ':memory:':
+            return None
+        signature = []
+        for path in (self._path, f'{self._path}-wal'):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def _load_schema(self):
+        self._loaded_signature = self._signature()
+        self._table_names = list(super().get_usable_table_names())
+        self._table_info = {name: super(CachedSQLDatabase, self).get_table_info([name])
+                            for name in self._table_names}
+        self._results.clear()
+
+    def _refresh(self):
+        """
+        Reload the schema and drop the cached results when the database file changed since they were loaded.
+        """
+        signature = self._signature()
+        if signature != self._loaded_signature:
+            with self._lock:
+                if signature != self._loaded_signature:
+                    del self._table_names
+                    SQLDatabase.__init__(self, self._engine, **self._init_kwargs)
+                    self._load_schema()
+
+    def get_usable_table_names(self):
+        if not hasattr(self, '_table_names'):
+            # Called by SQLDatabase.__init__ before the schema is (re)loaded
+            return super().get_usable_table_names()
+        self._refresh()
+        return list(self._table_names)
+
+    def get_table_info(self, table_names=None):
+        self._refresh()
+        if table_names is None:
+            table_names = self._table_names
+        missing_tables = set(table_names).difference(self._table_names)
+        if missing_tables:
+            raise ValueError(f"table_names {missing_tables} not found in database")
+        # Sorted like SQLDatabase does
+        return "\n\n".join(sorted(self._table_info[name] for name in set(table_names) if self._table_info[name]))
+
+    def run(self, command, fetch="all", include_columns=False, *, parameters=None, execution_options=None):
+        if fetch == "cursor" or not isinstance(command, str) or not CACHEABLE.match(command):
+            return self._timed(command, False, lambda: self._run_uncached(command, fetch, include_columns,
+                                                                          parameters, execution_options))
+
+        self._refresh()
+        key = (normalize_sql(command), fetch, include_columns, json.dumps(parameters, sort_keys=True, default=str))
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                self.cache_hits += 1
+                result = self._results[key]
+                return self._timed(command, True, lambda: result)
+        self.cache_misses += 1
+        result = self._timed(command, False, lambda: self._run_uncached(command, fetch, include_columns,
+                                                                        parameters, execution_options))
+        with self._lock:
+            self._results[key] = result
+            while len(self._results) > self._max_cached_results:
+                self._results.popitem(last=False)
+        return result
+
+    def _run_uncached(self, command, fetch, include_columns, parameters, execution_options):
+        return super().run(command, fetch, include_columns, parameters=parameters,
+                           execution_options=execution_options)
+
+    def _timed(self, command, cached, function):
+        start_time = time.perf_counter()
+        result = function()
+        self.timings.append({'sql': str(command), 'cached': cached, 'seconds': time.perf_counter() - start_time})
+        return result
+
+    def stats(self):
+        """
+        Cache counters and query latency of this process.
+        """
+        total = self.cache_hits + self.cache_misses
+        seconds = [timing['seconds'] for timing in self.timings if not timing['cached']]
+        return {'queries': len(self.timings), 'cache_hits': self.cache_hits, 'cache_misses': self.cache_misses,
+                'hit_rate': self.cache_hits / total if total else 0.0,
+                'database_seconds': sum(seconds)}
+
+
+class QueryRejectedError(ValueError):
+    """
+    Query that the guarded database refuses to run, the message tells the agent how to fix it.
+    """
+
+
+def strip_quoted(sql):
+    """
+    SQL with the contents of quoted strings and identifiers removed, so keywords can be searched safely.
+    sql: SQL query
+    """
+    return QUOTED.sub("''", sql)
+
+
+def has_top_level_limit(sql):
+    """
+    Bool whether a query ends with a LIMIT clause outside of any subquery.
+    sql: SQL query
+    """
+    sql = strip_quoted(sql)
+    while True:
+        reduced = re.sub(r"\([^()]*\)", " ", sql)
+        if reduced == sql:
+            break
+        sql = reduced
+    return re.search(r"\blimit\s+\S+", sql, re.IGNORECASE) is not None
+
+
+class GuardedSQLDatabase(CachedSQLDatabase):
+    """
+    CachedSQLDatabase that bounds the cost of agent generated SQL, in database time and in prompt size. Only
+    single SELECT statements are run. EXPLAIN QUERY PLAN is checked before execution, and a query that fully
+    scans a large table without a LIMIT gets a LIMIT injected, or is rejected unless it aggregates. Results are
+    streamed from the cursor, and reading stops at max_rows rows or when the result text exceeds the token
+    budget, with a note telling the agent the result was truncated.
+    """
+
+    def __init__(self, engine, max_rows=100, max_result_tokens=2000, large_table_rows=1000, on_full_scan='limit',
+                 **kwargs):
+        """
+        engine: SQLAlchemy engine
+        max_rows: Maximum number of rows returned per query
+        max_result_tokens: Maximum number of tokens of the result text of a query
+        large_table_rows: Tables with more rows than this count as large
+        on_full_scan: 'limit' to inject a LIMIT, 'reject' to refuse the query unless it aggregates
+        kwargs: Passed to CachedSQLDatabase
+        """
+        if on_full_scan not in ('limit', 'reject'):
+            raise ValueError(f"on_full_scan of {on_full_scan} not allowed, choose from 'limit' and 'reject'")
+        self.max_rows = max_rows
+        self.max_result_tokens = max_result_tokens
+        self.large_table_rows = large_table_rows
+        self.on_full_scan = on_full_scan
+        self.guard_counts = {'rejected': 0, 'limited': 0, 'truncated': 0}
+        super().__init__(engine, **kwargs)
+
+    def _load_schema(self):
+        super()._load_schema()
+        self._checked = OrderedDict()
+        # Row counts per table, reloaded together with the schema when the file changes
+        with self._engine.connect() as connection:
+            self._row_counts = {name: connection.execute(text(f'SELECT COUNT(*) FROM "{name}"')).scalar()
+                                for name in self._table_names}
+
+    def full_scans(self, sql, parameters=None):
+        """
+        Large tables that a query scans completely, according to EXPLAIN QUERY PLAN.
+        sql: SQL query
+        parameters: Optional query parameters
+        returns: List of table names
+        """
+        tables = {name.lower(): name for name in self._table_names}
+        aliases = dict(tables)
+        for table, alias in TABLE_REFERENCE.findall(strip_quoted(sql)):
+            if table.lower() in tables and alias and alias.lower() not in NOT_ALIASES:
+                aliases[alias.lower()] = tables[table.lower()]
+
+        with self._engine.connect() as connection:
+            plan = connection.execute(text(f"EXPLAIN QUERY PLAN {sql}"), parameters or {}).fetchall()
+        scanned = []
+        for row in plan:
+            match = re.match(r"SCAN (?:TABLE )?(\w+)", row[-1])
+            table = aliases.get(match.group(1).lower()) if match else None
+            if table and self._row_counts.get(table, 0) > self.large_table_rows and table not in scanned:
+                scanned.append(table)
+        return scanned
+
+    def check_query(self, sql, parameters=None):
+        """
+        Validate a query and rewrite it when needed.
+        sql: SQL query
+        parameters: Optional query parameters
+        returns: The query to run
+        """
+        sql = sql.strip().rstrip(';').strip()
+        if not READ_ONLY.match(sql) or ';' in strip_quoted(sql):
+            self.guard_counts['rejected'] += 1
+            raise QueryRejectedError("Only single SELECT statements are allowed.")
+        if has_top_level_limit(sql):
+            return sql
+        scanned = self.full_scans(sql, parameters)
+        if not scanned:
+            return sql
+        if self.on_full_scan == 'reject' and not AGGREGATE.search(strip_quoted(sql)):
+            self.guard_counts['rejected'] += 1
+            raise QueryRejectedError(f"The query scans the large table(s) {', '.join(scanned)} completely. "
+                                     f"Filter on an indexed column, aggregate, or add a LIMIT of at most "
+                                     f"{self.max_rows}.")
+        # One row more than is returned, so the truncation note tells the agent there are more rows
+        self.guard_counts['limited'] += 1
+        return f"{sql}\nLIMIT {self.max_rows + 1}"
+
+    def run(self, command, fetch="all", include_columns=False, *, parameters=None, execution_options=None):
+        if isinstance(command, str):
+            # The checked form of a query is cached with the schema, in an LRU as large as the one of the results,
+            # so repeated queries skip EXPLAIN
+            key = (normalize_sql(command), json.dumps(parameters, sort_keys=True, default=str))
+            self._refresh()
+            with self._lock:
+                checked = self._checked
+                if key in checked:
+                    checked.move_to_end(key)
+                checked_command = checked.get(key)
+            if checked_command is None:
+                # A reload of the schema in the meantime replaces the dictionary, dropping this entry with it
+                checked_command = self.check_query(command, parameters)
+                with self._lock:
+                    checked[key] = checked_command
+                    while len(checked) > self._max_cached_results:
+                        checked.popitem(last=False)
+            command = checked_command
+        return super().run(command, fetch, include_columns, parameters=parameters,
+                           execution_options=execution_options)
+
+    def run_no_throw(self, command, fetch="all", include_columns=False, *, parameters=None,
+                     execution_options=None):
+        try:
+            return super().run_no_throw(command, fetch, include_columns, parameters=parameters,
+                                        execution_options=execution_options)
+        except QueryRejectedError as e:
+            return f"Error: {e}"
+
+    def _run_uncached(self, command, fetch, include_columns, parameters, execution_options):
+        if fetch == "cursor" or not isinstance(command, str):
+            return super()._run_uncached(command, fetch, include_columns, parameters, execution_options)
+
+        # Same text as SQLDatabase.run, built row by row from the cursor until a limit is reached
+        max_rows = 1 if fetch == "one" else self.max_rows
+        budget = self.max_result_tokens * CHARS_PER_TOKEN
+        parts = []
+        length = 2
+        truncated = False
+        with self._engine.connect() as connection:
+            result = connection.execution_options(**(execution_options or {})).execute(text(command),
+                                                                                      parameters or {})
+            columns = list(result.keys())
+            while not truncated and (rows := result.fetchmany(min(max_rows, 64))):
+                for row in rows:
+                    if len(parts) == max_rows:
+                        truncated = fetch != "one"
+                        break
+                    values = [truncate_word(value, length=self._max_string_length) for value in row]
+                    part = repr(dict(zip(columns, values)) if include_columns else tuple(values))
+                    if parts and length + len(part) + 2 > budget:
+                        truncated = True
+                        break
+                    parts.append(part)
+                    length += len(part) + 2
+                if fetch == "one":
+                    break
+            result.close()
+
+        if not parts:
+            return ""
+        output = f"[{', '.join(parts)}]"
+        if truncated:
+            self.guard_counts['truncated'] += 1
+            output += (f"\n-- Result truncated to the first {len(parts)} rows. Refine the query with a filter, "
+                       f"an aggregate or a LIMIT to see the rest.")
+        return output
+
+    def stats(self):
+        return {**super().stats(), **self.guard_counts}
@@ -3,11 +3,15 @@ import openai
 from dotenv import load_dotenv
 from langchain.chains import LLMSummarizationCheckerChain
 from langchain_openai import OpenAI
+from llm_cache import enable_llm_cache
 
 # Load the .env file
 load_dotenv()
 openai.api_key = os.environ["OPENAI_API_KEY"]
 
+# Cache the responses on disk, so reruns do not call the model again
+llm_cache = enable_llm_cache()
+
 # Summarization checker chain
 llm = OpenAI(model='gpt-3.5-turbo-instruct', temperature=0)
 checker_chain = LLMSummarizationCheckerChain.from_llm(llm, verbose=True, max_checks=2)
@@ -21,3 +25,4 @@ These discoveries can spark a child's imagination about the infinite wonders of
 result = checker_chain.invoke(text)
 
 print(result)
+print(llm_cache.stats())
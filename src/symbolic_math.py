@@ -3,11 +3,15 @@ import openai
 from dotenv import load_dotenv
 from langchain_experimental.llm_symbolic_math.base import LLMSymbolicMathChain
 from langchain_openai import OpenAI
+from llm_cache import enable_llm_cache
 
 # Load the .env file
 load_dotenv()
 openai.api_key = os.environ["OPENAI_API_KEY"]
 
+# Cache the responses on disk, so reruns do not call the model again
+llm_cache = enable_llm_cache()
+
 # Create LLMSymbolicMathChain base on SymPy
 llm = OpenAI(model='gpt-3.5-turbo-instruct', temperature=0)
 llm_symbolic_math = LLMSymbolicMathChain.from_llm(llm)
@@ -15,6 +19,7 @@ llm_symbolic_math = LLMSymbolicMathChain.from_llm(llm)
 # Integrals and derivatives
 result = llm_symbolic_math.invoke("What is the derivative of sin(x)*exp(x) with respect to x?")
 print(result['answer'])
+print(llm_cache.stats())
 
 # Solving equations
 # llm_symbolic_math.invoke("What are the solutions to this equation y^3 + 1/3y?")
@@ -1,32 +1,30 @@
 import time
-from transformers import AutoTokenizer, AutoModelForSequenceClassification, pipeline
+import random
+from zero_shot_classifier import ZeroShotClassifier, benchmark
 
 # bart-large-mnli -- 'facebook/bart-large-mnli': 407M params
 # 'MoritzLaurer/mDeBERTa-v3-base-mnli-xnli': 279M params
 
 
-def load_model(model_name='facebook/bart-large-mnli'):
+def load_model(model_name='facebook/bart-large-mnli', quantize=False):
     """
-    Function to load the model.
+    Function to load the model, once, as a reusable classifier.
     """
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
-    model = AutoModelForSequenceClassification.from_pretrained(model_name)
-    return tokenizer, model
+    return ZeroShotClassifier(model_name, quantize=quantize)
 
 
-def classify_text(input_str, candidate_labels, tokenizer, model):
+def classify_text(input_str, candidate_labels, classifier):
     """
-    Function to classify text.
+    Function to classify text, a single string or a batch of strings.
     """
-    classifier = pipeline("zero-shot-classification", model=model, tokenizer=tokenizer)
     start_time = time.time()
-    outputs = classifier(input_str, candidate_labels)
+    outputs = classifier.classify(input_str, candidate_labels)
     end_time = time.time()
     return outputs, end_time - start_time
 
 
 # Load the model
-tokenizer, model = load_model()
+classifier = load_model()
 
 # Classify text
 input_str = """
@@ -50,8 +48,28 @@ candidate_labels = ['What is the delivery date?',
                     'What is the delivery address?',
                     'I have a complaint.']
 
-output_str, inference_time = classify_text(input_str, candidate_labels, tokenizer, model)
+output_str, inference_time = classify_text(input_str, candidate_labels, classifier)
 for l, s in list(zip(output_str['labels'], output_str['scores'])):
     print(l, round(s, 2))
 
 print(f"Inference time: {round(inference_time, 1)} seconds")
+
+# Throughput benchmark on generated support emails, for both models with and without int8 quantization
+run_benchmark = False
+n_emails = 64
+
+if run_benchmark:
+    random.seed(0)
+    questions = ["When will I receive my parcel?", "Which carrier delivers my order?",
+                 "Please update the delivery address to Kerkstraat 12.", "My package arrived damaged.",
+                 "Can you confirm the name on the order?", "Ik wil een klacht indienen over de bezorging."]
+    emails = [f"Subject: Order {random.randint(100000, 999999)}\n\nDear sir/madam,\n\n"
+              f"{' '.join(random.choices(questions, k=random.randint(1, 4)))}\n\nKind regards,\n\nCustomer {i}"
+              for i in range(n_emails)]
+
+    for model_name in ['facebook/bart-large-mnli', 'MoritzLaurer/mDeBERTa-v3-base-mnli-xnli']:
+        for quantize in [False, True]:
+            for result in benchmark(load_model(model_name, quantize), emails, candidate_labels):
+                print(f"{result['model']}{' int8' if quantize else ''}, batch size {result['batch_size']}: "
+                      f"{result['emails_per_sec']:.1f} emails/sec, "
+                      f"p50 {result['p50_latency']:.2f} s, p95 {result['p95_latency']:.2f} s")
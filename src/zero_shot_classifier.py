@@ -0,0 +1,216 @@
+import os
+import time
+import numpy as np
+import torch
+from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+
+class ZeroShotClassifier:
+    """
+    Reusable NLI zero-shot classifier that gives the same scores as the transformers zero-shot-classification
+    pipeline. The model is loaded once, the hypothesis of every label is tokenized once and cached, every text
+    is tokenized once for all labels, and the text x label pairs are sorted by length and padded per batch.
+    """
+
+    def __init__(self, model_name='facebook/bart-large-mnli', hypothesis_template='This example is {}.',
+                 quantize=False, num_threads=None, max_batch_tokens=16_384, max_batch_size=64, max_length=None):
+        """
+        model_name: NLI model, e.g. 'facebook/bart-large-mnli' or 'MoritzLaurer/mDeBERTa-v3-base-mnli-xnli'
+        hypothesis_template: Template that turns a label into a hypothesis
+        quantize: Bool to run the linear layers with int8 weights
+        num_threads: Number of CPU threads used for inference
+        max_batch_tokens: Maximum of batch size times padded length per forward pass
+        max_batch_size: Maximum number of text x label pairs per forward pass
+        max_length: Pairs are truncated to this number of tokens, cutting the text; by default the maximum length
+        of the tokenizer, as in the pipeline, capped at the positions of the model
+        """
+        self.model_name = model_name
+        self.hypothesis_template = hypothesis_template
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        if num_threads:
+            torch.set_num_threads(num_threads)
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModelForSequenceClassification.from_pretrained(model_name).eval()
+        if quantize:
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model
+        positions = getattr(model.config, 'max_position_embeddings', None) or self.tokenizer.model_max_length
+        self.max_length = max_length or min(self.tokenizer.model_max_length, positions)
+
+        label2id = {label.lower(): i for label, i in model.config.label2id.items()}
+        self.entailment_id = next(i for label, i in label2id.items() if label.startswith('entail'))
+        self.contradiction_id = next(i for label, i in label2id.items() if label.startswith('contra'))
+        self.use_token_type_ids = 'token_type_ids' in self.tokenizer.model_input_names
+        self.n_special_tokens = self.tokenizer.num_special_tokens_to_add(pair=True)
+        self._hypotheses = {}
+
+    def hypothesis_ids(self, label):
+        """
+        Token ids of the hypothesis of a label, cached.
+        label: Candidate label
+        """
+        if label not in self._hypotheses:
+            self._hypotheses[label] = self.tokenizer(self.hypothesis_template.format(label),
+                                                     add_special_tokens=False)['input_ids']
+        return self._hypotheses[label]
+
+    def _pair(self, premise_ids, hypothesis_ids):
+        premise_ids = premise_ids[:max(0, self.max_length - self.n_special_tokens - len(hypothesis_ids))]
+        pair = {'input_ids': self.tokenizer.build_inputs_with_special_tokens(premise_ids, hypothesis_ids)}
+        if self.use_token_type_ids:
+            pair['token_type_ids'] = self.tokenizer.create_token_type_ids_from_sequences(premise_ids, hypothesis_ids)
+        return pair
+
+    def _batches(self, pairs):
+        # Sorted by length, so the current pair sets the padded length of the batch
+        order = sorted(range(len(pairs)), key=lambda i: len(pairs[i]['input_ids']))
+        batch = []
+        for position in order:
+            if batch and ((len(batch) + 1) * len(pairs[position]['input_ids']) > self.max_batch_tokens
+                          or len(batch) == self.max_batch_size):
+                yield batch
+                batch = []
+            batch.append(position)
+        if batch:
+            yield batch
+
+    def _pair_logits(self, pairs):
+        logits = np.zeros((len(pairs), self.model.config.num_labels), dtype=np.float32)
+        with torch.inference_mode():
+            for batch in self._batches(pairs):
+                encoding = self.tokenizer.pad([pairs[i] for i in batch], return_tensors='pt')
+                logits[batch] = self.model(**encoding).logits.float().numpy()
+        return logits
+
+    def logits(self, texts, labels):
+        """
+        NLI logits of every text x label pair.
+        texts: List of strings
+        labels: List of candidate labels, or a list with the candidate labels of every text, all of equal length
+        returns: Array of shape (len(texts), n_labels, n_classes)
+        """
+        premises = self.tokenizer(list(texts), add_special_tokens=False)['input_ids']
+        text_labels = labels if labels and isinstance(labels[0], (list, tuple)) else [labels] * len(premises)
+        n_labels = len(text_labels[0]) if text_labels else 0
+        pairs = [self._pair(premise, self.hypothesis_ids(label))
+                 for premise, candidates in zip(premises, text_labels) for label in candidates]
+        return self._pair_logits(pairs).reshape(len(premises), n_labels, -1)
+
+    def _scores(self, logits, multi_label):
+        if multi_label or logits.shape[1] == 1:
+            pair_logits = logits[:, :, [self.contradiction_id, self.entailment_id]]
+            pair_logits = np.exp(pair_logits - pair_logits.max(axis=2, keepdims=True))
+            return pair_logits[:, :, 1] / pair_logits.sum(axis=2)
+        entailment = logits[:, :, self.entailment_id]
+        entailment = np.exp(entailment - entailment.max(axis=1, keepdims=True))
+        return entailment / entailment.sum(axis=1, keepdims=True)
+
+    @staticmethod
+    def _outputs(texts, text_labels, scores):
+        outputs = []
+        for text, labels, text_scores in zip(texts, text_labels, scores):
+            order = np.argsort(-text_scores, kind='stable')
+            outputs.append({'sequence': text,
+                            'labels': [labels[i] for i in order],
+                            'scores': [float(text_scores[i]) for i in order]})
+        return outputs
+
+    def classify(self, texts, candidate_labels, multi_label=False):
+        """
+        Classify a batch of texts, with the output format of the zero-shot-classification pipeline.
+        texts: String or list of strings
+        candidate_labels: List of candidate labels
+        multi_label: Bool to score every label independently instead of normalizing over the labels
+        """
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        if not texts:
+            return []
+        scores = self._scores(self.logits(texts, candidate_labels), multi_label)
+        outputs = self._outputs(texts, [candidate_labels] * len(texts), scores)
+        return outputs[0] if single else outputs
+
+    def classify_cascade(self, texts, label_index, top_n=10, multi_label=False):
+        """
+        Two-stage classification for large label sets: the label index selects the top_n most similar labels
+        of every text, and only those text x label pairs go through the NLI model. The cost is top_n instead
+        of len(labels) pairs per text. Scores are normalized over the selected labels, and only those labels
+        are returned.
+        texts: String or list of strings
+        label_index: LabelIndex with the candidate labels
+        top_n: Number of labels per text that are scored by the NLI model
+        multi_label: Bool to score every label independently instead of normalizing over the labels
+        """
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        if not texts:
+            return []
+        text_labels = label_index.top_labels(texts, top_n)
+        scores = self._scores(self.logits(texts, text_labels), multi_label)
+        outputs = self._outputs(texts, text_labels, scores)
+        return outputs[0] if single else outputs
+
+
+class LabelIndex:
+    """
+    Precomputed embeddings of a set of candidate labels, the cheap first stage of cascaded zero-shot
+    classification: texts are embedded in one batched call and matched to all labels with a single matrix
+    product.
+    """
+
+    def __init__(self, labels, embeddings):
+        """
+        labels: List of candidate labels
+        embeddings: Embeddings used for labels and texts, preferably a batched local model like LocalEmbeddings
+        """
+        self.labels = list(labels)
+        self.embeddings = embeddings
+        self.vectors = self._embed(self.labels)
+
+    def _embed(self, texts):
+        vectors = np.asarray(self.embeddings.embed_documents(list(texts)), dtype=np.float32)
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    def top_labels(self, texts, n):
+        """
+        The n labels most similar to every text, by cosine similarity.
+        texts: List of strings
+        n: Number of labels per text
+        returns: List with a list of labels per text, most similar first
+        """
+        n = min(n, len(self.labels))
+        similarities = self._embed(texts) @ self.vectors.T
+        top = np.argpartition(-similarities, n - 1, axis=1)[:, :n]
+        top = np.take_along_axis(top, np.argsort(-np.take_along_axis(similarities, top, axis=1), axis=1), axis=1)
+        return [[self.labels[i] for i in row] for row in top]
+
+
+def benchmark(classifier, texts, candidate_labels, batch_sizes=(1, 4, 16, 64)):
+    """
+    Throughput and latency of a classifier per batch size.
+    classifier: ZeroShotClassifier
+    texts: List of texts to classify, e.g. emails
+    candidate_labels: List of candidate labels
+    batch_sizes: Number of texts per classify call
+    returns: List with a dictionary of results per batch size
+    """
+    # Warm up, the first call includes one-off allocations
+    classifier.classify(texts[:1], candidate_labels)
+
+    results = []
+    for batch_size in batch_sizes:
+        latencies = []
+        start_time = time.perf_counter()
+        for start in range(0, len(texts), batch_size):
+            batch_start = time.perf_counter()
+            classifier.classify(texts[start:start + batch_size], candidate_labels)
+            latencies.append(time.perf_counter() - batch_start)
+        elapsed = time.perf_counter() - start_time
+        results.append({'model': os.path.basename(classifier.model_name),
+                        'batch_size': batch_size,
+                        'emails_per_sec': len(texts) / elapsed,
+                        'p50_latency': float(np.percentile(latencies, 50)),
+                        'p95_latency': float(np.percentile(latencies, 95))})
+    return results